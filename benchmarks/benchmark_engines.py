@@ -0,0 +1,241 @@
+"""
+Throughput and latency benchmarks for the execution engines.
+
+Every engine runs every case in a fresh Python process, against a local synthetic
+producer, so that the peak RSS of one run does not leak into the next one.
+
+Usage:
+    python benchmarks/benchmark_engines.py [--engines linux,crossplatform,async]
+        [--cases bulk,interleaved,trickle,utf8,roundtrip] [--size-mb 20]
+        [--rounds 20] [--json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+ENGINES = ["linux", "crossplatform", "async"]
+CASES = ["bulk", "interleaved", "trickle", "utf8", "roundtrip"]
+
+# Prompt printed by the round-trip producer, answered by the benchmark
+PROMPT = "ready>"
+
+# Synthetic producers, formatted with the size in bytes and the number of rounds
+PRODUCERS = {
+    # One large burst on stdout
+    "bulk": (
+        "import sys\n"
+        "line = b'x' * 1023 + b'\\n'\n"
+        "for _ in range({size} // 1024):\n"
+        "    sys.stdout.buffer.write(line)\n"
+    ),
+    # Alternating stdout and stderr lines
+    "interleaved": (
+        "import sys\n"
+        "line = b'y' * 255 + b'\\n'\n"
+        "for index in range({size} // 256):\n"
+        "    stream = sys.stdout if index % 2 else sys.stderr\n"
+        "    stream.buffer.write(line)\n"
+        "    stream.flush()\n"
+    ),
+    # A few lines, slowly
+    "trickle": (
+        "import sys, time\n"
+        "for index in range(50):\n"
+        "    print('tick', index, flush=True)\n"
+        "    time.sleep(0.01)\n"
+    ),
+    # Multi-byte characters, so reads split characters
+    "utf8": (
+        "import sys\n"
+        "line = ('héllo wörld ✓ 日本語 ' * 20 + '\\n').encode()\n"
+        "for _ in range({size} // len(line)):\n"
+        "    sys.stdout.buffer.write(line)\n"
+    ),
+    # Prompts that wait for an answer on stdin
+    "roundtrip": (
+        "import sys\n"
+        "for _ in range({rounds}):\n"
+        "    print('" + PROMPT + "', flush=True)\n"
+        "    sys.stdin.readline()\n"
+    ),
+}
+
+
+def producer_command(case: str, size: int, rounds: int) -> str:
+    """Return the shell command line running the producer of a case."""
+    script = PRODUCERS[case].format(size=size, rounds=rounds)
+    return subprocess.list2cmdline([sys.executable, "-c", script])
+
+
+def iter_events(engine: str, command_line: str):
+    """Yield (time, event) for each event of the command, run by the engine."""
+    if engine == "async":
+        yield from _iter_async_events(command_line)
+        return
+
+    from autogpt_interactive_shell_commands_plugin.interactive_shell_commands import (
+        InteractiveShellCommands,
+    )
+
+    is_commands = InteractiveShellCommands(default_timeout_seconds=600)
+    if engine == "linux":
+        events = is_commands.iter_interactive_shell_linux(command_line)
+    else:
+        events = is_commands.iter_interactive_shell_crossplatform(command_line)
+    for event in events:
+        yield time.perf_counter(), event
+
+
+def _iter_async_events(command_line: str):
+    from autogpt_interactive_shell_commands_plugin.async_interactive_shell_commands import (  # noqa: E501
+        AsyncInteractiveShellCommands,
+    )
+
+    is_commands = AsyncInteractiveShellCommands(default_timeout_seconds=600)
+    loop = asyncio.new_event_loop()
+    events = is_commands.iter_interactive_shell_async(command_line)
+    try:
+        while True:
+            try:
+                event = loop.run_until_complete(events.__anext__())
+            except StopAsyncIteration:
+                return
+            yield time.perf_counter(), event
+    finally:
+        loop.run_until_complete(events.aclose())
+        loop.close()
+
+
+def run_case(engine: str, case: str, size: int, rounds: int) -> dict:
+    """Run one case with one engine, in this process, and return its measurements."""
+    import resource
+
+    command_line = producer_command(case, size, rounds)
+    answer_fd = None
+    if case == "roundtrip":
+        stdin_fd, answer_fd = os.pipe()
+        stdin = open(stdin_fd, "rb")
+    else:
+        stdin = open(os.devnull, "rb")
+
+    first_event = None
+    answered_at = None
+    round_trips = []
+    events = 0
+    started = time.perf_counter()
+    with stdin, patch("sys.stdin", stdin):
+        for timestamp, event in iter_events(engine, command_line):
+            events += 1
+            if first_event is None:
+                first_event = timestamp
+            if answer_fd is not None and PROMPT in event["content"]:
+                if answered_at is not None:
+                    round_trips.append(timestamp - answered_at)
+                answered_at = time.perf_counter()
+                os.write(answer_fd, b"answer\n")
+    elapsed = time.perf_counter() - started
+    if answer_fd is not None:
+        os.close(answer_fd)
+
+    # ru_maxrss is in kilobytes on Linux, and in bytes on MacOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        peak_rss *= 1024
+
+    produced = size if case in ("bulk", "interleaved", "utf8") else 0
+    return {
+        "engine": engine,
+        "case": case,
+        "events": events,
+        "seconds": round(elapsed, 4),
+        "mb_per_s": round(produced / elapsed / 1e6, 2) if produced else None,
+        "first_event_ms": (
+            round((first_event - started) * 1000, 2) if first_event else None
+        ),
+        "round_trip_ms": (
+            round(sum(round_trips) / len(round_trips) * 1000, 2)
+            if round_trips
+            else None
+        ),
+        "peak_rss_mb": round(peak_rss / 1e6, 1),
+    }
+
+
+def run_isolated(engine: str, case: str, size: int, rounds: int) -> dict:
+    """Run one case with one engine in a fresh Python process."""
+    result = subprocess.run(
+        [
+            sys.executable,
+            __file__,
+            "--child",
+            f"--engines={engine}",
+            f"--cases={case}",
+            f"--size-mb={size / 1e6}",
+            f"--rounds={rounds}",
+        ],
+        check=True,
+        stdout=subprocess.PIPE,
+    )
+    return json.loads(result.stdout)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--engines", default=",".join(ENGINES))
+    parser.add_argument("--cases", default=",".join(CASES))
+    parser.add_argument("--size-mb", type=float, default=20)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--json", action="store_true", help="print JSON lines")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    size = int(args.size_mb * 1e6)
+
+    if args.child:
+        # The engines mirror the output to the terminal: send it to /dev/null, and
+        # keep the real stdout for the result
+        result_stream = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+        devnull = open(os.devnull, "w")
+        with patch("sys.stdout", devnull), patch("sys.stderr", devnull):
+            result = run_case(args.engines, args.cases, size, args.rounds)
+        result_stream.write(json.dumps(result))
+        result_stream.flush()
+        return
+
+    engines = args.engines.split(",")
+    if sys.platform == "win32":
+        engines = [engine for engine in engines if engine == "crossplatform"]
+
+    columns = [
+        "engine",
+        "case",
+        "events",
+        "seconds",
+        "mb_per_s",
+        "first_event_ms",
+        "round_trip_ms",
+        "peak_rss_mb",
+    ]
+    if not args.json:
+        print(" ".join(f"{column:>14}" for column in columns))
+    for case in args.cases.split(","):
+        for engine in engines:
+            result = run_isolated(engine, case, size, args.rounds)
+            if args.json:
+                print(json.dumps(result), flush=True)
+            else:
+                print(
+                    " ".join(f"{str(result[column]):>14}" for column in columns),
+                    flush=True,
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Spawn latency benchmarks for the spawn backends of the POSIX engine.
+
+Forking gets slower as the parent grows, so every backend runs in a fresh Python
+process that first allocates and touches --ballast-mb of memory, like a large
+Auto-GPT process. Each round starts a command, waits for its EOF and reaps it.
+
+Usage:
+    python benchmarks/benchmark_spawn.py [--backends popen,posix_spawn]
+        [--ballast-mb 1024] [--rounds 200] [--json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+BACKENDS = ["popen", "posix_spawn"]
+
+# A command line the posix_spawn backend executes directly, and the same program
+# behind a shell operator, which it cannot. The program must not be a shell builtin
+# such as true, that would be run by /bin/sh too
+COMMANDS = {"plain": "ls /", "shell": "ls / && true"}
+
+
+def measure(backend: str, ballast_mb: int, rounds: int) -> dict:
+    """Measure the spawn latency of a backend, in this process."""
+    from autogpt_interactive_shell_commands_plugin.engine import (
+        SelectorEngine,
+        ShellProcess,
+    )
+    from autogpt_interactive_shell_commands_plugin.spawn import split_command
+
+    if split_command(COMMANDS["plain"]) is None:
+        sys.exit(f"{COMMANDS['plain']!r} would run with /bin/sh, not directly")
+
+    # Touch every page, so that it is mapped and copied on fork
+    ballast = bytearray(ballast_mb * 1024 * 1024)
+    for offset in range(0, len(ballast), 4096):
+        ballast[offset] = 1
+
+    results = {}
+    with open(os.devnull, "rb") as stdin:
+        sys.stdin = stdin
+        engine = SelectorEngine()
+        for name, command_line in COMMANDS.items():
+            spawn_us, total_us = [], []
+            for _ in range(rounds):
+                started = time.perf_counter()
+                shell = ShellProcess(
+                    engine, command_line, forward_stdin=False, spawn_backend=backend
+                )
+                spawned = time.perf_counter()
+                while not shell.done:
+                    engine.poll(1)
+                shell.wait()
+                done = time.perf_counter()
+                shell.close()
+                spawn_us.append((spawned - started) * 1e6)
+                total_us.append((done - started) * 1e6)
+            results[f"{name}_spawn_us"] = round(statistics.median(spawn_us), 1)
+            results[f"{name}_total_us"] = round(statistics.median(total_us), 1)
+        engine.close()
+    return results
+
+
+def run_isolated(backend: str, ballast_mb: int, rounds: int) -> dict:
+    """Measure the spawn latency of a backend in a fresh Python process."""
+    result = subprocess.run(
+        [
+            sys.executable,
+            __file__,
+            "--child",
+            f"--backends={backend}",
+            f"--ballast-mb={ballast_mb}",
+            f"--rounds={rounds}",
+        ],
+        check=True,
+        stdout=subprocess.PIPE,
+    )
+    return json.loads(result.stdout)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--ballast-mb", type=int, default=1024)
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--json", action="store_true", help="print JSON")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.backends, args.ballast_mb, args.rounds)))
+        return
+
+    results = {
+        backend: run_isolated(backend, args.ballast_mb, args.rounds)
+        for backend in args.backends.split(",")
+    }
+    if args.json:
+        print(json.dumps(results))
+        return
+
+    columns = list(next(iter(results.values())))
+    print(f"Median of {args.rounds} rounds, with {args.ballast_mb} MiB of ballast:")
+    print(f"{'backend':>12}" + "".join(f"{column:>18}" for column in columns))
+    for backend, result in results.items():
+        print(f"{backend:>12}" + "".join(f"{result[c]:>18}" for c in columns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Startup benchmarks for the plugin: import, construction and prompt building.
+
+Agents are often started as many short-lived processes, each paying for the plugin's
+startup, so every run measures it in a fresh Python process.
+
+Usage:
+    python benchmarks/benchmark_startup.py [--runs 20] [--prompts 100] [--json]
+"""
+import argparse
+import contextlib
+import io
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+COLUMNS = ["import_ms", "init_ms", "first_prompt_ms", "prompt_us"]
+
+
+class PromptGenerator:
+    """Just enough of Auto-GPT's PromptGenerator to register commands."""
+
+    def __init__(self) -> None:
+        self.commands = []
+
+    def add_command(self, label, name, args, function) -> None:
+        self.commands.append((label, name, args, function))
+
+
+def measure(prompts: int) -> dict:
+    """Measure the startup of the plugin, in this process."""
+    started = time.perf_counter()
+    from autogpt_interactive_shell_commands_plugin import (
+        AutoGPTInteractiveShellCommandsPlugin,
+    )
+
+    imported = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        plugin = AutoGPTInteractiveShellCommandsPlugin()
+    initialized = time.perf_counter()
+    plugin.post_prompt(PromptGenerator())
+    first_prompt = time.perf_counter()
+    for _ in range(prompts):
+        plugin.post_prompt(PromptGenerator())
+    done = time.perf_counter()
+
+    return {
+        "import_ms": (imported - started) * 1000,
+        "init_ms": (initialized - imported) * 1000,
+        "first_prompt_ms": (first_prompt - initialized) * 1000,
+        "prompt_us": (done - first_prompt) / prompts * 1e6,
+    }
+
+
+def run_isolated(prompts: int) -> dict:
+    """Measure the startup of the plugin in a fresh Python process."""
+    result = subprocess.run(
+        [sys.executable, __file__, "--child", f"--prompts={prompts}"],
+        check=True,
+        stdout=subprocess.PIPE,
+    )
+    return json.loads(result.stdout)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--prompts", type=int, default=100)
+    parser.add_argument("--json", action="store_true", help="print JSON")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.prompts)))
+        return
+
+    runs = [run_isolated(args.prompts) for _ in range(args.runs)]
+    medians = {
+        column: round(statistics.median(run[column] for run in runs), 3)
+        for column in COLUMNS
+    }
+    if args.json:
+        print(json.dumps(medians))
+    else:
+        print(f"Median of {args.runs} runs:")
+        for column in COLUMNS:
+            print(f"{column:>16} {medians[column]:>10}")
+
+
+if __name__ == "__main__":
+    main()
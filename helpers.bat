@@ -9,8 +9,11 @@ if "%1" == "clean" (
 ) else if "%1" == "style" (
   echo Running code formatters...
   call :style
+) else if "%1" == "bench" (
+  echo Running benchmarks...
+  call :bench
 ) else (
-  echo Usage: %0 [clean^|qa^|style]
+  echo Usage: %0 [clean^|qa^|style^|bench]
   exit /b 1
 )
 
@@ -36,6 +39,13 @@ exit /b 0
   echo Done!
   exit /b 0
 
+:bench
+  rem Run the engine and startup benchmarks
+  @python benchmarks\benchmark_engines.py
+  @python benchmarks\benchmark_startup.py
+  echo Done!
+  exit /b 0
+
 :style
   rem Format code
   @isort .
@@ -18,6 +18,13 @@ qa() {
   python run_pylint.py
 }
 
+bench() {
+  # Run the engine, startup and spawn benchmarks
+  python benchmarks/benchmark_engines.py
+  python benchmarks/benchmark_startup.py
+  python benchmarks/benchmark_spawn.py
+}
+
 style() {
   # Format code
   isort .
@@ -33,8 +40,11 @@ elif [ "$1" = "qa" ]; then
 elif [ "$1" = "style" ]; then
   echo Running code formatters...
   style
+elif [ "$1" = "bench" ]; then
+  echo Running benchmarks...
+  bench
 else
-  echo "Usage: $0 [clean|qa|style]"
+  echo "Usage: $0 [clean|qa|style|bench]"
   exit 1
 fi
 
@@ -4,13 +4,21 @@ This plugin allows Auto-GPT to execute interactive shell commands and get feedba
 Build by @lcOrp on github & @lc0rp#0081 on discord
 For help and discussion: https://discord.com/channels/1092243196446249134/1109480174321414214
 """
+import math
 import os
+import sys
 from typing import Any, Dict, List, Optional, Tuple, TypedDict, TypeVar
 
 from auto_gpt_plugin_template import AutoGPTPluginTemplate
 
 PromptGenerator = TypeVar("PromptGenerator")
 
+# Commands of this plugin that change no files, or that keep the result cache up
+# to date themselves; every other command clears the cache before it runs
+_CACHE_SAFE_COMMANDS = frozenset(
+    {"execute_interactive_shell", "ask_user", "read_shell_log", "grep_shell_log"}
+)
+
 
 class Message(TypedDict):
     """Message type."""
@@ -19,6 +27,53 @@ class Message(TypedDict):
     content: str
 
 
+def _env_seconds(name: str, default: float, allow_zero: bool = True) -> float:
+    """Read a number of seconds from the environment, once, and validate it.
+
+    Raises:
+        ValueError: If the value is not a number, or is negative (or zero, when
+            allow_zero is False)
+    """
+    value = os.getenv(name, default)
+    try:
+        seconds = float(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a number of seconds, not {value!r}") from None
+    if seconds < 0 or (seconds == 0 and not allow_zero):
+        raise ValueError(f"{name} must be a positive number of seconds, not {value!r}")
+    # Keep whole numbers as int, for "Timeout after 900 seconds"
+    return int(seconds) if seconds.is_integer() else seconds
+
+
+def _env_int(name: str, default: int, allow_zero: bool = True) -> int:
+    """Read a count or a size from the environment, once, and validate it.
+
+    Raises:
+        ValueError: If the value is not a whole number, or is negative (or zero,
+            when allow_zero is False)
+    """
+    value = os.getenv(name, default)
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a whole number, not {value!r}") from None
+    if number < 0 or (number == 0 and not allow_zero):
+        raise ValueError(f"{name} must be a positive whole number, not {value!r}")
+    return number
+
+
+def _env_flag(name: str, default: bool = False) -> bool:
+    """Read a true/false setting from the environment."""
+    return os.getenv(name, str(default)).lower() in ("true", "1", "yes")
+
+
+def _split_list(value: Optional[str]) -> Optional[List[str]]:
+    """Split a comma-separated setting, None if it is not set."""
+    if not value:
+        return None
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
 class AutoGPTInteractiveShellCommandsPlugin(AutoGPTPluginTemplate):
     """
     Interactive Shell Commands allows Auto-GPT to execute interactive shell commands and get
@@ -29,7 +84,28 @@ class AutoGPTInteractiveShellCommandsPlugin(AutoGPTPluginTemplate):
     
     # Default timeout in seconds (15 minutes)
     _default_timeout_seconds: int = 900
-    
+
+    # Bytes of output kept per role in a conversation (0 = unlimited)
+    _max_capture_bytes: int = 0
+
+    # How output that is not valid UTF-8 is decoded
+    _decode_errors: str = "replace"
+
+    # Seconds without output before a command is stopped (0 = no idle timeout)
+    _idle_timeout_seconds: int = 0
+
+    # Seconds a shell session can stay unused before it is closed (30 minutes)
+    _session_idle_seconds: int = 1800
+
+    # Seconds the results of read-only commands are reused (0 = no caching)
+    _cache_ttl_seconds: int = 0
+
+    # Number of command results kept in the cache
+    _cache_max_entries: int = 128
+
+    # Commands of a batch running at the same time
+    _batch_max_workers: int = 4
+
     def __init__(self):
         """Initialize the plugin."""
         super().__init__()
@@ -42,12 +118,141 @@ class AutoGPTInteractiveShellCommandsPlugin(AutoGPTPluginTemplate):
         )
 
         # Default timeout in seconds (15 minutes)
-        self._default_timeout_seconds = os.getenv("INTERACTIVE_SHELL_DEFAULT_TIMEOUT_SECONDS", self._default_timeout_seconds)
+        self._default_timeout_seconds = _env_seconds(
+            "INTERACTIVE_SHELL_DEFAULT_TIMEOUT_SECONDS",
+            self._default_timeout_seconds,
+            allow_zero=False,
+        )
+
+        # Keep the first and last half of this many bytes per role, drop the middle
+        self._max_capture_bytes = _env_int(
+            "INTERACTIVE_SHELL_MAX_CAPTURE_BYTES", self._max_capture_bytes
+        )
+
+        # Keep the final state of redrawn lines, and collapse repeated lines
+        self._compact_output = _env_flag("INTERACTIVE_SHELL_COMPACT_OUTPUT", True)
+        # Estimated tokens kept per conversation, start and end (0 = unlimited)
+        self._max_output_tokens = _env_int("INTERACTIVE_SHELL_MAX_OUTPUT_TOKENS", 0)
+
+        # Stop commands that go quiet for this long, even before the default timeout
+        self._idle_timeout_seconds = _env_seconds(
+            "INTERACTIVE_SHELL_IDLE_TIMEOUT_SECONDS", self._idle_timeout_seconds
+        )
+
+        # Run at most this many commands of execute_shell_batch at once
+        self._batch_max_workers = _env_int(
+            "INTERACTIVE_SHELL_BATCH_MAX_WORKERS",
+            self._batch_max_workers,
+            allow_zero=False,
+        )
+
+        # Close persistent shell sessions that were not used for this long
+        self._session_idle_seconds = _env_seconds(
+            "INTERACTIVE_SHELL_SESSION_IDLE_SECONDS", self._session_idle_seconds
+        )
+
+        # Reuse the results of read-only commands for this long, 0 to disable
+        self._cache_ttl_seconds = _env_seconds(
+            "INTERACTIVE_SHELL_CACHE_TTL_SECONDS", self._cache_ttl_seconds
+        )
+        self._cache_max_entries = _env_int(
+            "INTERACTIVE_SHELL_CACHE_MAX_ENTRIES",
+            self._cache_max_entries,
+            allow_zero=False,
+        )
+        # Comma-separated glob patterns of the cacheable command lines, and paths
+        # whose modification invalidates the cache, None for the defaults
+        self._cache_patterns = _split_list(
+            os.getenv("INTERACTIVE_SHELL_CACHE_PATTERNS")
+        )
+        self._cache_watch_paths = _split_list(
+            os.getenv("INTERACTIVE_SHELL_CACHE_WATCH_PATHS")
+        )
+        self._result_cache = None
+
+        # JSON file of [{"pattern": ..., "response": ...}] rules answering prompts
+        self._auto_responses_file = os.getenv("INTERACTIVE_SHELL_AUTO_RESPONSES_FILE")
+        self._auto_responder = None
+
+        # Answer the prompts of ask_user that the user already answered
+        self._remember_answers = _env_flag("INTERACTIVE_SHELL_REMEMBER_ANSWERS")
+        # Seconds an answer is remembered (0 = until the end of the run, or forever
+        # with an answers file), "cwd" or "global" scope, and JSON file to keep them
+        self._answer_ttl_seconds = _env_seconds(
+            "INTERACTIVE_SHELL_ANSWER_TTL_SECONDS", 0
+        )
+        self._answer_scope = os.getenv("INTERACTIVE_SHELL_ANSWER_SCOPE", "cwd")
+        self._answers_file = os.getenv("INTERACTIVE_SHELL_ANSWERS_FILE")
+        self._answer_store = None
+
+        # Keep the full raw output of the last N commands, to read or grep it later
+        # (0 = disabled); bytes kept in memory before a log spills to a file in
+        # INTERACTIVE_SHELL_LOG_DIR (the temporary directory by default)
+        self._keep_logs = _env_int("INTERACTIVE_SHELL_KEEP_LOGS", 0)
+        self._log_spill_bytes = _env_int(
+            "INTERACTIVE_SHELL_LOG_SPILL_BYTES", 1024 * 1024
+        )
+        self._log_dir = os.getenv("INTERACTIVE_SHELL_LOG_DIR")
+        self._shell_logs = None
 
-        # Print out a summary of the settings
-        print(f"Interactive Shell Commands Plugin Settings (v {self._version}):")
-        print("=================================================================")
-        print(f" - Default Timeout: {self._default_timeout_seconds} seconds")
+        # RLIMIT caps of every command (0 = inherit the limits of Auto-GPT): address
+        # space and output file size in MiB, CPU seconds and open files
+        self._limit_address_space_mb = _env_int(
+            "INTERACTIVE_SHELL_LIMIT_ADDRESS_SPACE_MB", 0
+        )
+        self._limit_cpu_seconds = _env_seconds("INTERACTIVE_SHELL_LIMIT_CPU_SECONDS", 0)
+        self._limit_open_files = _env_int("INTERACTIVE_SHELL_LIMIT_OPEN_FILES", 0)
+        self._limit_file_size_mb = _env_int("INTERACTIVE_SHELL_LIMIT_FILE_SIZE_MB", 0)
+        self._resource_limits = None
+
+        # "posix_spawn" starts commands without forking Auto-GPT, and without the
+        # shell for plain command lines; "popen" (the default) always uses /bin/sh
+        self._spawn_backend = os.getenv("INTERACTIVE_SHELL_SPAWN_BACKEND", "popen")
+        if self._spawn_backend not in ("popen", "posix_spawn"):
+            raise ValueError(
+                "INTERACTIVE_SHELL_SPAWN_BACKEND must be popen or posix_spawn, "
+                f"not {self._spawn_backend!r}"
+            )
+
+        # Capture the commands without mirroring them to the terminal, for unattended
+        # runs; otherwise the terminal is written from a background thread
+        self._headless = _env_flag("INTERACTIVE_SHELL_HEADLESS")
+
+        # Record the raw streams of every command in this directory, to replay them
+        self._recording_dir = os.getenv("INTERACTIVE_SHELL_RECORDING_DIR") or None
+
+        # Append the metrics of every command to this JSON-lines file, if set
+        self._metrics_file = os.getenv("INTERACTIVE_SHELL_METRICS_FILE")
+        # Add a summary of the metrics to the responses of the shell commands
+        self._metrics_in_response = _env_flag("INTERACTIVE_SHELL_METRICS_IN_RESPONSE")
+        self._metrics_file_sink = None
+        self._last_metrics = None
+
+        # Built on the first post_prompt, then shared by every prompt
+        self._is_commands = None
+
+        # Error handler used when decoding output: replace, ignore, backslashreplace...
+        self._decode_errors = os.getenv(
+            "INTERACTIVE_SHELL_DECODE_ERRORS", self._decode_errors
+        )
+
+        # Print out a summary of the settings, in a single write
+        print(
+            f"Interactive Shell Commands Plugin Settings (v {self._version}):\n"
+            "=================================================================\n"
+            f" - Default Timeout: {self._default_timeout_seconds} seconds\n"
+            f" - Idle Timeout: {self._idle_timeout_seconds or 'none'}\n"
+            f" - Max Capture Bytes: {self._max_capture_bytes or 'unlimited'}\n"
+            f" - Max Output Tokens: {self._max_output_tokens or 'unlimited'}\n"
+            f" - Compact Output: {self._compact_output}\n"
+            f" - Headless: {self._headless}\n"
+            f" - Result Cache TTL: {self._cache_ttl_seconds or 'disabled'}\n"
+            f" - Auto Responses File: {self._auto_responses_file or 'none'}\n"
+            f" - Remember Answers: {self._remember_answers}\n"
+            f" - Kept Shell Logs: {self._keep_logs or 'disabled'}\n"
+            f" - Recording Directory: {self._recording_dir or 'none'}\n"
+            f" - Metrics File: {self._metrics_file or 'none'}"
+        )
 
     def post_prompt(self, prompt: PromptGenerator) -> PromptGenerator:
         """
@@ -60,11 +265,7 @@ class AutoGPTInteractiveShellCommandsPlugin(AutoGPTPluginTemplate):
         Returns:
             PromptGenerator: The prompt generator.
         """
-        from .interactive_shell_commands import InteractiveShellCommands
-
-        is_commands = InteractiveShellCommands(
-            default_timeout_seconds=self._default_timeout_seconds
-        )
+        is_commands = self._get_interactive_shell_commands()
 
         execute_interactive_shell = is_commands.execute_interactive_shell
         ask_user = is_commands.ask_user
@@ -75,6 +276,7 @@ class AutoGPTInteractiveShellCommandsPlugin(AutoGPTPluginTemplate):
             {
                 "command_line": "<command_line>",
                 "timeout_seconds": "<timeout_seconds_optional>",
+                "stdin_data": "<stdin_data_optional>",
             },
             execute_interactive_shell,
         )
@@ -89,8 +291,174 @@ class AutoGPTInteractiveShellCommandsPlugin(AutoGPTPluginTemplate):
             ask_user,
         )
 
+        prompt.add_command(
+            "ask_user_batch",
+            "Ask user several questions at once, with one overall timeout.",
+            {
+                "prompts": "<list: prompts>",
+                "defaults": "<list: default_responses_optional>",
+                "timeout_seconds": "<timeout_seconds_optional>",
+            },
+            is_commands.ask_user_batch,
+        )
+
+        if self._keep_logs:
+            prompt.add_command(
+                "read_shell_log",
+                "Read a page of the full output of a previous command.",
+                {
+                    "log_id": "<log_id>",
+                    "offset": "<offset_bytes_optional>",
+                    "length": "<length_bytes_optional>",
+                },
+                is_commands.read_shell_log,
+            )
+
+            prompt.add_command(
+                "grep_shell_log",
+                "Search the full output of a previous command for a regex.",
+                {
+                    "log_id": "<log_id>",
+                    "pattern": "<regex>",
+                    "max_matches": "<max_matches_optional>",
+                },
+                is_commands.grep_shell_log,
+            )
+
+        if sys.platform != "win32":
+            prompt.add_command(
+                "execute_shell_batch",
+                "Execute independent, non-interactive shell commands concurrently.",
+                {
+                    "command_lines": "<list: command_lines>",
+                    "max_workers": "<max_workers_optional>",
+                    "timeout_seconds": "<timeout_seconds_per_command_optional>",
+                    "overall_timeout_seconds": "<timeout_seconds_optional>",
+                },
+                is_commands.execute_shell_batch,
+            )
+
+            prompt.add_command(
+                "execute_shell_session",
+                "Execute shell command in a persistent, named shell session.",
+                {
+                    "session_name": "<session_name>",
+                    "command_line": "<command_line>",
+                    "timeout_seconds": "<timeout_seconds_optional>",
+                    "input_only": "<true_to_answer_a_running_repl_optional>",
+                },
+                is_commands.execute_in_shell_session,
+            )
+
+            prompt.add_command(
+                "close_shell_session",
+                "Close a persistent shell session.",
+                {"session_name": "<session_name>"},
+                is_commands.close_shell_session,
+            )
+
         return prompt
 
+    def _get_interactive_shell_commands(self):
+        """Return the InteractiveShellCommands shared by every prompt, building it and
+        importing its modules on first use only."""
+        if self._is_commands is not None:
+            return self._is_commands
+
+        from .interactive_shell_commands import InteractiveShellCommands
+
+        if self._cache_ttl_seconds:
+            from .cache import ResultCache
+
+            self._result_cache = ResultCache(
+                self._cache_ttl_seconds,
+                max_entries=self._cache_max_entries,
+                patterns=self._cache_patterns,
+                watch_paths=self._cache_watch_paths,
+            )
+
+        if self._auto_responses_file:
+            from .responder import AutoResponder
+
+            try:
+                self._auto_responder = AutoResponder.from_file(
+                    self._auto_responses_file
+                )
+            except (OSError, ValueError, KeyError, TypeError) as error:
+                # The commands still run, their prompts are asked to the user
+                print(
+                    "Automatic responses disabled, could not load "
+                    f"{self._auto_responses_file}: {error!r}",
+                    file=sys.stderr,
+                )
+
+        if self._remember_answers:
+            from .answers import AnswerStore
+
+            self._answer_store = AnswerStore(
+                self._answer_ttl_seconds, self._answer_scope, self._answers_file
+            )
+
+        if self._keep_logs:
+            from .shell_logs import ShellLogStore
+
+            self._shell_logs = ShellLogStore(
+                self._keep_logs, self._log_spill_bytes, self._log_dir
+            )
+
+        if sys.platform != "win32" and (
+            self._limit_address_space_mb
+            or self._limit_cpu_seconds
+            or self._limit_open_files
+            or self._limit_file_size_mb
+        ):
+            from .resources import ResourceLimits
+
+            self._resource_limits = ResourceLimits(
+                address_space_bytes=self._limit_address_space_mb * 1024 * 1024 or None,
+                # RLIMIT_CPU counts whole seconds, so 0.5 is a 1 second limit
+                cpu_seconds=math.ceil(self._limit_cpu_seconds) or None,
+                open_files=self._limit_open_files or None,
+                file_size_bytes=self._limit_file_size_mb * 1024 * 1024 or None,
+            )
+
+        self._is_commands = InteractiveShellCommands(
+            default_timeout_seconds=self._default_timeout_seconds,
+            max_capture_bytes=self._max_capture_bytes,
+            decode_errors=self._decode_errors,
+            idle_timeout_seconds=self._idle_timeout_seconds,
+            # The sessions are only started, and their module imported, on first use
+            session_idle_seconds=self._session_idle_seconds,
+            compact_output=self._compact_output,
+            max_output_tokens=self._max_output_tokens,
+            batch_max_workers=self._batch_max_workers,
+            metrics_sink=(
+                self._record_metrics
+                if self._metrics_file or self._metrics_in_response
+                else None
+            ),
+            result_cache=self._result_cache,
+            auto_responder=self._auto_responder,
+            answer_store=self._answer_store,
+            shell_logs=self._shell_logs,
+            recording_dir=self._recording_dir,
+            resource_limits=self._resource_limits,
+            spawn_backend=self._spawn_backend,
+            headless=self._headless,
+        )
+        return self._is_commands
+
+    def _record_metrics(self, metrics) -> None:
+        """Keep the metrics of the last command for post_command, and append them to
+        the metrics file."""
+        self._last_metrics = metrics
+        if self._metrics_file:
+            if self._metrics_file_sink is None:
+                from .metrics import JsonLinesMetricsSink
+
+                self._metrics_file_sink = JsonLinesMetricsSink(self._metrics_file)
+            self._metrics_file_sink(metrics)
+
     def can_handle_post_prompt(self) -> bool:
         """
         This method is called to check that the plugin can
@@ -224,7 +592,7 @@ class AutoGPTInteractiveShellCommandsPlugin(AutoGPTPluginTemplate):
 
         Returns:
             bool: True if the plugin can handle the pre_command method."""
-        return False
+        return bool(self._cache_ttl_seconds) or self._metrics_in_response
 
     def pre_command(
         self, command_name: str, arguments: Dict[str, Any]
@@ -240,6 +608,13 @@ class AutoGPTInteractiveShellCommandsPlugin(AutoGPTPluginTemplate):
             Tuple[str, Dict[str, Any]]: The command name and the arguments.
         """
         # Return "write_to_file" => settings file
+        # Other commands, such as Auto-GPT's file commands, may change the files
+        # that cached results depend on, without touching any watched path
+        if self._result_cache is not None and command_name not in _CACHE_SAFE_COMMANDS:
+            self._result_cache.clear()
+        # Only the metrics of this command may be added to its response, and a
+        # cached result, or another command such as a batch, leaves none
+        self._last_metrics = None
         return command_name, arguments
 
     def can_handle_post_command(self) -> bool:
@@ -249,7 +624,7 @@ class AutoGPTInteractiveShellCommandsPlugin(AutoGPTPluginTemplate):
 
         Returns:
             bool: True if the plugin can handle the post_command method."""
-        return False
+        return self._metrics_in_response
 
     def post_command(self, command_name: str, response: str) -> str:
         """
@@ -262,6 +637,9 @@ class AutoGPTInteractiveShellCommandsPlugin(AutoGPTPluginTemplate):
         Returns:
             str: The resulting response.
         """
+        if command_name == "execute_interactive_shell" and self._last_metrics:
+            metrics, self._last_metrics = self._last_metrics, None
+            return f"{response}\nCommand metrics: {metrics.summary()}"
         return response
 
     def can_handle_chat_completion(
@@ -0,0 +1,145 @@
+"""Remember the user's answers to the questions the agent asks again"""
+import json
+import os
+import re
+import sys
+import time
+from typing import Optional
+
+# Scopes of the remembered answers: shared by every directory, or per directory
+SCOPES = ("global", "cwd")
+
+_NOT_WORDS = re.compile(r"\W+")
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Reduce a prompt to its lowercase words, so that near-identical prompts match.
+
+    Args:
+        prompt (str): The prompt
+
+    Returns:
+        str: The words of the prompt, lowercase and separated by single spaces
+    """
+    return " ".join(_NOT_WORDS.sub(" ", prompt.lower()).split())
+
+
+class AnswerStore:
+    """The user's answers to prompts, returned again when a prompt is repeated.
+
+    Prompts are matched once normalized, so that case, punctuation and spacing do not
+    matter. Answers expire after ``ttl_seconds``. With the "cwd" scope, an answer is
+    only reused in the working directory it was given in. When ``path`` is set,
+    answers are loaded from, and saved to, that JSON file. A file that can't be
+    loaded is renamed with a .corrupt suffix, and the store starts empty.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: Optional[float] = None,
+        scope: str = "cwd",
+        path: Optional[str] = None,
+    ) -> None:
+        if scope not in SCOPES:
+            raise ValueError(
+                f"Unknown answer scope {scope!r}, expected one of {SCOPES}"
+            )
+        self._ttl_seconds = float(ttl_seconds) if ttl_seconds else None
+        self._scope = scope
+        self._path = path
+        # (scope key, normalized prompt) => (answer, wall-clock time it was given)
+        self._answers: dict[tuple[str, str], tuple[str, float]] = {}
+        if path and os.path.exists(path):
+            self._load()
+
+    def get(self, prompt: str) -> Optional[str]:
+        """Return the remembered answer to a prompt.
+
+        Args:
+            prompt (str): The prompt
+
+        Returns:
+            Optional[str]: The answer, None if there is none or it expired
+        """
+        key = self._key(prompt)
+        entry = self._answers.get(key)
+        if entry is None:
+            return None
+        answer, answered_at = entry
+        if self._expired(answered_at):
+            del self._answers[key]
+            return None
+        return answer
+
+    def put(self, prompt: str, answer: str) -> None:
+        """Remember the answer to a prompt.
+
+        Args:
+            prompt (str): The prompt
+            answer (str): The user's answer
+        """
+        self._answers[self._key(prompt)] = (answer, time.time())
+        if self._path:
+            self._save()
+
+    def forget(self, prompt: Optional[str] = None) -> None:
+        """Forget the answer to a prompt, or every answer.
+
+        Args:
+            prompt (str): The prompt, None to forget everything
+        """
+        if prompt is None:
+            self._answers.clear()
+        else:
+            self._answers.pop(self._key(prompt), None)
+        if self._path:
+            self._save()
+
+    def __len__(self) -> int:
+        return len(self._answers)
+
+    def _key(self, prompt: str) -> tuple[str, str]:
+        scope_key = os.getcwd() if self._scope == "cwd" else ""
+        return scope_key, normalize_prompt(prompt)
+
+    def _expired(self, answered_at: float) -> bool:
+        return (
+            self._ttl_seconds is not None
+            and time.time() - answered_at > self._ttl_seconds
+        )
+
+    def _load(self) -> None:
+        try:
+            with open(self._path, encoding="utf-8") as file:
+                entries = json.load(file)
+            for entry in entries:
+                if not self._expired(entry["answered_at"]):
+                    self._answers[(entry["scope"], entry["prompt"])] = (
+                        entry["answer"],
+                        entry["answered_at"],
+                    )
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            # Start afresh rather than fail, keeping the file aside to be looked at
+            self._answers.clear()
+            corrupt_path = f"{self._path}.corrupt"
+            try:
+                os.replace(self._path, corrupt_path)
+            except OSError:
+                corrupt_path = self._path
+            print(
+                f"Ignored the answers file {self._path} ({error!r}), "
+                f"kept as {corrupt_path}",
+                file=sys.stderr,
+            )
+
+    def _save(self) -> None:
+        entries = [
+            {"scope": scope, "prompt": prompt, "answer": answer, "answered_at": at}
+            for (scope, prompt), (answer, at) in self._answers.items()
+            if not self._expired(at)
+        ]
+        # Written aside then renamed, so a crash never leaves a truncated file
+        temporary_path = f"{self._path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            json.dump(entries, file, indent=2)
+        os.replace(temporary_path, self._path)
@@ -0,0 +1,228 @@
+"""Execute interactive shell commands in the workspace, on an asyncio event loop"""
+import asyncio
+import selectors
+import weakref
+from typing import AsyncIterator, Callable, Optional, Union
+
+from .capture import StreamDecoder, decode_events, flush_events
+from .engine import Call, Wait
+from .interactive_shell_commands import InteractiveShellCommands
+
+# The engine of each event loop, shared by the commands running on it
+_engines: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncioEngine]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+class AsyncioEngine:
+    """The SelectorEngine interface on an asyncio event loop, so that ShellProcess,
+    and so every feature of the POSIX engine, runs on it.
+
+    Descriptors are watched by the loop, which calls their callback when they are
+    ready. The commands sharing the loop share its engine, so only one of them
+    receives the user's input.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        # Weak, so that the engine of a loop does not keep the loop alive
+        self._loop_ref = weakref.ref(loop)
+        # Descriptor => the selectors events it is watched for
+        self._events: dict[int, int] = {}
+        # Regular files can't be watched by epoll, but are always ready to be read
+        self._always_ready: set[int] = set()
+        # The futures of the commands waiting for a descriptor to be serviced
+        self._waiters: set[asyncio.Future] = set()
+
+    @classmethod
+    def for_loop(cls, loop: asyncio.AbstractEventLoop) -> "AsyncioEngine":
+        """Return the engine of an event loop, creating it on first use."""
+        engine = _engines.get(loop)
+        if engine is None:
+            engine = _engines[loop] = cls(loop)
+        return engine
+
+    def register(
+        self,
+        fd: int,
+        callback: Callable[[int, int], None],
+        events: int = selectors.EVENT_READ,
+    ) -> None:
+        """Call ``callback(fd, events)`` whenever the descriptor is ready.
+
+        Args:
+            fd (int): The file descriptor
+            callback (Callable[[int, int], None]): Called with the descriptor and the
+                events it is ready for
+            events (int): selectors.EVENT_READ or selectors.EVENT_WRITE
+        """
+
+        def on_ready() -> None:
+            callback(fd, events)
+            for waiter in self._waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+
+        loop = self._loop_ref()
+        self._events[fd] = events
+        try:
+            if events & selectors.EVENT_WRITE:
+                loop.add_writer(fd, on_ready)
+            else:
+                loop.add_reader(fd, on_ready)
+        except PermissionError:
+            self._always_ready.add(fd)
+            loop.call_soon(self._call_while_registered, fd, on_ready)
+
+    def unregister(self, fd: int) -> None:
+        """Stop watching a descriptor.
+
+        Args:
+            fd (int): The file descriptor
+        """
+        events = self._events.pop(fd)
+        if fd in self._always_ready:
+            self._always_ready.discard(fd)
+        elif events & selectors.EVENT_WRITE:
+            self._loop_ref().remove_writer(fd)
+        else:
+            self._loop_ref().remove_reader(fd)
+
+    def is_registered(self, fd: int) -> bool:
+        """Check whether a descriptor is watched, for instance by another command.
+
+        Args:
+            fd (int): The file descriptor
+
+        Returns:
+            bool: True if the descriptor is registered
+        """
+        return fd in self._events
+
+    async def wait(self, timeout: float) -> None:
+        """Wait until a descriptor was serviced, for at most ``timeout`` seconds.
+
+        A descriptor of another command on the loop may end the wait too, so the
+        caller checks again what it waits for.
+
+        Args:
+            timeout (float): The maximum number of seconds to wait
+        """
+        waiter = self._loop_ref().create_future()
+        self._waiters.add(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._waiters.discard(waiter)
+
+    def _call_while_registered(self, fd: int, on_ready: Callable[[], None]) -> None:
+        if fd in self._always_ready:
+            on_ready()
+        if fd in self._always_ready:
+            self._loop_ref().call_soon(self._call_while_registered, fd, on_ready)
+
+
+class AsyncInteractiveShellCommands(InteractiveShellCommands):
+    """InteractiveShellCommands that can run many commands concurrently on one asyncio
+    event loop (POSIX only).
+
+    Commands run on the same ShellProcess, and the same steps, as the POSIX engine,
+    so they get the same features: stdin_data, resource limits, spawn backends,
+    reaping with wait4(), shell logs, recordings and echo. The engine is awaited on
+    the event loop instead of being polled, and the steps that may block, such as
+    stopping a process group, run in the loop's default executor.
+
+    The synchronous methods are inherited unchanged, so an instance can still be
+    registered with prompt.add_command.
+    """
+
+    async def execute_interactive_shell_async(
+        self,
+        command_line: str,
+        timeout_seconds: int = None,
+        stdin_data: Optional[Union[str, bytes]] = None,
+    ) -> list[dict]:
+        """Execute a shell command that requires interactivity and return the output.
+
+        Args:
+            command_line (str): The command line to execute
+            timeout_seconds (int): The timeout in seconds
+            stdin_data (str | bytes): Input fed to the command's stdin, which is then
+                closed, instead of forwarding the user's input
+
+        Returns:
+            list[dict]: The interaction between the user and the process, as a list of dictionaries: [{role: "user"|"process"|"error", content: "the content of the interaction"}, ...]
+        """
+        capture = self._begin_capture(command_line, "async")
+        try:
+            async for role, data in self._aiter_chunks(
+                command_line, timeout_seconds, stdin_data
+            ):
+                capture.add(role, data)
+        finally:
+            capture.close()
+        return capture.to_conversation()
+
+    async def iter_interactive_shell_async(
+        self,
+        command_line: str,
+        timeout_seconds: int = None,
+        stdin_data: Optional[Union[str, bytes]] = None,
+    ) -> AsyncIterator[dict]:
+        """Execute a shell command that requires interactivity and yield the interaction
+        as it happens.
+
+        Closing the generator before it is exhausted kills the process.
+
+        Args:
+            command_line (str): The command line to execute
+            timeout_seconds (int): The timeout in seconds
+            stdin_data (str | bytes): Input fed to the command's stdin, which is then
+                closed, instead of forwarding the user's input
+
+        Yields:
+            dict: Each interaction event as soon as it is read: {role: "user"|"process"|"error", content: "the content of the interaction"}
+        """
+        decoder = StreamDecoder(errors=self._decode_errors)
+        async for role, data in self._aiter_chunks(
+            command_line, timeout_seconds, stdin_data
+        ):
+            for event in decode_events(decoder, role, data):
+                yield event
+        for event in flush_events(decoder):
+            yield event
+
+    async def _aiter_chunks(
+        self,
+        command_line: str,
+        timeout_seconds: int = None,
+        stdin_data: Optional[Union[str, bytes]] = None,
+    ) -> AsyncIterator[tuple[str, Union[bytes, str]]]:
+        """Run the command and yield the raw (role, bytes) chunks of the interaction,
+        and the messages of the plugin itself, such as timeouts, as (role, str).
+
+        Only one command per event loop receives the user's input.
+        """
+        loop = asyncio.get_running_loop()
+        engine = AsyncioEngine.for_loop(loop)
+        steps = self._shell_steps(
+            command_line, timeout_seconds, engine, stdin_data, "async"
+        )
+        try:
+            result = None
+            while True:
+                try:
+                    step = steps.send(result)
+                except StopIteration:
+                    return
+                result = None
+                if isinstance(step, Wait):
+                    await engine.wait(step.seconds)
+                elif isinstance(step, Call):
+                    result = await loop.run_in_executor(None, step.function)
+                else:
+                    yield step
+        finally:
+            # Also reached when the caller stops iterating early
+            steps.close()
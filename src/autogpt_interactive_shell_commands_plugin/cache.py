@@ -0,0 +1,169 @@
+"""Reuse the results of read-only commands that are run again and again"""
+import copy
+import fnmatch
+import os
+import re
+import shlex
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+# Commands that only inspect the workspace, cached when no pattern is configured.
+# git status and git diff are left out: editing a tracked file in place changes
+# neither its directory nor .git/index, so their results can't be invalidated
+DEFAULT_CACHEABLE_PATTERNS = [
+    "ls",
+    "ls *",
+    "pwd",
+    "cat *",
+    "head *",
+    "tail *",
+    "wc *",
+    "git log *",
+    "git branch",
+    "pip list",
+    "pip freeze",
+    "pip show *",
+]
+
+# Paths whose modification invalidates every entry, relative to the entry's cwd
+DEFAULT_WATCH_PATHS = [".", ".git/index", ".git/HEAD"]
+
+# Environment variables that change what the cacheable commands print
+DEFAULT_ENV_VARS = ["PATH", "VIRTUAL_ENV", "PYTHONPATH", "HOME", "LANG"]
+
+# Command lines with these can chain, redirect or substitute commands
+_SHELL_SYNTAX = re.compile(r"[;&|<>`$()\n]")
+
+
+class ResultCache:
+    """Keep the conversations of read-only commands, to return them again while
+    nothing they depend on changed.
+
+    Entries are keyed on the command line, the working directory and the values of
+    a few environment variables. They expire after ``ttl_seconds``, or as soon as
+    the modification time of a watched path changes: the working directory, the
+    configured watch paths, and the files named in the command line. The least
+    recently used entry is evicted once ``max_entries`` are stored.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float,
+        max_entries: int = 128,
+        patterns: Optional[Iterable[str]] = None,
+        watch_paths: Optional[Iterable[str]] = None,
+        env_vars: Optional[Iterable[str]] = None,
+    ) -> None:
+        self._ttl_seconds = float(ttl_seconds)
+        self._max_entries = max_entries
+        self._patterns = list(
+            DEFAULT_CACHEABLE_PATTERNS if patterns is None else patterns
+        )
+        self._watch_paths = list(
+            DEFAULT_WATCH_PATHS if watch_paths is None else watch_paths
+        )
+        self._env_vars = list(DEFAULT_ENV_VARS if env_vars is None else env_vars)
+        # key => (stored at, watched mtimes, conversation), least recently used first
+        self._entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def is_cacheable(self, command_line: str) -> bool:
+        """Check whether a command line matches the allow-list.
+
+        Command lines that chain, redirect or substitute commands never match.
+
+        Args:
+            command_line (str): The command line
+
+        Returns:
+            bool: True if the command's result can be cached
+        """
+        command_line = " ".join(command_line.split())
+        if _SHELL_SYNTAX.search(command_line):
+            return False
+        return any(
+            fnmatch.fnmatchcase(command_line, pattern) for pattern in self._patterns
+        )
+
+    def get(self, command_line: str) -> Optional[list[dict]]:
+        """Return the cached conversation of a command, if it is still valid.
+
+        Args:
+            command_line (str): The command line
+
+        Returns:
+            Optional[list[dict]]: A copy of the conversation, None on a cache miss
+        """
+        key = self._key(command_line)
+        entry = self._entries.get(key)
+        if entry is not None:
+            stored_at, mtimes, conversation = entry
+            if (
+                time.monotonic() - stored_at <= self._ttl_seconds
+                and self._mtimes(mtimes) == mtimes
+            ):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(conversation)
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, command_line: str, conversation: list[dict]) -> None:
+        """Store the conversation of a cacheable command.
+
+        Args:
+            command_line (str): The command line
+            conversation (list[dict]): The conversation returned for the command
+        """
+        key = self._key(command_line)
+        paths = [os.path.abspath(path) for path in self._watch_paths]
+        paths.extend(self._argument_paths(command_line))
+        self._entries[key] = (
+            time.monotonic(),
+            self._mtimes(paths),
+            copy.deepcopy(conversation),
+        )
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Drop every entry, for instance after a command that may change files."""
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _key(self, command_line: str) -> tuple:
+        return (
+            " ".join(command_line.split()),
+            os.getcwd(),
+            tuple(os.environ.get(name) for name in self._env_vars),
+        )
+
+    @staticmethod
+    def _argument_paths(command_line: str) -> list[str]:
+        """Return the existing files and directories named in the command line."""
+        try:
+            arguments = shlex.split(command_line)[1:]
+        except ValueError:
+            return []
+        return [
+            os.path.abspath(argument)
+            for argument in arguments
+            if not argument.startswith("-") and os.path.exists(argument)
+        ]
+
+    @staticmethod
+    def _mtimes(paths: Iterable[str]) -> dict[str, Optional[int]]:
+        """Return the modification time of each path, None if it does not exist."""
+        mtimes = {}
+        for path in paths:
+            try:
+                mtimes[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                mtimes[path] = None
+        return mtimes
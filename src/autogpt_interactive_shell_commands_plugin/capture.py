@@ -0,0 +1,403 @@
+"""Capture the conversation with a shell command"""
+import codecs
+import re
+import time
+from collections import deque
+from typing import Iterator, Optional, Union
+
+from .compaction import LineCompactor, apply_token_budget
+
+# Whitespace runs, and the terminal escape sequences (CSI, OSC and two byte escapes)
+# that only make sense on a screen
+_NORMALIZE_PATTERN = re.compile(
+    r"(?P<space>\s+)"
+    r"|\x1b\[[0-?]*[ -/]*[@-~]"
+    r"|\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)"
+    r"|\x1b[@-Z\\-_]"
+)
+
+
+def _normalize_match(match: re.Match) -> str:
+    # A run made only of carriage returns glues its neighbours back together
+    if match.lastgroup == "space" and match.group().strip("\r"):
+        return " "
+    return ""
+
+
+def normalize_content(content: str) -> str:
+    """Normalize a piece of captured text for the conversation, in a single pass.
+
+    Args:
+        content (str): The decoded text
+
+    Returns:
+        str: The text on a single line, without carriage returns, escape sequences
+            or repeated whitespace
+    """
+    return _NORMALIZE_PATTERN.sub(_normalize_match, content).strip() if content else ""
+
+
+class StreamDecoder:
+    """Decode the byte streams of each role incrementally.
+
+    Multi-byte characters split across chunks are decoded once complete, and
+    undecodable bytes are handled according to ``errors`` (see codecs).
+    """
+
+    def __init__(self, encoding: str = "utf-8", errors: str = "replace") -> None:
+        self._decoder_factory = codecs.getincrementaldecoder(encoding)
+        self._errors = errors
+        self._decoders: dict[str, codecs.IncrementalDecoder] = {}
+
+    def decode(self, role: str, data: bytes, final: bool = False) -> str:
+        """Decode the next chunk of a role's stream.
+
+        Args:
+            role (str): "user", "process" or "error"
+            data (bytes): The chunk
+            final (bool): Whether this is the end of the stream
+
+        Returns:
+            str: The text that could be decoded so far
+        """
+        decoder = self._decoders.get(role)
+        if decoder is None:
+            decoder = self._decoders[role] = self._decoder_factory(self._errors)
+        return decoder.decode(data, final)
+
+    def flush(self) -> list[tuple[str, str]]:
+        """End every stream, and return the text left in the decoders.
+
+        Returns:
+            list[tuple[str, str]]: The (role, text) left over, if any
+        """
+        remainders = [
+            (role, decoder.decode(b"", True))
+            for role, decoder in self._decoders.items()
+        ]
+        return [(role, text) for role, text in remainders if text]
+
+
+class ChunkCoalescer:
+    """Merge consecutive chunks read from the same role into a single event.
+
+    A new event is started when the role changes, when more than ``gap_seconds``
+    passed since the previous chunk, or when the pending event reached ``max_bytes``.
+    """
+
+    def __init__(self, gap_seconds: float = 0.25, max_bytes: int = 1024 * 1024) -> None:
+        self._gap_seconds = gap_seconds
+        self._max_bytes = max_bytes
+        self._role: Optional[str] = None
+        self._pending = bytearray()
+        self._last_time = 0.0
+
+    def add(
+        self, role: str, data: bytes, timestamp: Optional[float] = None
+    ) -> list[tuple[str, bytes]]:
+        """Add a chunk, and return the events it completed.
+
+        Args:
+            role (str): "user", "process" or "error"
+            data (bytes): The chunk that was read
+            timestamp (float): When the chunk was read, defaults to now
+
+        Returns:
+            list[tuple[str, bytes]]: The (role, data) events that are complete
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+
+        events = []
+        if self._pending and (
+            role != self._role
+            or timestamp - self._last_time > self._gap_seconds
+            or len(self._pending) >= self._max_bytes
+        ):
+            events = self.flush()
+
+        self._role = role
+        self._pending += data
+        self._last_time = timestamp
+        return events
+
+    def flush(self) -> list[tuple[str, bytes]]:
+        """Return the pending event, if any.
+
+        Returns:
+            list[tuple[str, bytes]]: The (role, data) events that were pending
+        """
+        if not self._pending:
+            return []
+
+        event = (self._role, bytes(self._pending))
+        self._pending.clear()
+        return [event]
+
+
+class ConversationBuffer:
+    """Collect the conversation with a shell command, optionally within a byte budget.
+
+    When ``max_bytes`` is set, only the first and last ``max_bytes / 2`` bytes of each
+    role are kept. The tail is kept in a ring buffer, and each dropped span is replaced
+    by a single event summarizing how many bytes and lines were left out.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None) -> None:
+        self._max_bytes = max_bytes or None
+        self._head_bytes = self._max_bytes // 2 if self._max_bytes else None
+        self._tail_bytes = self._max_bytes - self._head_bytes if self._max_bytes else 0
+        self._sequence = 0
+        # (sequence, part, role, content). Part orders the pieces of one event:
+        # 0 = kept in the head, 1 = summary of the dropped span, 2 = kept in the tail
+        self._head: list[tuple[int, int, str, str]] = []
+        self._head_used: dict[str, int] = {}
+        self._tails: dict[str, deque] = {}
+        self._tail_used: dict[str, int] = {}
+        # role: [first dropped sequence, bytes, lines]
+        self._dropped: dict[str, list[int]] = {}
+
+    def append(self, role: str, content: str) -> None:
+        """Add an event to the conversation.
+
+        Args:
+            role (str): "user", "process" or "error"
+            content (str): The decoded, not yet normalized, text of the event
+        """
+        sequence = self._sequence
+        self._sequence += 1
+
+        if self._max_bytes is None:
+            self._head.append((sequence, 0, role, content))
+            return
+
+        data = content.encode("utf-8")
+        head_left = self._head_bytes - self._head_used.get(role, 0)
+        if head_left > 0:
+            head, data = data[:head_left], data[head_left:]
+            self._head_used[role] = self._head_used.get(role, 0) + len(head)
+            self._head.append(
+                (sequence, 0, role, head.decode("utf-8", errors="ignore"))
+            )
+            if not data:
+                return
+
+        tail = self._tails.setdefault(role, deque())
+        tail.append([sequence, data])
+        self._tail_used[role] = self._tail_used.get(role, 0) + len(data)
+
+        # Drop from the oldest end of the ring buffer until the tail fits the budget
+        while self._tail_used[role] > self._tail_bytes:
+            overflow = self._tail_used[role] - self._tail_bytes
+            oldest = tail[0]
+            if len(oldest[1]) <= overflow:
+                tail.popleft()
+                dropped = oldest[1]
+            else:
+                dropped, oldest[1] = oldest[1][:overflow], oldest[1][overflow:]
+            self._tail_used[role] -= len(dropped)
+            summary = self._dropped.setdefault(role, [oldest[0], 0, 0])
+            summary[1] += len(dropped)
+            summary[2] += dropped.count(b"\n")
+
+    def to_conversation(self) -> list[dict]:
+        """Return the captured conversation.
+
+        Returns:
+            list[dict]: The interaction between the user and the process, as a list of dictionaries: [{role: "user"|"process"|"error", content: "the content of the interaction"}, ...]
+        """
+        events = list(self._head)
+        for role, (sequence, dropped_bytes, dropped_lines) in self._dropped.items():
+            events.append(
+                (
+                    sequence,
+                    1,
+                    role,
+                    f"[... {dropped_bytes} bytes, {dropped_lines} lines omitted ...]",
+                )
+            )
+        for role, tail in self._tails.items():
+            events.extend(
+                (sequence, 2, role, data.decode("utf-8", errors="ignore"))
+                for sequence, data in tail
+            )
+        events.sort(key=lambda event: event[:2])
+
+        return [
+            {
+                "role": role,
+                "content": content if part == 1 else normalize_content(content),
+            }
+            for _, part, role, content in events
+        ]
+
+
+class ConversationCapture:
+    """Turn the raw chunks read from a shell command into a conversation.
+
+    Chunks are merged by a ChunkCoalescer, decoded by a StreamDecoder, optionally
+    compacted by a LineCompactor, and collected in a ConversationBuffer. The
+    conversation is finally cut down to ``max_tokens``, if set.
+    """
+
+    def __init__(
+        self,
+        max_bytes: Optional[int] = None,
+        decode_errors: str = "replace",
+        compact: bool = False,
+        max_tokens: Optional[int] = None,
+    ) -> None:
+        self._coalescer = ChunkCoalescer()
+        self._decoder = StreamDecoder(errors=decode_errors)
+        self._compactor = LineCompactor() if compact else None
+        self._buffer = ConversationBuffer(max_bytes)
+        self._max_tokens = max_tokens or None
+
+    def feed(self, role: str, data: bytes, timestamp: Optional[float] = None) -> None:
+        """Add a chunk read from (or written to) the process.
+
+        Args:
+            role (str): "user", "process" or "error"
+            data (bytes): The chunk
+            timestamp (float): When the chunk was read, defaults to now
+        """
+        self._append(self._coalescer.add(role, data, timestamp))
+
+    def append(self, role: str, content: str) -> None:
+        """Add a message that was not read from the process, such as a timeout.
+
+        Args:
+            role (str): "user", "process" or "error"
+            content (str): The message
+        """
+        self._append(self._coalescer.flush())
+        self._flush_compactor()
+        self._buffer.append(role, content)
+
+    def to_conversation(self) -> list[dict]:
+        """Return the captured conversation.
+
+        Returns:
+            list[dict]: The interaction between the user and the process, as a list of dictionaries: [{role: "user"|"process"|"error", content: "the content of the interaction"}, ...]
+        """
+        self._append(self._coalescer.flush())
+        for role, content in self._decoder.flush():
+            self._add_content(role, content)
+        self._flush_compactor()
+        conversation = self._buffer.to_conversation()
+        if self._max_tokens:
+            conversation = apply_token_budget(conversation, self._max_tokens)
+        return conversation
+
+    def _append(self, events: list[tuple[str, bytes]]) -> None:
+        for role, data in events:
+            content = self._decoder.decode(role, data)
+            if content:
+                self._add_content(role, content)
+
+    def _add_content(self, role: str, content: str) -> None:
+        if self._compactor is None:
+            self._buffer.append(role, content)
+        elif role == "user":
+            # The user's input is kept as is, after the output it answers
+            self._flush_compactor()
+            self._buffer.append(role, content)
+        else:
+            for role, content in self._compactor.add(role, content):
+                self._buffer.append(role, content)
+
+    def _flush_compactor(self) -> None:
+        if self._compactor is not None:
+            for role, content in self._compactor.flush():
+                self._buffer.append(role, content)
+
+
+class CommandCapture:
+    """The capture of one command: its conversation, and the shell log and the
+    recording of its raw chunks, if they are enabled.
+
+    Chunks are bytes read from (or written to) the process. Messages of the plugin
+    itself, such as timeouts, are str, and become events of their own.
+    """
+
+    def __init__(
+        self,
+        conversation: ConversationCapture,
+        log_id: Optional[int] = None,
+        log=None,
+        recorder=None,
+    ) -> None:
+        self._conversation = conversation
+        self._log_id = log_id
+        self._log = log
+        self._recorder = recorder
+
+    def add(self, role: str, data: Union[bytes, str]) -> None:
+        """Add a chunk, or a message of the plugin.
+
+        Args:
+            role (str): "user", "process" or "error"
+            data (bytes | str): The chunk, or the message
+        """
+        # The same timestamp, so that a replay coalesces chunks the same way
+        timestamp = time.monotonic()
+        if isinstance(data, str):
+            self._conversation.append(role, data)
+        else:
+            self._conversation.feed(role, data, timestamp)
+        if self._log is not None:
+            self._log.append(role, data.encode() if isinstance(data, str) else data)
+        if self._recorder is not None:
+            self._recorder.record(role, data, timestamp)
+
+    def close(self) -> None:
+        """End the recording, if any."""
+        if self._recorder is not None:
+            self._recorder.close()
+
+    def to_conversation(self) -> list[dict]:
+        """Return the captured conversation, pointing at the shell log, if any.
+
+        Returns:
+            list[dict]: The interaction between the user and the process, as a list of dictionaries: [{role: "user"|"process"|"error", content: "the content of the interaction"}, ...]
+        """
+        result = self._conversation.to_conversation()
+        if self._log is not None and self._log.size:
+            result.append(
+                {
+                    "role": "error",
+                    "content": f"Full output kept as shell log {self._log_id} "
+                    f"({self._log.size} bytes), see read_shell_log and grep_shell_log",
+                }
+            )
+        return result
+
+
+def decode_events(
+    decoder: StreamDecoder, role: str, data: Union[bytes, str]
+) -> Iterator[dict]:
+    """Decode a chunk, or a message of the plugin, into events as soon as it is read,
+    for the commands yielding their interaction as it happens.
+
+    Args:
+        decoder (StreamDecoder): The decoder of the command's streams
+        role (str): "user", "process" or "error"
+        data (bytes | str): The chunk, or the message
+
+    Yields:
+        dict: The events: {role: "user"|"process"|"error", content: "the content of the interaction"}
+    """
+    if isinstance(data, str):
+        # A message of the plugin is an event of its own, after the output
+        yield from flush_events(decoder)
+        yield {"role": role, "content": data}
+        return
+    content = decoder.decode(role, data)
+    if content:
+        yield {"role": role, "content": normalize_content(content)}
+
+
+def flush_events(decoder: StreamDecoder) -> Iterator[dict]:
+    """Yield the events of the text left in a decoder, once the command is done."""
+    for role, content in decoder.flush():
+        yield {"role": role, "content": normalize_content(content)}
@@ -0,0 +1,173 @@
+"""Compact the output of commands before it is shown to the model"""
+import re
+from typing import Optional
+
+# Characters per token, to estimate the size of a conversation in the prompt
+CHARS_PER_TOKEN = 4
+
+# A line without a newline longer than this is passed on as is
+MAX_PENDING_CHARS = 64 * 1024
+
+# Redrawn lines that only differ by their numbers (counters, percentages...) repeat
+_NUMBERS = re.compile(r"\d+")
+
+
+class LineCompactor:
+    """Compact the decoded output of a command as it is captured.
+
+    Only the final state of lines redrawn with carriage returns (progress bars) is
+    kept. Runs of identical lines, or of redrawn lines that only differ by their
+    numbers, are collapsed into "line (×N)", or "first … last (×N)" when the
+    lines differ, so the first and last lines of a run are never lost.
+
+    Compacted lines are held back, and released as a single event when the role
+    changes, when MAX_PENDING_CHARS of them are ready, or on flush(). So the
+    conversation has no more events than without compaction, in the same order.
+    """
+
+    def __init__(self) -> None:
+        self._role: Optional[str] = None
+        # Compacted lines not released yet, and their total length
+        self._ready: list[str] = []
+        self._ready_chars = 0
+        # The line being written, after the carriage returns it contained
+        self._partial = ""
+        # The first and last lines of the current run of repeated lines, their
+        # repetition key and how many lines the run has
+        self._run_first: Optional[str] = None
+        self._run_line: Optional[str] = None
+        self._run_key: Optional[str] = None
+        self._run_count = 0
+
+    def add(self, role: str, content: str) -> list[tuple[str, str]]:
+        """Add decoded output, and return the (role, content) events it completed.
+
+        Args:
+            role (str): "process" or "error"
+            content (str): The decoded text
+
+        Returns:
+            list[tuple[str, str]]: The compacted events, ready to be captured
+        """
+        events = self.flush() if role != self._role else []
+        self._role = role
+
+        lines = (self._partial + content).split("\n")
+        partial = lines.pop()
+        # A trailing carriage return is kept, so that the next text, possibly in the
+        # next chunk, overwrites the line instead of extending it
+        self._partial = self._overwrite(partial) + "\r" * partial.endswith("\r")
+        for line in lines:
+            self._add_line(self._overwrite(line), redrawn="\r" in line)
+
+        if self._ready_chars + len(self._partial) > MAX_PENDING_CHARS:
+            events.extend(self.flush())
+        return events
+
+    def flush(self) -> list[tuple[str, str]]:
+        """Release everything held back, at the end of the output or of a role.
+
+        Returns:
+            list[tuple[str, str]]: The compacted events, ready to be captured
+        """
+        self._end_run()
+        content = "\n".join(self._ready) + "\n" if self._ready else ""
+        content += self._partial.rstrip("\r")
+        self._ready, self._ready_chars, self._partial = [], 0, ""
+        return [(self._role, content)] if content else []
+
+    @staticmethod
+    def _overwrite(line: str) -> str:
+        """Return what is left of a line once its carriage returns were applied."""
+        if "\r" not in line:
+            return line
+        segments = [segment for segment in line.split("\r") if segment]
+        return segments[-1] if segments else ""
+
+    def _add_line(self, line: str, redrawn: bool = False) -> None:
+        # Only progress output, redrawn in place, may differ by its numbers; other
+        # lines that differ (error locations, counts) are all kept
+        key = "\r" + _NUMBERS.sub("#", line.strip()) if redrawn else line
+        if self._run_line is not None and key == self._run_key:
+            self._run_line = line
+            self._run_count += 1
+            return
+        self._end_run()
+        self._run_first, self._run_line = line, line
+        self._run_key, self._run_count = key, 1
+
+    def _end_run(self) -> None:
+        if self._run_line is None:
+            return
+        line = self._run_line
+        # Repeated blank lines are not worth a count
+        if self._run_count > 1 and line.strip():
+            if self._run_first != line:
+                line = f"{self._run_first} … {line}"
+            line = f"{line} (×{self._run_count})"
+        self._ready.append(line)
+        self._ready_chars += len(line) + 1
+        self._run_first, self._run_line = None, None
+        self._run_key, self._run_count = None, 0
+
+
+def estimate_tokens(content: str) -> int:
+    """Estimate the number of tokens of a piece of text.
+
+    Args:
+        content (str): The text
+
+    Returns:
+        int: The estimated number of tokens
+    """
+    return -(-len(content) // CHARS_PER_TOKEN)
+
+
+def apply_token_budget(conversation: list[dict], max_tokens: int) -> list[dict]:
+    """Keep the start and the end of a conversation within a token budget.
+
+    The first and last halves of the budget are kept, and what is dropped in the
+    middle is replaced by a single event saying how much was left out. Events that
+    straddle a boundary are cut.
+
+    Args:
+        conversation (list[dict]): The conversation: [{role, content}, ...]
+        max_tokens (int): The estimated number of tokens to keep
+
+    Returns:
+        list[dict]: The conversation within the budget
+    """
+    total_chars = sum(len(event["content"]) for event in conversation)
+    budget_chars = max_tokens * CHARS_PER_TOKEN
+    if total_chars <= budget_chars:
+        return conversation
+
+    head, left = [], budget_chars // 2
+    for event in conversation:
+        content = event["content"][:left]
+        if len(content) < len(event["content"]):
+            # The summary takes the role of the first event that is cut
+            cut_role = event["role"]
+            if content:
+                head.append({**event, "content": content})
+            break
+        head.append(event)
+        left -= len(content)
+
+    tail, left = [], budget_chars - budget_chars // 2
+    for event in reversed(conversation):
+        content = event["content"][-left:] if left else ""
+        if len(content) < len(event["content"]):
+            if content:
+                tail.append({**event, "content": content})
+            break
+        tail.append(event)
+        left -= len(content)
+    tail.reverse()
+
+    omitted_tokens = -(-(total_chars - budget_chars) // CHARS_PER_TOKEN)
+    summary = {
+        "role": cut_role,
+        "content": f"[... about {omitted_tokens} tokens of output omitted ...]",
+    }
+    return head + [summary] + tail
@@ -0,0 +1,19 @@
+"""
+Shared fixtures for the tests.
+"""
+import os
+from unittest.mock import patch
+
+import pytest
+
+
+@pytest.fixture
+def idle_stdin():
+    """Replace sys.stdin with a pipe that stays open but never has input."""
+    read_fd, write_fd = os.pipe()
+    try:
+        with open(read_fd, "rb", closefd=False) as stdin, patch("sys.stdin", stdin):
+            yield stdin
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
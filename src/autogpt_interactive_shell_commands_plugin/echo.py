@@ -0,0 +1,128 @@
+"""Mirror the conversation of commands to the terminal without slowing them down"""
+import atexit
+import sys
+import threading
+from itertools import groupby
+from typing import Optional
+
+# Bytes waiting to be echoed before new output is dropped from the echo
+DEFAULT_MAX_QUEUE_BYTES = 4 * 1024 * 1024
+
+# Seconds between two batches of writes and flushes to the terminal
+DEFAULT_FLUSH_INTERVAL = 0.05
+
+# Seconds a command waits for its output to be echoed before returning
+DEFAULT_FLUSH_TIMEOUT = 1.0
+
+
+class EchoWriter:
+    """Echo output from a background thread, so a slow terminal or log pipe never
+    blocks the loop reading the process, and thus never blocks the process.
+
+    Chunks are queued, then written in batches, each stream flushed once per batch
+    and at most every ``flush_interval`` seconds. Once ``max_queue_bytes`` are
+    waiting, new output is not echoed (it is still captured), and a note says how
+    much was skipped.
+    """
+
+    def __init__(
+        self,
+        max_queue_bytes: int = DEFAULT_MAX_QUEUE_BYTES,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+    ) -> None:
+        self._max_queue_bytes = max_queue_bytes
+        self._flush_interval = flush_interval
+        self._condition = threading.Condition()
+        # (stream, data) chunks waiting to be written, and their total size
+        self._pending: list[tuple[object, bytes]] = []
+        self._pending_bytes = 0
+        self._dropped_bytes = 0
+        # Chunks queued, and chunks written, so far, for flush()
+        self._queued = 0
+        self._written = 0
+        self._flush_requested = False
+        self._thread: Optional[threading.Thread] = None
+
+    def write(self, role: str, data: bytes) -> None:
+        """Queue a chunk to be echoed, without waiting.
+
+        Args:
+            role (str): "user" or "process" (echoed to stdout), or "error" (stderr)
+            data (bytes): The chunk
+        """
+        stream = sys.stderr.buffer if role == "error" else sys.stdout.buffer
+        with self._condition:
+            if self._thread is None:
+                self._start()
+            if self._pending_bytes + len(data) > self._max_queue_bytes:
+                self._dropped_bytes += len(data)
+            else:
+                self._pending.append((stream, data))
+                self._pending_bytes += len(data)
+                self._queued += 1
+            self._condition.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until everything queued so far was written and flushed.
+
+        Args:
+            timeout (float): The maximum number of seconds to wait, None to block
+
+        Returns:
+            bool: False if the timeout expired first
+        """
+        with self._condition:
+            target = self._queued
+            self._flush_requested = True
+            self._condition.notify_all()
+            return self._condition.wait_for(
+                lambda: self._written >= target, timeout=timeout
+            )
+
+    def _start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._run, name="shell-echo", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.flush, DEFAULT_FLUSH_TIMEOUT)
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending or self._dropped_bytes)
+                pending, self._pending = self._pending, []
+                self._pending_bytes = 0
+                dropped, self._dropped_bytes = self._dropped_bytes, 0
+                self._flush_requested = False
+
+            self._write(pending, dropped)
+            with self._condition:
+                self._written += len(pending)
+                self._condition.notify_all()
+                # Let output accumulate, unless someone waits for it
+                self._condition.wait_for(
+                    lambda: self._flush_requested, timeout=self._flush_interval
+                )
+
+    @staticmethod
+    def _write(pending: list[tuple[object, bytes]], dropped: int) -> None:
+        """Write a batch, joining consecutive chunks of the same stream, and flush
+        each stream once."""
+        writes = [
+            (stream, b"".join(data for _, data in chunks))
+            for stream, chunks in groupby(pending, key=lambda chunk: chunk[0])
+        ]
+        if dropped:
+            note = f"\n[... {dropped} bytes not echoed ...]\n"
+            writes.append((sys.stderr.buffer, note.encode()))
+        for stream, data in writes:
+            try:
+                stream.write(data)
+            except (OSError, ValueError):
+                # The terminal went away, or the stream was closed
+                pass
+        for stream in {stream for stream, _ in writes}:
+            try:
+                stream.flush()
+            except (OSError, ValueError):
+                pass
@@ -0,0 +1,381 @@
+"""Multiplex the pipes of running shell commands"""
+import functools
+import os
+import selectors
+import signal
+import subprocess
+import sys
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Any, Callable, Optional
+
+from .spawn import POPEN_BACKEND, spawn
+
+if TYPE_CHECKING:
+    from .echo import EchoWriter
+    from .resources import ResourceLimits, ResourceUsage
+
+# Bounds of the adaptive read size used on the process pipes
+MIN_READ_SIZE = 1024
+MAX_READ_SIZE = 64 * 1024
+
+# Seconds a process group gets to exit after SIGTERM, before it is sent SIGKILL
+TERMINATE_GRACE_SECONDS = 2
+
+# Longest sleep between two checks for the exit of a process
+MAX_REAP_INTERVAL = 0.05
+
+# Most bytes of input written to a process at once
+MAX_WRITE_SIZE = 64 * 1024
+
+
+class SelectorEngine:
+    """Wait for the pipes of one or more shell commands to be ready.
+
+    Descriptors are registered once with a selector (epoll on Linux), each with a
+    callback that poll() calls when it is ready. Several ShellProcess instances can
+    share one engine, as long as a single thread polls it.
+    """
+
+    def __init__(self, selector: Optional[selectors.BaseSelector] = None) -> None:
+        self._selector = selector or selectors.DefaultSelector()
+        # Regular files can't be watched by epoll, but are always ready to be read
+        self._always_ready: dict[int, Callable[[int, int], None]] = {}
+
+    def register(
+        self,
+        fd: int,
+        callback: Callable[[int, int], None],
+        events: int = selectors.EVENT_READ,
+    ) -> None:
+        """Call ``callback(fd, events)`` whenever the descriptor is ready.
+
+        Args:
+            fd (int): The file descriptor
+            callback (Callable[[int, int], None]): Called with the descriptor and the
+                events it is ready for
+            events (int): The selectors events to wait for
+        """
+        try:
+            self._selector.register(fd, events, callback)
+        except PermissionError:
+            self._always_ready[fd] = callback
+
+    def unregister(self, fd: int) -> None:
+        """Stop watching a descriptor.
+
+        Args:
+            fd (int): The file descriptor
+        """
+        if self._always_ready.pop(fd, None) is None:
+            self._selector.unregister(fd)
+
+    def is_registered(self, fd: int) -> bool:
+        """Check whether a descriptor is watched, for instance by another command.
+
+        Args:
+            fd (int): The file descriptor
+
+        Returns:
+            bool: True if the descriptor is registered
+        """
+        return fd in self._always_ready or fd in self._selector.get_map()
+
+    def poll(self, timeout: Optional[float] = None) -> int:
+        """Wait for descriptors to be ready, and call back every one of them.
+
+        Args:
+            timeout (float): The maximum number of seconds to wait, None to block
+
+        Returns:
+            int: The number of descriptors that were serviced
+        """
+        if self._always_ready:
+            timeout = 0
+        ready = [
+            (key.fd, key.data, mask) for key, mask in self._selector.select(timeout)
+        ]
+        ready.extend(
+            (fd, callback, selectors.EVENT_READ)
+            for fd, callback in self._always_ready.items()
+        )
+        for fd, callback, mask in ready:
+            callback(fd, mask)
+        return len(ready)
+
+    def close(self) -> None:
+        """Close the selector."""
+        self._selector.close()
+
+
+class ShellProcess:
+    """A shell command whose pipes are serviced by a SelectorEngine.
+
+    Output read from the process, and user input forwarded to it, are queued in
+    ``chunks`` as (role, bytes) tuples, to be consumed by the caller. Output, and
+    automatic responses, are also echoed by ``echo``, if set.
+
+    With ``stdin_data``, the user's input is not forwarded. The data is written to
+    the process instead, as fast as it reads it, while its output is drained, then
+    its stdin is closed. ``stdin_sent`` counts the bytes it read.
+
+    The process is reaped with wait4(), so ``usage`` holds the resources it used
+    once it exited.
+    """
+
+    def __init__(
+        self,
+        engine: SelectorEngine,
+        command_line: str,
+        forward_stdin: bool = True,
+        limits: Optional["ResourceLimits"] = None,
+        spawn_backend: str = POPEN_BACKEND,
+        echo: Optional["EchoWriter"] = None,
+        stdin_data: Optional[bytes] = None,
+    ) -> None:
+        self._engine = engine
+        self._echo = echo
+        self.usage: Optional["ResourceUsage"] = None
+        self.process = spawn(command_line, spawn_backend, limits)
+        self.chunks: deque[tuple[str, bytes]] = deque()
+        self.last_activity = time.monotonic()
+
+        # Grow the read size while reads fill it, shrink it back when output slows
+        self._read_sizes: dict[int, int] = {}
+        # The command is done once it has exited and these are drained to EOF
+        self._output_fds: set[int] = set()
+        self._stdin_fd: Optional[int] = None
+        # The input still to be written, once stdin_data is given
+        self._input: Optional[memoryview] = None
+        self.stdin_sent = 0
+
+        # Output is captured and echoed, user input is captured and forwarded
+        self._watch(self.process.stdout.fileno(), "process")
+        self._output_fds.add(self.process.stdout.fileno())
+        self._watch(self.process.stderr.fileno(), "error")
+        self._output_fds.add(self.process.stderr.fileno())
+        if stdin_data is not None:
+            self._input = memoryview(stdin_data)
+            input_fd = self.process.stdin.fileno()
+            # Write what the pipe can take, and come back when it has room again
+            os.set_blocking(input_fd, False)
+            engine.register(input_fd, self._on_writable, selectors.EVENT_WRITE)
+        # Only one of the commands sharing an engine can receive the user's input
+        elif forward_stdin and not engine.is_registered(sys.stdin.fileno()):
+            self._stdin_fd = sys.stdin.fileno()
+            self._watch(self._stdin_fd, "user")
+
+    @property
+    def done(self) -> bool:
+        """Whether stdout and stderr were drained to EOF."""
+        return not self._output_fds
+
+    def respond(self, data: bytes) -> bool:
+        """Write an automatic response to the process, and echo it.
+
+        Args:
+            data (bytes): The response
+
+        Returns:
+            bool: False if the process closed its stdin
+        """
+        if not write_quietly(self.process.stdin, data):
+            return False
+        self.last_activity = time.monotonic()
+        if self._echo is not None:
+            self._echo.write("user", data)
+        return True
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        """Wait for the process to exit, and record the resources it used.
+
+        Args:
+            timeout (float): The maximum number of seconds to wait, None to block
+
+        Returns:
+            int: The exit code, negative for a signal
+
+        Raises:
+            subprocess.TimeoutExpired: If the process is still running
+        """
+        if self.process.returncode is not None:
+            return self.process.returncode
+
+        from .resources import ResourceUsage
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        interval = 0.001
+        while True:
+            try:
+                pid, status, rusage = os.wait4(
+                    self.process.pid, 0 if deadline is None else os.WNOHANG
+                )
+            except ChildProcessError:
+                # Already reaped by someone else, without its resource usage
+                return self.process.wait()
+            if pid:
+                self.usage = ResourceUsage.from_rusage(rusage)
+                self.process.returncode = os.waitstatus_to_exitcode(status)
+                return self.process.returncode
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(self.process.args, timeout)
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, MAX_REAP_INTERVAL)
+
+    def poll(self, timeout: float = 0) -> Optional[int]:
+        """Return the exit code if the process exited, waiting for at most
+        ``timeout`` seconds, None if it is still running."""
+        try:
+            return self.wait(timeout)
+        except subprocess.TimeoutExpired:
+            return None
+
+    def terminate(self) -> None:
+        """Stop the process and its children."""
+        terminate_process_group(self.process, wait=self.wait)
+
+    def close(self) -> None:
+        """Stop watching the pipes, stop the process if needed, and close the pipes."""
+        for fd in list(self._read_sizes):
+            self._unwatch(fd)
+        self._end_input()
+        if self.poll() is None:
+            self.terminate()
+        close_quietly(self.process.stdin)
+        self.process.stdout.close()
+        self.process.stderr.close()
+
+    def _watch(self, fd: int, role: str) -> None:
+        self._read_sizes[fd] = MIN_READ_SIZE
+        self._engine.register(fd, functools.partial(self._on_readable, role))
+
+    def _unwatch(self, fd: int) -> None:
+        if self._read_sizes.pop(fd, None) is not None:
+            self._engine.unregister(fd)
+
+    def _on_writable(self, fd: int, _events: int) -> None:
+        try:
+            written = os.write(fd, self._input[self.stdin_sent :][:MAX_WRITE_SIZE])
+        except BlockingIOError:
+            return
+        except OSError:
+            # BrokenPipeError: the process closed its stdin without reading it all
+            self._end_input()
+            return
+        self.stdin_sent += written
+        self.last_activity = time.monotonic()
+        if self.stdin_sent == len(self._input):
+            self._end_input()
+
+    def _end_input(self) -> None:
+        """Stop writing stdin_data, and pass the EOF on to the process."""
+        if self._input is None:
+            return
+        self._input = None
+        self._engine.unregister(self.process.stdin.fileno())
+        close_quietly(self.process.stdin)
+
+    def _on_readable(self, role: str, fd: int, _events: int) -> None:
+        read_size = self._read_sizes[fd]
+        data = os.read(fd, read_size)
+        if data == b"":
+            self._unwatch(fd)
+            if fd in self._output_fds:
+                self._output_fds.discard(fd)
+            else:
+                # The user closed stdin, pass the EOF on to the process
+                close_quietly(self.process.stdin)
+            return
+
+        if len(data) == read_size:
+            self._read_sizes[fd] = min(read_size * 2, MAX_READ_SIZE)
+        elif len(data) < read_size // 4:
+            self._read_sizes[fd] = max(read_size // 2, MIN_READ_SIZE)
+        self.last_activity = time.monotonic()
+        if fd in self._output_fds:
+            if self._echo is not None:
+                self._echo.write(role, data)
+        else:
+            try:
+                self.process.stdin.write(data)
+                self.process.stdin.flush()
+            except BrokenPipeError:
+                # The process closed its stdin, stop forwarding user input
+                self._unwatch(fd)
+        self.chunks.append((role, data))
+
+
+class Wait:
+    """A step of a running command: wait for the descriptors of the engine to be
+    ready, and service them, for at most ``seconds``."""
+
+    __slots__ = ("seconds",)
+
+    def __init__(self, seconds: float) -> None:
+        self.seconds = seconds
+
+
+class Call:
+    """A step of a running command that may block, such as reaping the process: call
+    ``function``, and send its result back to the command."""
+
+    __slots__ = ("function",)
+
+    def __init__(self, function: Callable[[], Any]) -> None:
+        self.function = function
+
+
+def terminate_process_group(
+    process: subprocess.Popen,
+    grace_seconds: float = TERMINATE_GRACE_SECONDS,
+    wait: Optional[Callable[[float], int]] = None,
+) -> None:
+    """Stop a process and its children: SIGTERM first, then SIGKILL.
+
+    On Windows, where there are no process groups, only the process is terminated.
+
+    Args:
+        process (subprocess.Popen): A process started in its own session
+        grace_seconds (float): How long the process gets to exit after SIGTERM
+        wait (Callable): Reaps the process, process.wait by default
+    """
+    if sys.platform == "win32":
+        process.kill()
+        process.wait()
+        return
+
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(process.pid, sig)
+        except ProcessLookupError:
+            # The whole group already exited
+            break
+        try:
+            (wait or process.wait)(grace_seconds)
+            break
+        except subprocess.TimeoutExpired:
+            continue
+
+
+def write_quietly(stream, data: bytes) -> bool:
+    """Write to a pipe to a process that may already have exited.
+
+    Returns:
+        bool: True if the data was written, False if the pipe is closed
+    """
+    try:
+        stream.write(data)
+        stream.flush()
+    except (OSError, ValueError):
+        # BrokenPipeError, or ValueError once the pipe was closed on our side
+        return False
+    return True
+
+
+def close_quietly(stream) -> None:
+    """Close a pipe to a process that may already have exited."""
+    try:
+        stream.close()
+    except BrokenPipeError:
+        pass
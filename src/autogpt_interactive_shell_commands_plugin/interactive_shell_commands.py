@@ -1,21 +1,137 @@
 """Execute interactive shell commands in the workspace"""
+import functools
 import os
+import re
 import subprocess
 import sys
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Generator, Iterator, Optional, Union
+
+from .capture import (
+    CommandCapture,
+    ConversationCapture,
+    StreamDecoder,
+    decode_events,
+    flush_events,
+)
+from .engine import (
+    MAX_READ_SIZE,
+    MAX_WRITE_SIZE,
+    MIN_READ_SIZE,
+    Call,
+    SelectorEngine,
+    ShellProcess,
+    Wait,
+    close_quietly,
+    terminate_process_group,
+    write_quietly,
+)
+from .echo import DEFAULT_FLUSH_TIMEOUT, EchoWriter
+from .metrics import CommandMetrics, MetricsSink
+from .spawn import POPEN_BACKEND
+
+if TYPE_CHECKING:
+    # Only imported by the plugin when their features are enabled
+    from .answers import AnswerStore
+    from .cache import ResultCache
+    from .resources import ResourceLimits
+    from .responder import AutoResponder
+    from .shell_logs import ShellLogStore
+
+# Seconds without new output after which the user is asked for a response
+OUTPUT_SETTLE_SECONDS = 0.05
+
+# Seconds between two checks for the user's response, in the cross-platform loop
+STDIN_POLL_SECONDS = 0.05
+
+# Answer to ask_user_batch taking the defaults of the remaining prompts
+DEFAULTS_SHORTCUT = "!defaults"
+
+# Commands of execute_shell_batch running at once by default
+DEFAULT_BATCH_WORKERS = 4
+
+# Bytes of a shell log returned by read_shell_log by default
+DEFAULT_LOG_PAGE_BYTES = 8192
+
+# Bytes of output kept per role in the conversation of a command kept as a shell
+# log, when max_capture_bytes is unlimited; the rest can be read from the log
+DEFAULT_LOGGED_CAPTURE_BYTES = 32 * 1024
 
 
 class InteractiveShellCommands:
-    def __init__(self, default_timeout_seconds) -> None:
+    def __init__(
+        self,
+        default_timeout_seconds,
+        max_capture_bytes: Optional[int] = None,
+        decode_errors: str = "replace",
+        idle_timeout_seconds: Optional[float] = None,
+        session_manager=None,
+        metrics_sink: Optional[MetricsSink] = None,
+        result_cache: Optional["ResultCache"] = None,
+        auto_responder: Optional["AutoResponder"] = None,
+        answer_store: Optional["AnswerStore"] = None,
+        session_idle_seconds: Optional[float] = None,
+        compact_output: bool = True,
+        max_output_tokens: Optional[int] = None,
+        batch_max_workers: int = DEFAULT_BATCH_WORKERS,
+        shell_logs: Optional["ShellLogStore"] = None,
+        recording_dir: Optional[str] = None,
+        resource_limits: Optional["ResourceLimits"] = None,
+        spawn_backend: str = POPEN_BACKEND,
+        headless: bool = False,
+    ) -> None:
         self._default_timeout_seconds = default_timeout_seconds
+        # Keeps the full raw output of each command, to read or grep it later, if set
+        self._shell_logs = shell_logs
+        # Directory where the raw streams of each command are recorded, if set
+        self._recording_dir = recording_dir
+        # RLIMIT caps applied to the commands of the POSIX engine, if set
+        self._resource_limits = resource_limits
+        # How the POSIX engine starts commands: "popen" or "posix_spawn"
+        self._spawn_backend = spawn_backend
+        # Mirrors the conversations to the terminal, None to capture them only
+        self._echo = None if headless else EchoWriter()
+        # Remembers the user's answers to the prompts of ask_user, if set
+        self._answer_store = answer_store
+        # Answers the prompts matching its rules, instead of the user, if set
+        self._auto_responder = auto_responder
+        # Reuses the conversations of read-only commands, if set
+        self._result_cache = result_cache
+        # Called with the CommandMetrics of each command, if set
+        self._metrics_sink = metrics_sink
+        # The CommandMetrics of the last command that ran, if any
+        self._last_command_metrics: Optional[CommandMetrics] = None
+        # ShellSessionManager keeping the named sessions, created on first use if None
+        self._session_manager = session_manager
+        # Seconds a session created on first use can stay unused, None for the default
+        self._session_idle_seconds = session_idle_seconds
+        # Seconds without any output or input before a command is stopped, None to wait
+        self._idle_timeout_seconds = idle_timeout_seconds
+        # Bytes kept per role in each conversation, None to keep everything
+        self._max_capture_bytes = max_capture_bytes
+        # How undecodable output is handled: "replace", "ignore", "strict", ...
+        self._decode_errors = decode_errors
+        # Keep the final state of redrawn lines, and collapse repeated lines
+        self._compact_output = compact_output
+        # Estimated tokens kept per conversation, None to keep everything
+        self._max_output_tokens = max_output_tokens
+        # Commands of execute_shell_batch running at once, unless told otherwise
+        self._batch_max_workers = batch_max_workers
 
     def execute_interactive_shell(
-        self, command_line: str, timeout_seconds: int = None
+        self,
+        command_line: str,
+        timeout_seconds: int = None,
+        stdin_data: Optional[Union[str, bytes]] = None,
     ) -> list[dict]:
         """Execute a shell command that requires interactivity and return the output.
 
         Args:
             command_line (str): The command line to execute
             timeout_seconds (int): The timeout in seconds
+            stdin_data (str | bytes): Input fed to the command's stdin, which is then
+                closed, instead of forwarding the user's input
 
         Returns:
             list[dict]: The interaction between the user and the process, as a list of dictionaries: [{role: "user"|"process"|"error", content: "the content of the interaction"}, ...]
@@ -23,77 +139,379 @@ class InteractiveShellCommands:
         if timeout_seconds is None:
             timeout_seconds = self._default_timeout_seconds
 
+        # The result of a command depends on its input, if any
+        cacheable = (
+            self._result_cache is not None
+            and self._check_cache(command_line)
+            and stdin_data is None
+        )
+        if cacheable:
+            conversation = self._result_cache.get(command_line)
+            if conversation is not None:
+                return conversation
+
+        self._last_command_metrics = None
         if sys.platform == "win32":
-            return self.execute_interactive_shell_crossplatform(
-                command_line, timeout_seconds
+            conversation = self.execute_interactive_shell_crossplatform(
+                command_line, timeout_seconds, stdin_data
             )
         else:
-            return self.execute_interactive_shell_linux(command_line, timeout_seconds)
+            conversation = self.execute_interactive_shell_linux(
+                command_line, timeout_seconds, stdin_data
+            )
+
+        # Answers and timeouts make a conversation specific to this run
+        metrics = self._last_command_metrics
+        if (
+            cacheable
+            and metrics is not None
+            and metrics.timeout is None
+            and not any(event["role"] == "user" for event in conversation)
+        ):
+            self._result_cache.put(command_line, conversation)
+        return conversation
+
+    def _check_cache(self, command_line: str) -> bool:
+        """Check whether a command's result can be cached. Any other command may
+        change files, so the cached results are dropped before it runs."""
+        if self._result_cache.is_cacheable(command_line):
+            return True
+        self._result_cache.clear()
+        return False
+
+    def iter_interactive_shell(
+        self,
+        command_line: str,
+        timeout_seconds: int = None,
+        stdin_data: Optional[Union[str, bytes]] = None,
+    ) -> Iterator[dict]:
+        """Execute a shell command that requires interactivity and yield the interaction
+        as it happens.
+
+        Args:
+            command_line (str): The command line to execute
+            timeout_seconds (int): The timeout in seconds
+            stdin_data (str | bytes): Input fed to the command's stdin, which is then
+                closed, instead of forwarding the user's input
+
+        Yields:
+            dict: Each interaction event as soon as it is read: {role: "user"|"process"|"error", content: "the content of the interaction"}
+        """
+        if self._result_cache is not None:
+            self._check_cache(command_line)
+        if sys.platform == "win32":
+            return self.iter_interactive_shell_crossplatform(
+                command_line, timeout_seconds, stdin_data
+            )
+        else:
+            return self.iter_interactive_shell_linux(
+                command_line, timeout_seconds, stdin_data
+            )
 
     def execute_interactive_shell_linux(
-        self, command_line: str, timeout_seconds: int = None
+        self,
+        command_line: str,
+        timeout_seconds: int = None,
+        stdin_data: Optional[Union[str, bytes]] = None,
     ) -> list[dict]:
         """Execute a shell command that requires interactivity and return the output.
 
         Args:
             command_line (str): The command line to execute
             timeout_seconds (int): The timeout in seconds
+            stdin_data (str | bytes): Input fed to the command's stdin, which is then
+                closed, instead of forwarding the user's input
 
         Returns:
             list[dict]: The interaction between the user and the process, as a list of dictionaries: [{role: "user"|"process"|"error", content: "the content of the interaction"}, ...]
         """
-        import select
+        return self._capture(
+            command_line,
+            "linux",
+            self._iter_linux_chunks(
+                command_line, timeout_seconds, stdin_data=stdin_data
+            ),
+        )
+
+    def iter_interactive_shell_linux(
+        self,
+        command_line: str,
+        timeout_seconds: int = None,
+        stdin_data: Optional[Union[str, bytes]] = None,
+    ) -> Iterator[dict]:
+        """Execute a shell command that requires interactivity and yield the interaction
+        as it happens, instead of waiting for the process to exit.
+
+        Closing the generator before it is exhausted kills the process.
 
+        Args:
+            command_line (str): The command line to execute
+            timeout_seconds (int): The timeout in seconds
+            stdin_data (str | bytes): Input fed to the command's stdin, which is then
+                closed, instead of forwarding the user's input
+
+        Yields:
+            dict: Each interaction event as soon as it is read: {role: "user"|"process"|"error", content: "the content of the interaction"}
+        """
+        return self._iter_events(
+            self._iter_linux_chunks(
+                command_line, timeout_seconds, stdin_data=stdin_data
+            )
+        )
+
+    def _iter_events(
+        self, chunks: Iterator[tuple[str, Union[bytes, str]]]
+    ) -> Iterator[dict]:
+        """Decode the chunks of a command into events, as soon as they are read."""
+        decoder = StreamDecoder(errors=self._decode_errors)
+        for role, data in chunks:
+            yield from decode_events(decoder, role, data)
+        yield from flush_events(decoder)
+
+    def _iter_linux_chunks(
+        self,
+        command_line: str,
+        timeout_seconds: int = None,
+        engine: Optional[SelectorEngine] = None,
+        stdin_data: Optional[Union[str, bytes]] = None,
+    ) -> Iterator[tuple[str, Union[bytes, str]]]:
+        """Run the command and yield the raw (role, bytes) chunks of the interaction,
+        and the messages of the plugin itself, such as timeouts, as (role, str).
+
+        Args:
+            command_line (str): The command line to execute
+            timeout_seconds (int): The timeout in seconds
+            engine (SelectorEngine): An engine shared with other commands, if any
+            stdin_data (str | bytes): Input fed to the command's stdin, which is then
+                closed, instead of forwarding the user's input
+        """
+        own_engine = engine is None
+        if own_engine:
+            engine = SelectorEngine()
+        steps = self._shell_steps(
+            command_line, timeout_seconds, engine, stdin_data, "linux"
+        )
+        try:
+            result = None
+            while True:
+                try:
+                    step = steps.send(result)
+                except StopIteration:
+                    return
+                result = None
+                if isinstance(step, Wait):
+                    engine.poll(step.seconds)
+                elif isinstance(step, Call):
+                    result = step.function()
+                else:
+                    yield step
+        finally:
+            # Also reached when the caller stops iterating early
+            steps.close()
+            if own_engine:
+                engine.close()
+
+    def _shell_steps(
+        self,
+        command_line: str,
+        timeout_seconds: Optional[int],
+        engine,
+        stdin_data: Optional[Union[str, bytes]],
+        engine_name: str,
+    ) -> Generator:
+        """Run the command on a ShellProcess, whatever drives its engine.
+
+        Yields the (role, data) chunks of the interaction, like _iter_linux_chunks,
+        and the steps its driver carries out: a Wait for the pipes of the engine, or
+        a Call that may block, whose result is sent back. So the engine is polled
+        here by _iter_linux_chunks, and awaited on an event loop by the async engine.
+
+        Args:
+            command_line (str): The command line to execute
+            timeout_seconds (int): The timeout in seconds
+            engine: The SelectorEngine, or an engine with the same interface
+            stdin_data (str | bytes): Input fed to the command's stdin, which is then
+                closed, instead of forwarding the user's input
+            engine_name (str): The engine named in the metrics
+        """
         if timeout_seconds is None:
             timeout_seconds = self._default_timeout_seconds
 
-        process = subprocess.Popen(
+        deadline = time.monotonic() + float(timeout_seconds)
+        idle_timeout = (
+            float(self._idle_timeout_seconds) if self._idle_timeout_seconds else None
+        )
+
+        if isinstance(stdin_data, str):
+            stdin_data = stdin_data.encode()
+
+        metrics = CommandMetrics(command_line, engine_name)
+        shell = ShellProcess(
+            engine,
             command_line,
-            shell=True,
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
+            limits=self._resource_limits,
+            spawn_backend=self._spawn_backend,
+            echo=self._echo,
+            stdin_data=stdin_data,
         )
+        metrics.spawned()
+        matcher = self._auto_responder.matcher() if self._auto_responder else None
 
-        # To capture the conversation, we'll read from one set of descriptors, save the output and write it to the other set descriptors.
-        fd_map = {
-            process.stdout.fileno(): ("process", sys.stdout.buffer),
-            process.stderr.fileno(): ("error", sys.stderr.buffer),
-            sys.stdin.fileno(): ("user", process.stdin),  # Already buffered
-        }
+        try:
+            if stdin_data is not None:
+                metrics.add_chunk("user", len(stdin_data))
+                yield "user", _input_summary(stdin_data)
+            while True:
+                while shell.chunks:
+                    role, data = shell.chunks.popleft()
+                    metrics.add_chunk(role, len(data))
+                    yield role, data
+                    if matcher is None or role == "user":
+                        continue
+                    for response in matcher.feed(role, data):
+                        if shell.respond(response):
+                            metrics.add_chunk("user", len(response))
+                            yield "user", response
+                if shell.done:
+                    break
 
-        conversation = []
+                now = time.monotonic()
+                if now >= deadline:
+                    metrics.timeout = "deadline"
+                    yield Call(shell.terminate)
+                    yield "error", f"Timeout after {timeout_seconds} seconds"
+                    return
+                if idle_timeout and now - shell.last_activity >= idle_timeout:
+                    metrics.timeout = "idle"
+                    yield Call(shell.terminate)
+                    yield "error", f"No output for {idle_timeout:g} seconds"
+                    return
 
-        while True:
-            read_fds, _, _ = select.select(list(fd_map.keys()), [], [])
-            input_fd = next(fd for fd in read_fds if fd in fd_map)
-            role, output_buffer = fd_map[input_fd]
+                wait_seconds = deadline - now
+                if idle_timeout:
+                    wait_seconds = min(
+                        wait_seconds, shell.last_activity + idle_timeout - now
+                    )
+                yield Wait(wait_seconds)
 
-            input_buffer = os.read(input_fd, 1024)
-            if input_buffer == b"":
-                break
-            output_buffer.write(input_buffer)
-            output_buffer.flush()
-            content = input_buffer.decode("utf-8")
-            content = (
-                content.replace("\r", "").replace("\n", " ").strip() if content else ""
+            if stdin_data is not None and shell.stdin_sent < len(stdin_data):
+                yield "error", _unread_input_message(shell.stdin_sent, stdin_data)
+            returncode = yield Call(
+                functools.partial(shell.poll, max(deadline - time.monotonic(), 0))
             )
-            conversation.append({"role": role, "content": content})
+            if returncode is None:
+                metrics.timeout = "deadline"
+                yield Call(shell.terminate)
+                yield "error", f"Timeout after {timeout_seconds} seconds"
+            else:
+                message = self._limit_message(returncode)
+                if message:
+                    yield "error", message
+        finally:
+            shell.close()
+            self._flush_echo()
+            metrics.finish(shell.process.returncode)
+            metrics.usage = shell.usage
+            self._emit_metrics(metrics)
 
+    def _flush_echo(self) -> None:
+        """Let the terminal catch up with a command that is done, for a while."""
+        if self._echo is not None:
+            self._echo.flush(DEFAULT_FLUSH_TIMEOUT)
+
+    def _limit_message(self, returncode: Optional[int]) -> Optional[str]:
+        """Return why a command was stopped, if it exceeded a resource limit."""
+        if not self._resource_limits:
+            return None
+        from .resources import limit_exceeded
+
+        limit = limit_exceeded(returncode)
+        return f"Stopped by the {limit} limit" if limit else None
+
+    def _capture(
+        self,
+        command_line: str,
+        engine: str,
+        chunks: Iterator[tuple[str, Union[bytes, str]]],
+    ) -> list[dict]:
+        """Capture the conversation of a command from its chunks, keeping them in a
+        shell log and a recording if they are enabled."""
+        capture = self._begin_capture(command_line, engine)
         try:
-            process.wait(timeout=timeout_seconds)
-            process.stdin.close()
-            process.stdout.close()
-            process.stderr.close()
-        except subprocess.TimeoutExpired:
-            conversation.append(
-                {"role": "error", "content": f"Timeout after {timeout_seconds} seconds"}
+            for role, data in chunks:
+                capture.add(role, data)
+        finally:
+            capture.close()
+        return capture.to_conversation()
+
+    def _begin_capture(self, command_line: str, engine: str) -> CommandCapture:
+        """Start the capture of a command, with a shell log and a recording if they
+        are enabled."""
+        log_id, log = self._shell_logs.new() if self._shell_logs else (None, None)
+        settings = self._capture_settings(logged=log is not None)
+        return CommandCapture(
+            ConversationCapture(**settings),
+            log_id,
+            log,
+            self._new_recorder(command_line, engine, settings),
+        )
+
+    def _new_recorder(self, command_line: str, engine: str, capture_settings: dict):
+        """Start the recording of a command, if recordings are enabled, without ever
+        failing the command itself."""
+        if self._recording_dir is None:
+            return None
+        from .recording import RecordingWriter
+
+        try:
+            return RecordingWriter.create(
+                self._recording_dir,
+                {
+                    "command_line": command_line,
+                    "engine": engine,
+                    "cwd": os.getcwd(),
+                    "started": time.time(),
+                    # So that a replay captures the conversation the same way
+                    "capture": capture_settings,
+                },
             )
+        except OSError as error:
+            print(f"Could not record the command: {error}", file=sys.stderr)
+            return None
 
-        return conversation
+    def _new_capture(self) -> ConversationCapture:
+        """Return a capture for the conversation of a new command."""
+        return ConversationCapture(**self._capture_settings())
+
+    def _capture_settings(self, logged: bool = False) -> dict:
+        """Return the arguments of the ConversationCapture of a command, bounded when
+        its full output is kept in a shell log."""
+        max_bytes = self._max_capture_bytes
+        if logged and not max_bytes:
+            max_bytes = DEFAULT_LOGGED_CAPTURE_BYTES
+        return {
+            "max_bytes": max_bytes,
+            "decode_errors": self._decode_errors,
+            "compact": self._compact_output,
+            "max_tokens": self._max_output_tokens,
+        }
+
+    def _emit_metrics(self, metrics: CommandMetrics) -> None:
+        """Keep the metrics of a command, and send them to the sink, if any, without
+        ever failing the command itself."""
+        self._last_command_metrics = metrics
+        if self._metrics_sink is None:
+            return
+        try:
+            self._metrics_sink(metrics)
+        except Exception as error:  # pylint: disable=broad-except
+            print(f"Could not record command metrics: {error}", file=sys.stderr)
 
     def execute_interactive_shell_crossplatform(
-        self, command_line: str, timeout_seconds: int = None
+        self,
+        command_line: str,
+        timeout_seconds: int = None,
+        stdin_data: Optional[Union[str, bytes]] = None,
     ) -> list[dict]:
         """Execute a shell command that requires interactivity and return the output.
         This can also work on linux, but is less native than the other function.
@@ -101,86 +519,541 @@ class InteractiveShellCommands:
         Args:
             command_line (str): The command line to execute
             timeout_seconds (int): The timeout in seconds
+            stdin_data (str | bytes): Input fed to the command's stdin, which is then
+                closed, instead of forwarding the user's input
 
         Returns:
             list[dict]: The interaction between the user and the process, as a list of dictionaries: [{role: "user"|"process"|"error", content: "the content of the interaction"}, ...]
         """
+        return self._capture(
+            command_line,
+            "crossplatform",
+            self._iter_crossplatform_chunks(command_line, timeout_seconds, stdin_data),
+        )
+
+    def iter_interactive_shell_crossplatform(
+        self,
+        command_line: str,
+        timeout_seconds: int = None,
+        stdin_data: Optional[Union[str, bytes]] = None,
+    ) -> Iterator[dict]:
+        """Execute a shell command that requires interactivity and yield the interaction
+        as it happens. This can also work on linux, but is less native than the other
+        function.
+
+        Closing the generator before it is exhausted kills the process.
+
+        Args:
+            command_line (str): The command line to execute
+            timeout_seconds (int): The timeout in seconds
+            stdin_data (str | bytes): Input fed to the command's stdin, which is then
+                closed, instead of forwarding the user's input
+
+        Yields:
+            dict: Each interaction event as soon as it is read: {role: "user"|"process"|"error", content: "the content of the interaction"}
+        """
+        return self._iter_events(
+            self._iter_crossplatform_chunks(command_line, timeout_seconds, stdin_data)
+        )
+
+    def _iter_crossplatform_chunks(
+        self,
+        command_line: str,
+        timeout_seconds: int = None,
+        stdin_data: Optional[Union[str, bytes]] = None,
+    ) -> Iterator[tuple[str, Union[bytes, str]]]:
+        """Run the command and yield the raw (role, bytes) chunks of the interaction,
+        and the messages of the plugin itself, such as timeouts, as (role, str).
+
+        A thread per output pipe queues what it reads, so the loop wakes up as soon as
+        either stream has data, and knows the command is done when both reached EOF.
+        Once the output settles, the user is asked for a response to send to the
+        process, unless stdin_data is written to it instead, from another thread.
+        While the user is asked, stdin is polled between the waits for output, so the
+        timeouts still apply, and nothing is left reading stdin once the command ends.
+        """
+        import queue
+        import threading
+
         if timeout_seconds is None:
             timeout_seconds = self._default_timeout_seconds
 
-        from sarge import Capture, Command
+        deadline = time.monotonic() + float(timeout_seconds)
+        idle_timeout = (
+            float(self._idle_timeout_seconds) if self._idle_timeout_seconds else None
+        )
 
-        command = Command(
+        metrics = CommandMetrics(command_line, "crossplatform")
+        matcher = self._auto_responder.matcher() if self._auto_responder else None
+        process = subprocess.Popen(
             command_line,
-            stdout=Capture(buffer_size=1),
-            stderr=Capture(buffer_size=1),
+            shell=True,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            # Own process group, so a timeout also stops the processes it started
+            start_new_session=sys.platform != "win32",
         )
-        command.run(input=subprocess.PIPE, async_=True)
+        metrics.spawned()
 
-        # To capture the conversation, we'll read from one set of descriptors, save the output and write it to the other set descriptors.
-        fd_map = {
-            command.stdout: ("process", sys.stdout.buffer),
-            command.stderr: ("error", sys.stderr.buffer),
-        }
+        # (role, data) chunks, or (role, None) when a stream reached EOF
+        chunks = queue.Queue()
+        for pipe, role in ((process.stdout, "process"), (process.stderr, "error")):
+            threading.Thread(
+                target=self._read_pipe, args=(pipe, role, chunks), daemon=True
+            ).start()
+        open_streams = {"process", "error"}
 
-        conversation = []
+        if isinstance(stdin_data, str):
+            stdin_data = stdin_data.encode()
+        # The number of bytes of stdin_data written so far
+        stdin_sent = [0]
+        if stdin_data is not None:
+            feeder = threading.Thread(
+                target=self._feed_pipe,
+                args=(process.stdin, stdin_data, stdin_sent),
+                daemon=True,
+            )
+            feeder.start()
 
-        while True:
-            output = {fd: fd.read(timeout=0.1) for fd in fd_map.keys()}
-            if not any(output.values()):
-                break
+        last_activity = time.monotonic()
+        # Whether output arrived since the user was last asked for a response
+        awaiting_response = False
+        # Whether the user was asked for a response, and stdin is being polled
+        reading_response = False
+        ends_with_newline = True
+        forward_input = stdin_data is None
 
-            content = ""
-            for fd, output_content in output.items():
-                if output_content:
-                    output_content = (
-                        output_content + b"\n"
-                        if not output_content.endswith(b"\n")
-                        else output_content
-                    )
-                    fd_map[fd][1].write(output_content)
-                    fd_map[fd][1].flush()
-
-                    content = output_content.decode("utf-8")
-                    content = (
-                        content.replace("\r", "").replace("\n", " ").strip()
-                        if content
-                        else ""
-                    )
-                    conversation.append({"role": fd_map[fd][0], "content": content})
+        try:
+            if stdin_data is not None:
+                metrics.add_chunk("user", len(stdin_data))
+                yield "user", _input_summary(stdin_data)
+            while open_streams:
+                now = time.monotonic()
+                if now >= deadline:
+                    metrics.timeout = "deadline"
+                    terminate_process_group(process)
+                    yield "error", f"Timeout after {timeout_seconds} seconds"
+                    return
+                if idle_timeout and now - last_activity >= idle_timeout:
+                    metrics.timeout = "idle"
+                    terminate_process_group(process)
+                    yield "error", f"No output for {idle_timeout:g} seconds"
+                    return
 
-            if any(output.values()):
-                prompt = "Response [None]: "
-                os.write(sys.stdout.fileno(), prompt.encode("utf-8"))
-                stdin = os.read(sys.stdin.fileno(), 1024)
-                if stdin != b"":
+                if reading_response and _stdin_ready():
+                    reading_response = False
+                    last_activity = time.monotonic()
+                    stdin = os.read(sys.stdin.fileno(), MIN_READ_SIZE)
+                    if stdin == b"":
+                        # The user closed stdin, pass the EOF on to the process
+                        forward_input = False
+                        close_quietly(process.stdin)
+                        continue
                     try:
-                        command.stdin.write(stdin)
-                        command.stdin.flush()
-                        content = stdin.decode("utf-8")
-                        content = (
-                            content.replace("\r", "").replace("\n", " ").strip()
-                            if content
-                            else ""
-                        )
-                        conversation.append({"role": "user", "content": content})
+                        process.stdin.write(stdin)
+                        process.stdin.flush()
+                        metrics.add_chunk("user", len(stdin))
+                        yield "user", stdin
                     except (BrokenPipeError, OSError):
                         # Child process already exited
                         print("Command exited... returning.")
+                        forward_input = False
+                    continue
+
+                wait_seconds = deadline - now
+                if idle_timeout:
+                    wait_seconds = min(wait_seconds, last_activity + idle_timeout - now)
+                if awaiting_response:
+                    wait_seconds = min(wait_seconds, OUTPUT_SETTLE_SECONDS)
+                if reading_response:
+                    wait_seconds = min(wait_seconds, STDIN_POLL_SECONDS)
+
+                try:
+                    role, data = chunks.get(timeout=wait_seconds)
+                except queue.Empty:
+                    if (
+                        awaiting_response
+                        and not reading_response
+                        and process.poll() is None
+                    ):
+                        awaiting_response = False
+                        if self._echo is not None:
+                            if not ends_with_newline:
+                                self._echo.write("process", b"\n")
+                            # The prompt must follow the output it answers
+                            self._echo.flush()
+                            os.write(sys.stdout.fileno(), b"Response [None]: ")
+                        ends_with_newline = True
+                        reading_response = True
+                    continue
+
+                if data is None:
+                    open_streams.discard(role)
+                    continue
+                last_activity = time.monotonic()
+                awaiting_response = forward_input
+                ends_with_newline = data.endswith(b"\n")
+                if self._echo is not None:
+                    self._echo.write(role, data)
+                metrics.add_chunk(role, len(data))
+                yield role, data
 
+                # Prompts matching a rule are answered without asking the user
+                for response in matcher.feed(role, data) if matcher else ():
+                    if write_quietly(process.stdin, response):
+                        awaiting_response = False
+                        if self._echo is not None:
+                            self._echo.write("user", response)
+                        ends_with_newline = response.endswith(b"\n")
+                        metrics.add_chunk("user", len(response))
+                        yield "user", response
+
+            if stdin_data is not None:
+                feeder.join(OUTPUT_SETTLE_SECONDS)
+                if stdin_sent[0] < len(stdin_data):
+                    yield "error", _unread_input_message(stdin_sent[0], stdin_data)
+            try:
+                process.wait(timeout=max(deadline - time.monotonic(), 0))
+            except subprocess.TimeoutExpired:
+                metrics.timeout = "deadline"
+                terminate_process_group(process)
+                yield "error", f"Timeout after {timeout_seconds} seconds"
+        finally:
+            # Also reached when the caller stops iterating early
+            if process.poll() is None:
+                terminate_process_group(process)
+            close_quietly(process.stdin)
+            self._flush_echo()
+            metrics.finish(process.returncode)
+            self._emit_metrics(metrics)
+
+    @staticmethod
+    def _feed_pipe(pipe, data: bytes, sent: list[int]) -> None:
+        """Write data to a process's stdin, counting the bytes in ``sent[0]``, then
+        close it."""
+        view = memoryview(data)
+        while sent[0] < len(data):
+            try:
+                pipe.write(view[sent[0] :][:MAX_WRITE_SIZE])
+                pipe.flush()
+            except (OSError, ValueError):
+                # The process closed its stdin, or exited
+                break
+            sent[0] = min(sent[0] + MAX_WRITE_SIZE, len(data))
+        close_quietly(pipe)
+
+    @staticmethod
+    def _read_pipe(pipe, role: str, chunks) -> None:
+        """Queue everything read from a process pipe, then queue its EOF."""
+        with pipe:
+            for data in iter(lambda: pipe.read1(MAX_READ_SIZE), b""):
+                chunks.put((role, data))
+        chunks.put((role, None))
+
+    def execute_shell_batch(
+        self,
+        command_lines: list[str],
+        max_workers: int = None,
+        timeout_seconds: int = None,
+        overall_timeout_seconds: int = None,
+    ) -> list[dict]:
+        """Execute independent shell commands concurrently, and return their output.
+
+        At most ``max_workers`` commands run at once, their pipes all serviced by one
+        SelectorEngine, and each one captured like by execute_interactive_shell. The
+        commands can't be interacted with: their stdin is closed.
+
+        Args:
+            command_lines (list[str]): The command lines to execute
+            max_workers (int): How many commands can run at the same time
+            timeout_seconds (int): The timeout in seconds of each command
+            overall_timeout_seconds (int): The timeout in seconds of the whole batch
+
+        Returns:
+            list[dict]: One result per command line, in the same order: {command_line: "the command line", exit_code: the exit code (negative if killed by a signal, None if the command was not started), conversation: [{role: "process"|"error", content: "the content of the interaction"}, ...]}
+        """
+        results = [
+            {"command_line": command_line, "exit_code": None, "conversation": []}
+            for command_line in command_lines
+        ]
+        if sys.platform == "win32":
+            for result in results:
+                result["conversation"].append(
+                    {"role": "error", "content": "Batches need POSIX pipes"}
+                )
+            return results
+
+        if timeout_seconds is None:
+            timeout_seconds = self._default_timeout_seconds
+        max_workers = max(int(max_workers or self._batch_max_workers), 1)
+        overall_deadline = (
+            time.monotonic() + float(overall_timeout_seconds)
+            if overall_timeout_seconds
+            else None
+        )
+        idle_timeout = (
+            float(self._idle_timeout_seconds) if self._idle_timeout_seconds else None
+        )
+
+        # The commands may change files that cached results depend on
+        if self._result_cache is not None:
+            self._result_cache.clear()
+
+        engine = SelectorEngine()
+        waiting = deque(enumerate(command_lines))
+        # index => (shell, capture, metrics, deadline)
+        running: dict[int, tuple] = {}
+        try:
+            while waiting or running:
+                now = time.monotonic()
+                if overall_deadline is not None and now >= overall_deadline:
+                    break
+                while waiting and len(running) < max_workers:
+                    index, command_line = waiting.popleft()
+                    metrics = CommandMetrics(command_line, "batch")
+                    shell = ShellProcess(
+                        engine,
+                        command_line,
+                        forward_stdin=False,
+                        limits=self._resource_limits,
+                        spawn_backend=self._spawn_backend,
+                        echo=self._echo,
+                    )
+                    metrics.spawned()
+                    close_quietly(shell.process.stdin)
+                    deadline = time.monotonic() + float(timeout_seconds)
+                    running[index] = (shell, self._new_capture(), metrics, deadline)
+
+                # When a deadline or an idle timeout is next due
+                wake_up = [overall_deadline] if overall_deadline is not None else []
+                for index, (shell, capture, metrics, deadline) in list(running.items()):
+                    while shell.chunks:
+                        role, data = shell.chunks.popleft()
+                        metrics.add_chunk(role, len(data))
+                        capture.feed(role, data)
+
+                    now = time.monotonic()
+                    if shell.done and shell.poll() is not None:
+                        pass
+                    elif now >= deadline:
+                        metrics.timeout = "deadline"
+                        capture.append(
+                            "error", f"Timeout after {timeout_seconds} seconds"
+                        )
+                    elif idle_timeout and now - shell.last_activity >= idle_timeout:
+                        metrics.timeout = "idle"
+                        capture.append(
+                            "error", f"No output for {idle_timeout:g} seconds"
+                        )
+                    else:
+                        wake_up.append(deadline)
+                        if idle_timeout:
+                            wake_up.append(shell.last_activity + idle_timeout)
+                        if shell.done:
+                            # Drained, but the process did not exit yet
+                            wake_up.append(now + OUTPUT_SETTLE_SECONDS)
+                        continue
+                    del running[index]
+                    results[index].update(
+                        self._finish_batch_command(shell, capture, metrics)
+                    )
+
+                # Start the next commands right away if workers were freed
+                if running and (not waiting or len(running) >= max_workers):
+                    engine.poll(max(min(wake_up) - time.monotonic(), 0))
+
+            # Commands are left running or waiting only if the batch ran out of time
+            for index, (shell, capture, metrics, _) in running.items():
+                metrics.timeout = "deadline"
+                capture.append(
+                    "error", f"Timeout after {overall_timeout_seconds} seconds (batch)"
+                )
+                results[index].update(
+                    self._finish_batch_command(shell, capture, metrics)
+                )
+            running.clear()
+            for index, _ in waiting:
+                results[index]["conversation"].append(
+                    {
+                        "role": "error",
+                        "content": "Not started: the batch timed out after "
+                        f"{overall_timeout_seconds} seconds",
+                    }
+                )
+        finally:
+            # Also reached if capturing failed
+            for shell, *_ in running.values():
+                shell.close()
+            engine.close()
+            self._flush_echo()
+
+        return results
+
+    def _finish_batch_command(
+        self, shell: ShellProcess, capture: ConversationCapture, metrics: CommandMetrics
+    ) -> dict:
+        """Stop a command of a batch if needed, and return its exit code, resource
+        usage and output."""
+        shell.close()
+        message = self._limit_message(shell.process.returncode)
+        if message:
+            capture.append("error", message)
+        metrics.finish(shell.process.returncode)
+        metrics.usage = shell.usage
+        self._emit_metrics(metrics)
+        return {
+            "exit_code": shell.process.returncode,
+            "usage": shell.usage.to_dict() if shell.usage else None,
+            "conversation": capture.to_conversation(),
+        }
+
+    def execute_in_shell_session(
+        self,
+        session_name: str,
+        command_line: str,
+        timeout_seconds: int = None,
+        input_only: Union[bool, str] = False,
+    ) -> list[dict]:
+        """Execute a shell command in a named, persistent shell session, and return
+        the output. The working directory and environment variables are kept for the
+        next commands sent to the same session.
+
+        Args:
+            session_name (str): The session name, the session is started if needed
+            command_line (str): The command line to execute
+            timeout_seconds (int): The timeout in seconds
+            input_only (bool | str): Type the command line into the program running
+                in the session (a REPL, psql...), and return its output once it
+                settles, instead of waiting for a shell command to finish. The agent
+                passes it as a string, such as "true" or "false"
+
+        Returns:
+            list[dict]: The output of the command, as a list of dictionaries: [{role: "process"|"error", content: "the content of the interaction"}, ...]
+        """
+        if sys.platform == "win32":
+            return [
+                {"role": "error", "content": "Shell sessions need a POSIX terminal"}
+            ]
+
+        from .sessions import SessionTimeout
+
+        if timeout_seconds is None:
+            timeout_seconds = self._default_timeout_seconds
+
+        # The command may change files that cached results depend on
+        if self._result_cache is not None:
+            self._result_cache.clear()
+
+        conversation = self._new_capture()
         try:
-            command.wait(timeout=timeout_seconds)
-        except subprocess.TimeoutExpired:
+            session = self._get_session_manager().get(session_name)
+        except SessionTimeout as timeout:
             conversation.append(
-                {"role": "error", "content": f"Timeout after {timeout_seconds} seconds"}
+                "error", f"Session {session_name} did not start: {timeout}"
             )
+            return conversation.to_conversation()
+        if _is_true(input_only):
+            output = session.send(command_line, timeout_seconds)
+        else:
+            output = session.run(command_line, timeout_seconds)
+        try:
+            while True:
+                data = next(output)
+                if self._echo is not None:
+                    self._echo.write("process", data)
+                conversation.feed("process", data)
+        except StopIteration as stop:
+            if stop.value:
+                conversation.append("error", f"Exit code {stop.value}")
+        except SessionTimeout as timeout:
+            conversation.append("error", f"{timeout}, session {session_name} closed")
 
-        return conversation
+        self._flush_echo()
+        return conversation.to_conversation()
+
+    def close_shell_session(self, session_name: str) -> str:
+        """Close a named shell session, and stop everything running in it.
+
+        Args:
+            session_name (str): The session name
+
+        Returns:
+            str: What happened
+        """
+        if self._get_session_manager().close(session_name):
+            return f"Session {session_name} closed"
+        return f"No session named {session_name}"
+
+    def _get_session_manager(self):
+        if self._session_manager is None:
+            from .sessions import DEFAULT_SESSION_IDLE_SECONDS, ShellSessionManager
+
+            self._session_manager = ShellSessionManager(
+                DEFAULT_SESSION_IDLE_SECONDS
+                if self._session_idle_seconds is None
+                else self._session_idle_seconds
+            )
+        return self._session_manager
+
+    def read_shell_log(
+        self, log_id: int, offset: int = 0, length: int = DEFAULT_LOG_PAGE_BYTES
+    ) -> dict:
+        """Read a page of the full output of a previous command.
+
+        Args:
+            log_id (int): The shell log id, given with the command's output
+            offset (int): The offset of the page in the log, in bytes
+            length (int): The size of the page, in bytes
+
+        Returns:
+            dict: The page: {log_id, size: the size of the log, next_offset: the offset of the next page or None at the end, conversation: [{role, content}, ...]}
+        """
+        log = self._get_shell_log(log_id)
+        if log is None:
+            return {"error": f"No shell log {log_id}"}
+        offset, length = max(int(offset), 0), max(int(length), 1)
+        end = offset + length
+        return {
+            "log_id": int(log_id),
+            "size": log.size,
+            "next_offset": end if end < log.size else None,
+            "conversation": log.slice(offset, length, self._decode_errors),
+        }
+
+    def grep_shell_log(self, log_id: int, pattern: str, max_matches: int = 50) -> dict:
+        """Find the lines of the full output of a previous command matching a regular
+        expression.
+
+        Args:
+            log_id (int): The shell log id, given with the command's output
+            pattern (str): The regular expression
+            max_matches (int): The maximum number of lines returned
+
+        Returns:
+            dict: The matches: {log_id, size: the size of the log, matches: [{role, offset: the offset of the line, to read around it, line}, ...]}
+        """
+        log = self._get_shell_log(log_id)
+        if log is None:
+            return {"error": f"No shell log {log_id}"}
+        try:
+            matches = log.grep(pattern, int(max_matches))
+        except re.error as error:
+            return {"error": f"Invalid pattern {pattern!r}: {error}"}
+        return {"log_id": int(log_id), "size": log.size, "matches": matches}
+
+    def _get_shell_log(self, log_id):
+        if self._shell_logs is None or not str(log_id).strip().isdigit():
+            return None
+        return self._shell_logs.get(int(log_id))
 
     def ask_user(self, prompts: list[str], timeout_seconds: int = None) -> list[str]:
         """
         Ask the user a series of prompts and return the responses
 
+        Prompts with a remembered answer are not asked again. Their answers are
+        returned unchanged, ask_user_batch gives them the "remembered" status.
+
         Args:
             prompts (list[str]): The prompts to ask the user
 
@@ -190,14 +1063,169 @@ class InteractiveShellCommands:
         if timeout_seconds is None:
             timeout_seconds = self._default_timeout_seconds
 
-        from inputimeout import TimeoutOccurred, inputimeout
+        prompter = _inputimeout()
 
         results = []
         try:
             for prompt in prompts:
-                response = inputimeout(prompt, timeout=timeout_seconds)
+                remembered = self._remembered_answer(prompt)
+                if remembered is not None:
+                    # Shown to the user only, the answer itself is returned as given
+                    print(f"{prompt} {remembered} (remembered answer)")
+                    results.append(remembered)
+                    continue
+                response = prompter.inputimeout(prompt, timeout=timeout_seconds)
                 results.append(response)
-        except TimeoutOccurred:
-            results.append(f"Timeout after {timeout_seconds} seconds")
+                self._remember_answer(prompt, response)
+        except prompter.TimeoutOccurred:
+            # Keep the results aligned with the prompts that were not asked
+            results.extend(
+                [f"Timeout after {timeout_seconds} seconds"]
+                * (len(prompts) - len(results))
+            )
+
+        return results
+
+    def ask_user_batch(
+        self,
+        prompts: list[str],
+        defaults: Optional[list[Optional[str]]] = None,
+        timeout_seconds: int = None,
+    ) -> list[dict]:
+        """Ask the user a series of prompts as one form, with a single deadline for
+        the whole form, and return the responses aligned with the prompts.
+
+        An empty answer takes the prompt's default, or skips it if there is none.
+        Answering DEFAULTS_SHORTCUT takes the defaults for the remaining prompts.
+        Once the deadline is reached, the remaining prompts time out. Prompts with a
+        remembered answer are not asked again.
+
+        Args:
+            prompts (list[str]): The prompts to ask the user
+            defaults (list[Optional[str]]): The default response of each prompt
+            timeout_seconds (int): The timeout in seconds for the whole form
+
+        Returns:
+            list[dict]: One result per prompt: {prompt: "the prompt", status: "answered"|"remembered"|"default"|"skipped"|"timed_out", response: "the response or the default, None if there is none"}
+        """
+        if timeout_seconds is None:
+            timeout_seconds = self._default_timeout_seconds
+        defaults = list(defaults or [])
+        defaults += [None] * (len(prompts) - len(defaults))
+
+        prompter = _inputimeout()
+
+        remembered = [self._remembered_answer(prompt) for prompt in prompts]
+        deadline = time.monotonic() + float(timeout_seconds)
+        print(
+            f"Please answer these {len(prompts)} questions within {timeout_seconds} "
+            f"seconds. Leave an answer empty to use its default or skip it, or "
+            f"enter {DEFAULTS_SHORTCUT} to use the defaults for the rest:"
+        )
+        for number, (prompt, default, answer) in enumerate(
+            zip(prompts, defaults, remembered), 1
+        ):
+            if answer is not None:
+                print(f"  {number}. {prompt} (remembered: {answer})")
+            else:
+                print(f"  {number}. {prompt}" + (f" [{default}]" if default else ""))
+
+        results = []
+        use_defaults = False
+        for number, (prompt, default, answer) in enumerate(
+            zip(prompts, defaults, remembered), 1
+        ):
+            result = {"prompt": prompt, "status": "skipped", "response": default}
+            results.append(result)
+            remaining = deadline - time.monotonic()
+            if answer is not None:
+                result["status"] = "remembered"
+                result["response"] = answer
+                continue
+            if use_defaults:
+                response = ""
+            elif remaining <= 0:
+                result["status"] = "timed_out"
+                continue
+            else:
+                try:
+                    response = prompter.inputimeout(
+                        f"{number}. {prompt} ", timeout=remaining
+                    )
+                except prompter.TimeoutOccurred:
+                    # The whole form is out of time
+                    deadline = 0
+                    result["status"] = "timed_out"
+                    continue
+                if response.strip() == DEFAULTS_SHORTCUT:
+                    use_defaults = True
+                    response = ""
+
+            if response:
+                result["status"] = "answered"
+                result["response"] = response
+                self._remember_answer(prompt, response)
+            elif default is not None:
+                result["status"] = "default"
 
         return results
+
+    def _remembered_answer(self, prompt: str) -> Optional[str]:
+        """Return the answer the user already gave to this prompt, if remembered."""
+        if self._answer_store is None:
+            return None
+        return self._answer_store.get(prompt)
+
+    def _remember_answer(self, prompt: str, response: str) -> None:
+        """Remember the user's answer to a prompt, for the next time it is asked."""
+        if self._answer_store is not None and response:
+            self._answer_store.put(prompt, response)
+
+
+def _is_true(value: Union[bool, str, None]) -> bool:
+    """Read a true/false argument, which the agent may give as a string."""
+    if isinstance(value, str):
+        return value.strip().lower() in ("true", "1", "yes")
+    return bool(value)
+
+
+def _input_summary(stdin_data: bytes) -> bytes:
+    """Stand for the stdin_data of a command in its conversation."""
+    return f"[{len(stdin_data)} bytes of input]\n".encode()
+
+
+def _unread_input_message(sent: int, stdin_data: bytes) -> str:
+    """Say that a command exited before reading all of its stdin_data."""
+    return (
+        f"The command exited before reading all of its input: {sent} of "
+        f"{len(stdin_data)} bytes were sent"
+    )
+
+
+def _stdin_ready() -> bool:
+    """Check, without blocking, whether the user's input can be read.
+
+    On Windows, only a console can be polled; other stdin is read when asked.
+    """
+    if sys.platform == "win32":
+        if not sys.stdin.isatty():
+            return True
+        import msvcrt  # pylint: disable=import-outside-toplevel
+
+        return msvcrt.kbhit()
+    import select  # pylint: disable=import-outside-toplevel
+
+    readable, _, _ = select.select([sys.stdin.fileno()], [], [], 0)
+    return bool(readable)
+
+
+@functools.lru_cache(maxsize=None)
+def _inputimeout():
+    """Import inputimeout the first time the user is asked something, and only then.
+
+    The module is returned rather than its functions, so that they are looked up at
+    call time, and can be patched.
+    """
+    import inputimeout
+
+    return inputimeout
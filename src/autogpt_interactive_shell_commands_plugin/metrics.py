@@ -0,0 +1,106 @@
+"""Measure where the time goes when executing shell commands"""
+import json
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import TYPE_CHECKING, Callable, Optional
+
+if TYPE_CHECKING:
+    from .resources import ResourceUsage
+
+
+@dataclass
+class CommandMetrics:
+    """What happened while executing one shell command.
+
+    Durations are in seconds. ``waiting_on_user_seconds`` adds up the time between
+    the last output of the process and each of the user's replies, which is when the
+    process was most likely blocked on the human.
+    """
+
+    command_line: str
+    engine: str
+    started_at: float = field(default_factory=time.time)
+    spawn_seconds: Optional[float] = None
+    first_output_seconds: Optional[float] = None
+    bytes_by_role: dict[str, int] = field(default_factory=dict)
+    chunks_by_role: dict[str, int] = field(default_factory=dict)
+    waiting_on_user_seconds: float = 0.0
+    wall_seconds: Optional[float] = None
+    exit_code: Optional[int] = None
+    # "deadline" or "idle" when the command was stopped by a timeout
+    timeout: Optional[str] = None
+    # What the process used, reported when it was reaped (POSIX engines only)
+    usage: Optional["ResourceUsage"] = None
+
+    def __post_init__(self) -> None:
+        self._start = time.monotonic()
+        self._last_output: Optional[float] = None
+
+    def spawned(self) -> None:
+        """Record that the process was started."""
+        self.spawn_seconds = time.monotonic() - self._start
+
+    def add_chunk(self, role: str, size: int) -> None:
+        """Record a chunk read from, or written to, the process.
+
+        Args:
+            role (str): "user", "process" or "error"
+            size (int): The number of bytes
+        """
+        now = time.monotonic()
+        self.bytes_by_role[role] = self.bytes_by_role.get(role, 0) + size
+        self.chunks_by_role[role] = self.chunks_by_role.get(role, 0) + 1
+        if role == "user":
+            if self._last_output is not None:
+                self.waiting_on_user_seconds += now - self._last_output
+                self._last_output = None
+        else:
+            if self.first_output_seconds is None:
+                self.first_output_seconds = now - self._start
+            self._last_output = now
+
+    def finish(self, exit_code: Optional[int]) -> None:
+        """Record that the command is done.
+
+        Args:
+            exit_code (Optional[int]): The exit code, negative if killed by a signal
+        """
+        self.exit_code = exit_code
+        self.wall_seconds = time.monotonic() - self._start
+
+    def to_dict(self) -> dict:
+        """Return the metrics as a JSON-serializable dictionary."""
+        return asdict(self)
+
+    def summary(self) -> str:
+        """Return a one-line summary of the metrics."""
+        parts = [f"wall {self.wall_seconds or 0:.2f}s"]
+        if self.first_output_seconds is not None:
+            parts.append(f"first output {self.first_output_seconds:.2f}s")
+        if self.waiting_on_user_seconds:
+            parts.append(f"waiting on user {self.waiting_on_user_seconds:.2f}s")
+        parts.append(f"{sum(self.bytes_by_role.values())} bytes")
+        parts.append(f"exit code {self.exit_code}")
+        if self.timeout:
+            parts.append(f"{self.timeout} timeout")
+        if self.usage is not None:
+            parts.append(self.usage.summary())
+        return ", ".join(parts)
+
+
+# A metrics sink is any callable receiving the metrics of each command
+MetricsSink = Callable[[CommandMetrics], None]
+
+
+class JsonLinesMetricsSink:
+    """Append the metrics of each command to a JSON-lines file."""
+
+    def __init__(self, path: str) -> None:
+        self._path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, metrics: CommandMetrics) -> None:
+        line = json.dumps(metrics.to_dict()) + "\n"
+        with self._lock, open(self._path, "a", encoding="utf-8") as file:
+            file.write(line)
@@ -0,0 +1,272 @@
+"""Record the raw streams of commands, and replay them through the capture pipeline
+
+A recording starts with MAGIC, the length of its metadata as a little-endian uint32
+and the metadata as UTF-8 JSON. Each chunk then follows as a RECORD header (the
+microseconds since the previous chunk as a uint32, the role as a byte and the
+length as a uint32) and the raw bytes of the chunk. The messages of the plugin
+itself, such as timeouts, have MESSAGE_FLAG set in their role byte, and are UTF-8.
+
+Usage:
+    python -m autogpt_interactive_shell_commands_plugin.recording RECORDING
+        [--realtime] [--speed 1.0] [--[no-]compact] [--max-bytes N]
+        [--max-tokens N] [--repeat N]
+"""
+import argparse
+import json
+import os
+import struct
+import sys
+import time
+from typing import BinaryIO, Iterator, Optional, Union
+
+from .capture import ConversationCapture
+from .shell_logs import ROLES
+
+MAGIC = b"SHREC\x01"
+RECORD = struct.Struct("<IBI")
+_METADATA_LENGTH = struct.Struct("<I")
+
+# Set in the role byte of the messages that were not read from the process
+MESSAGE_FLAG = 0x80
+
+# Longer gaps between two chunks are recorded as this many microseconds
+MAX_DELAY_US = 2**32 - 1
+
+# File extension of the recordings written by RecordingWriter.create
+EXTENSION = ".shrec"
+
+
+class RecordingWriter:
+    """Write the chunks of a command to a recording as they are captured."""
+
+    def __init__(self, file: BinaryIO, metadata: Optional[dict] = None) -> None:
+        self._file = file
+        self._last_time: Optional[float] = None
+        encoded = json.dumps(metadata or {}).encode()
+        file.write(MAGIC + _METADATA_LENGTH.pack(len(encoded)) + encoded)
+
+    @classmethod
+    def create(cls, directory: str, metadata: Optional[dict] = None):
+        """Start a new recording file, named after the current time, in a directory.
+
+        Args:
+            directory (str): The directory of the recordings, created if needed
+            metadata (dict): What to remember about the command, such as its line
+
+        Returns:
+            RecordingWriter: The writer of the new recording
+        """
+        os.makedirs(directory, exist_ok=True)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{time.monotonic_ns()}"
+        # pylint: disable-next=consider-using-with
+        return cls(open(os.path.join(directory, name + EXTENSION), "wb"), metadata)
+
+    @property
+    def path(self) -> str:
+        """The path of the recording file."""
+        return self._file.name
+
+    def record(
+        self, role: str, data: Union[bytes, str], timestamp: Optional[float] = None
+    ) -> None:
+        """Add a chunk read from (or written to) the process.
+
+        Args:
+            role (str): "user", "process" or "error"
+            data (bytes | str): The chunk, or a message of the plugin such as a timeout
+            timestamp (float): When the chunk was read (time.monotonic()), defaults
+                to now
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+        if self._last_time is None:
+            self._last_time = timestamp
+        delay_us = min(max(round((timestamp - self._last_time) * 1e6), 0), MAX_DELAY_US)
+        self._last_time = timestamp
+        role_byte = ROLES.index(role)
+        if isinstance(data, str):
+            role_byte |= MESSAGE_FLAG
+            data = data.encode()
+        self._file.write(RECORD.pack(delay_us, role_byte, len(data)) + data)
+
+    def close(self) -> None:
+        """Close the recording file."""
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class Recording:
+    """A recording read back: its metadata, and its (seconds, role, data) chunks,
+    timed from the first one. The messages of the plugin are str data."""
+
+    def __init__(
+        self, metadata: dict, chunks: list[tuple[float, str, Union[bytes, str]]]
+    ) -> None:
+        self.metadata = metadata
+        self.chunks = chunks
+
+    @classmethod
+    def load(cls, path: str):
+        """Read a recording file.
+
+        Args:
+            path (str): The path of the recording
+
+        Returns:
+            Recording: The recording
+
+        Raises:
+            ValueError: If the file is not a recording, or is truncated
+        """
+        with open(path, "rb") as file:
+            data = file.read()
+        if not data.startswith(MAGIC):
+            raise ValueError(f"{path} is not a shell recording")
+
+        offset = len(MAGIC) + _METADATA_LENGTH.size
+        (length,) = _METADATA_LENGTH.unpack_from(data, len(MAGIC))
+        metadata = json.loads(data[offset : offset + length])
+        offset += length
+
+        chunks, elapsed_us = [], 0
+        while offset < len(data):
+            if offset + RECORD.size > len(data):
+                raise ValueError(f"{path} is truncated")
+            delay_us, role_byte, length = RECORD.unpack_from(data, offset)
+            offset += RECORD.size
+            if offset + length > len(data):
+                raise ValueError(f"{path} is truncated")
+            elapsed_us += delay_us
+            chunk = data[offset : offset + length]
+            if role_byte & MESSAGE_FLAG:
+                chunk = chunk.decode()
+            role = ROLES[role_byte & ~MESSAGE_FLAG]
+            chunks.append((elapsed_us / 1e6, role, chunk))
+            offset += length
+        return cls(metadata, chunks)
+
+    def new_capture(self, **overrides) -> ConversationCapture:
+        """Return a capture with the settings the command was captured with.
+
+        Args:
+            overrides: ConversationCapture arguments replacing the recorded ones
+
+        Returns:
+            ConversationCapture: The capture
+        """
+        return ConversationCapture(**{**self.metadata.get("capture", {}), **overrides})
+
+    @property
+    def size(self) -> int:
+        """The number of bytes of the chunks."""
+        return sum(
+            len(data.encode() if isinstance(data, str) else data)
+            for _, _, data in self.chunks
+        )
+
+    @property
+    def duration(self) -> float:
+        """The seconds between the first and the last chunk."""
+        return self.chunks[-1][0] if self.chunks else 0.0
+
+
+def iter_replay(
+    recording: Recording, realtime: bool = False, speed: float = 1.0
+) -> Iterator[tuple[str, Union[bytes, str], float]]:
+    """Yield the chunks of a recording, at full speed or with their original timing.
+
+    Args:
+        recording (Recording): The recording
+        realtime (bool): Wait between the chunks as long as when they were recorded
+        speed (float): How much faster than the original the chunks are replayed
+
+    Yields:
+        tuple[str, bytes | str, float]: The role, the data and the recorded timestamp
+    """
+    started = time.monotonic()
+    for seconds, role, data in recording.chunks:
+        if realtime:
+            delay = started + seconds / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        yield role, data, seconds
+
+
+def replay(
+    recording: Recording,
+    capture: Optional[ConversationCapture] = None,
+    realtime: bool = False,
+    speed: float = 1.0,
+) -> list[dict]:
+    """Feed a recording through the capture pipeline, and return the conversation.
+
+    The chunks are fed with their recorded timestamps, so the conversation is the
+    same whatever the speed of the replay.
+
+    Args:
+        recording (Recording): The recording
+        capture (ConversationCapture): The capture to feed, by default one with the
+            settings the command was captured with
+        realtime (bool): Wait between the chunks as long as when they were recorded
+        speed (float): How much faster than the original the chunks are replayed
+
+    Returns:
+        list[dict]: The interaction between the user and the process, as a list of dictionaries: [{role: "user"|"process"|"error", content: "the content of the interaction"}, ...]
+    """
+    if capture is None:
+        capture = recording.new_capture()
+    for role, data, timestamp in iter_replay(recording, realtime, speed):
+        if isinstance(data, str):
+            capture.append(role, data)
+        else:
+            capture.feed(role, data, timestamp)
+    return capture.to_conversation()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("recording")
+    parser.add_argument("--realtime", action="store_true", help="original timing")
+    parser.add_argument("--speed", type=float, default=1.0)
+    # The capture settings default to the recorded ones
+    parser.add_argument(
+        "--compact", action=argparse.BooleanOptionalAction, help="compact the output"
+    )
+    parser.add_argument("--max-bytes", type=int, default=None)
+    parser.add_argument("--max-tokens", type=int, default=None)
+    parser.add_argument("--repeat", type=int, default=1, help="replays to time")
+    args = parser.parse_args()
+
+    recording = Recording.load(args.recording)
+    overrides = {
+        name: value
+        for name, value in (
+            ("compact", args.compact),
+            ("max_bytes", args.max_bytes),
+            ("max_tokens", args.max_tokens),
+        )
+        if value is not None
+    }
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        conversation = replay(
+            recording, recording.new_capture(**overrides), args.realtime, args.speed
+        )
+    elapsed = time.perf_counter() - started
+
+    print(json.dumps(conversation, ensure_ascii=False, indent=2))
+    throughput = recording.size * args.repeat / 1e6 / max(elapsed, 1e-9)
+    print(
+        f"Replayed {len(recording.chunks)} chunks ({recording.size} bytes) "
+        f"{args.repeat} times in {elapsed:.3f} s: {throughput:.1f} MB/s",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Account for, and cap, the resources used by shell commands (POSIX only)"""
+import signal
+import sys
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+# Seconds of CPU time between SIGXCPU and SIGKILL, for commands that ignore SIGXCPU
+CPU_KILL_GRACE_SECONDS = 1
+
+# Signals sent by the kernel when a command exceeds a limit, and what they mean
+_LIMIT_SIGNALS = {
+    signal.SIGXCPU: "CPU time",
+    signal.SIGXFSZ: "file size",
+}
+
+
+@dataclass
+class ResourceUsage:
+    """The resources used by a command and the children it waited for, as reported
+    by wait4() when it was reaped."""
+
+    user_cpu_seconds: float
+    system_cpu_seconds: float
+    max_rss_kib: int
+    # Block input and output operations
+    block_reads: int
+    block_writes: int
+    voluntary_context_switches: int
+    involuntary_context_switches: int
+
+    @classmethod
+    def from_rusage(cls, rusage):
+        """Build from the resource.struct_rusage returned by os.wait4()."""
+        return cls(
+            user_cpu_seconds=rusage.ru_utime,
+            system_cpu_seconds=rusage.ru_stime,
+            # Bytes on macOS, kibibytes elsewhere
+            max_rss_kib=(
+                rusage.ru_maxrss // 1024
+                if sys.platform == "darwin"
+                else rusage.ru_maxrss
+            ),
+            block_reads=rusage.ru_inblock,
+            block_writes=rusage.ru_oublock,
+            voluntary_context_switches=rusage.ru_nvcsw,
+            involuntary_context_switches=rusage.ru_nivcsw,
+        )
+
+    def to_dict(self) -> dict:
+        """Return the usage as a JSON-serializable dictionary."""
+        return asdict(self)
+
+    def summary(self) -> str:
+        """Return a one-line summary of the usage."""
+        return (
+            f"cpu {self.user_cpu_seconds:.2f}s user "
+            f"{self.system_cpu_seconds:.2f}s sys, "
+            f"max rss {self.max_rss_kib / 1024:.1f} MiB"
+        )
+
+
+@dataclass
+class ResourceLimits:
+    """RLIMIT caps set by the shell of a command, before the command is executed.
+
+    Each limit is None when the command inherits the plugin's own limit.
+    """
+
+    address_space_bytes: Optional[int] = None
+    cpu_seconds: Optional[int] = None
+    open_files: Optional[int] = None
+    file_size_bytes: Optional[int] = None
+
+    def __bool__(self) -> bool:
+        return any(value is not None for value in asdict(self).values())
+
+    def shell_prefix(self) -> str:
+        """Return the ulimit commands that set the limits, to put before a command
+        line run with /bin/sh -c.
+
+        The limits are set by the shell itself, so no Python code runs between fork
+        and exec, which is not safe once the plugin has threads. They only lower the
+        current limits, and never raise the hard ones. If a limit can't be set, the
+        shell reports it and the command does not run.
+        """
+        import resource  # pylint: disable=import-outside-toplevel
+
+        commands = []
+        for option, limit, soft, unit in (
+            ("-v", resource.RLIMIT_AS, self.address_space_bytes, 1024),
+            ("-t", resource.RLIMIT_CPU, self.cpu_seconds, 1),
+            ("-n", resource.RLIMIT_NOFILE, self.open_files, 1),
+            # POSIX counts file sizes in blocks of 512 bytes
+            ("-f", resource.RLIMIT_FSIZE, self.file_size_bytes, 512),
+        ):
+            if soft is None:
+                continue
+            hard = soft
+            if limit == resource.RLIMIT_CPU:
+                hard += CPU_KILL_GRACE_SECONDS
+            _, current_hard = resource.getrlimit(limit)
+            if current_hard != resource.RLIM_INFINITY:
+                soft, hard = min(soft, current_hard), min(hard, current_hard)
+            # Without -H or -S, ulimit sets both limits; then lower the soft one
+            commands.append(f"ulimit {option} {hard // unit}")
+            if soft != hard:
+                commands.append(f"ulimit -S {option} {soft // unit}")
+        if not commands:
+            return ""
+        return " && ".join(commands) + " || exit 1; "
+
+
+def limit_exceeded(returncode: Optional[int]) -> Optional[str]:
+    """Tell which limit stopped a command, from its exit code.
+
+    Args:
+        returncode (int): The exit code of the shell, negative for a signal
+
+    Returns:
+        str: The name of the limit, None if the command was not stopped by a limit
+    """
+    for sig, name in _LIMIT_SIGNALS.items():
+        # The shell either executed the command itself, or reports its signal
+        if returncode in (-sig, 128 + sig):
+            return name
+    return None
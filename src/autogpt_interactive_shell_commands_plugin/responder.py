@@ -0,0 +1,157 @@
+"""Answer the predictable prompts of commands without waiting for the user"""
+import json
+import re
+from typing import Iterable, Optional
+
+# Bytes of recent output, per stream, in which prompts are looked for
+DEFAULT_WINDOW_BYTES = 4096
+
+
+# Inline flags at the start of a pattern, such as (?i)
+_GLOBAL_FLAGS = re.compile(r"\(\?([aiLmsux]+)\)")
+
+
+def _scope_flags(pattern: str) -> str:
+    """Turn the inline flags at the start of a pattern, which are only allowed at the
+    start of the whole alternation, into flags scoped to the pattern: (?i)a => (?i:a)
+    """
+    flags = ""
+    match = _GLOBAL_FLAGS.match(pattern)
+    while match:
+        flags += match.group(1)
+        pattern = pattern[match.end() :]
+        match = _GLOBAL_FLAGS.match(pattern)
+    if not flags:
+        return pattern
+    # A comment at the end of a verbose pattern must not hide the closing parenthesis
+    return f"(?{flags}:{pattern}\n)" if "x" in flags else f"(?{flags}:{pattern})"
+
+
+class AutoResponder:
+    """Expect-style rules answering the prompts of interactive commands.
+
+    Each rule is a regular expression, matched against the output of the process,
+    and the response written to its stdin when it matches. The rules are compiled
+    into a single alternation of named groups, so output is scanned once whatever
+    the number of rules. Rules with groups of their own, whose numbers or names
+    would change in the alternation, are kept as patterns of their own. When several
+    rules match at the same place, the first one wins. Responses are written as is,
+    so they usually end with a newline. An invalid pattern raises a ValueError
+    naming its rule.
+    """
+
+    def __init__(
+        self,
+        rules: Iterable[tuple[str, str]],
+        window_bytes: int = DEFAULT_WINDOW_BYTES,
+    ) -> None:
+        # Rule index => response
+        self._responses: list[bytes] = []
+        # (pattern, rule index) pairs, the index None for the alternation
+        self._patterns: list[tuple[re.Pattern, Optional[int]]] = []
+        alternatives = []
+        for index, (pattern, response) in enumerate(rules):
+            scoped = _scope_flags(pattern)
+            try:
+                compiled = re.compile(scoped.encode())
+            except re.error as error:
+                raise ValueError(
+                    f"Invalid pattern in auto-response rule {index + 1} "
+                    f"({pattern!r}): {error}"
+                ) from None
+            if compiled.groups:
+                self._patterns.append((compiled, index))
+            else:
+                alternatives.append(f"(?P<rule{index}>{scoped})")
+            self._responses.append(response.encode())
+        if alternatives:
+            self._patterns.insert(
+                0, (re.compile("|".join(alternatives).encode()), None)
+            )
+        self._window_bytes = window_bytes
+
+    @classmethod
+    def from_file(cls, path: str) -> "AutoResponder":
+        """Load the rules from a JSON file: [{"pattern": ..., "response": ...}, ...]
+
+        Args:
+            path (str): The path of the JSON file
+
+        Returns:
+            AutoResponder: The responder applying the rules, in order
+
+        Raises:
+            OSError: If the file can't be read
+            ValueError: If the file is not JSON, or a pattern is invalid
+        """
+        with open(path, encoding="utf-8") as file:
+            rules = json.load(file)
+        return cls((rule["pattern"], rule["response"]) for rule in rules)
+
+    def __len__(self) -> int:
+        return len(self._responses)
+
+    def matcher(self) -> "PromptMatcher":
+        """Return a matcher for the output of a new command."""
+        return PromptMatcher(self._patterns, self._responses, self._window_bytes)
+
+
+class PromptMatcher:
+    """The recent output of one command, searched for prompts as it is read.
+
+    Only the last ``window_bytes`` of each stream are kept, and output up to the end
+    of a match is dropped once it was answered, so a prompt is answered only once.
+    """
+
+    def __init__(
+        self,
+        patterns: list[tuple[re.Pattern, Optional[int]]],
+        responses: list[bytes],
+        window_bytes: int,
+    ) -> None:
+        self._patterns = patterns
+        self._responses = responses
+        self._window_bytes = window_bytes
+        self._windows: dict[str, bytes] = {}
+
+    def feed(self, role: str, data: bytes) -> list[bytes]:
+        """Add output of the process, and return the responses to the prompts it
+        completed.
+
+        Args:
+            role (str): "process" or "error"
+            data (bytes): The output that was just read
+
+        Returns:
+            list[bytes]: The responses to write to the process, in order
+        """
+        if not self._patterns:
+            return []
+
+        window = self._windows.get(role, b"") + data
+        responses = []
+        answered = position = 0
+        while position <= len(window):
+            found = self._search(window, position)
+            if found is None:
+                break
+            match, index = found
+            responses.append(self._responses[index])
+            answered = match.end()
+            position = answered + (match.end() == match.start())
+        self._windows[role] = window[answered:][-self._window_bytes :]
+        return responses
+
+    def _search(self, window: bytes, position: int) -> Optional[tuple[re.Match, int]]:
+        """Return the first prompt in the window from a position, and its rule index,
+        the first rule winning when several match at the same place."""
+        found = None
+        for pattern, index in self._patterns:
+            match = pattern.search(window, position)
+            if match is None:
+                continue
+            if index is None:
+                index = int(match.lastgroup[len("rule") :])
+            if found is None or (match.start(), index) < (found[0].start(), found[1]):
+                found = (match, index)
+        return found
@@ -0,0 +1,268 @@
+"""Long-lived shell sessions that keep their state between commands"""
+import atexit
+import os
+import pty
+import re
+import subprocess
+import termios
+import time
+import uuid
+from typing import Iterator, Optional
+
+from .engine import MAX_READ_SIZE, SelectorEngine, terminate_process_group
+
+# Seconds a session can stay unused before it is closed
+DEFAULT_SESSION_IDLE_SECONDS = 1800
+
+# Seconds a new shell gets to start and answer its first sentinel
+SESSION_START_TIMEOUT_SECONDS = 10
+
+# Seconds without output after which a program answering input (a REPL, psql...)
+# is considered to wait for more
+DEFAULT_SETTLE_SECONDS = 0.5
+
+
+class SessionTimeout(Exception):
+    """Raised when a command run in a session does not finish in time."""
+
+
+class ShellSession:
+    """A shell running on a pseudo-terminal, that commands are sent to one at a time.
+
+    The working directory, environment variables and activated virtualenvs are kept
+    between commands. The end of each command run() is detected by a unique sentinel
+    that the shell prints after it, along with the command's exit code.
+
+    Programs that keep reading the terminal (a REPL, psql...) never let the shell
+    print the sentinel, so they are driven with send() instead: it writes input as
+    is, and returns the output once it settles.
+    """
+
+    def __init__(self, name: str, shell: str = "/bin/sh") -> None:
+        self.name = name
+        master_fd, slave_fd = pty.openpty()
+
+        # Don't echo the commands and sentinels that are written to the shell
+        attributes = termios.tcgetattr(slave_fd)
+        attributes[3] &= ~termios.ECHO
+        termios.tcsetattr(slave_fd, termios.TCSANOW, attributes)
+
+        self.process = subprocess.Popen(
+            [shell],
+            stdin=slave_fd,
+            stdout=slave_fd,
+            stderr=slave_fd,
+            env={**os.environ, "PS1": "", "PS2": ""},
+            # Own process group, so closing the session also stops what it started
+            start_new_session=True,
+        )
+        os.close(slave_fd)
+        self._master_fd = master_fd
+        self.last_used = time.monotonic()
+
+        # Discard whatever the shell prints while starting up
+        for _ in self.run(":", SESSION_START_TIMEOUT_SECONDS):
+            pass
+
+    @property
+    def alive(self) -> bool:
+        """Whether the shell is still running."""
+        return self.process.poll() is None
+
+    def run(self, command_line: str, timeout_seconds: float) -> Iterator[bytes]:
+        """Run a command in the session, and yield its output as it is read.
+
+        The generator's return value is the command's exit code.
+
+        Args:
+            command_line (str): The command line to execute
+            timeout_seconds (float): The timeout in seconds
+
+        Raises:
+            SessionTimeout: If the command did not finish in time. The session is
+                closed, since the shell is still busy with the command.
+        """
+        self.last_used = time.monotonic()
+        deadline = self.last_used + float(timeout_seconds)
+        token = uuid.uuid4().hex
+        sentinel = re.compile(rb"\r?\n?" + token.encode() + rb":(\d+)\r?\n")
+
+        # The shell reads the whole group, up to the sentinel, before it runs the
+        # command, so a command reading stdin can't consume the sentinel; the group
+        # also keeps a trailing comment from hiding it
+        os.write(
+            self._master_fd,
+            f"{{ {command_line}\n}}; printf '\\n{token}:%s\\n' \"$?\"\n".encode(),
+        )
+        exit_code = yield from self._read(deadline, timeout_seconds, sentinel=sentinel)
+        return exit_code
+
+    def send(
+        self,
+        text: str,
+        timeout_seconds: float,
+        settle_seconds: float = DEFAULT_SETTLE_SECONDS,
+    ) -> Iterator[bytes]:
+        """Type input into the session, and yield the output until it settles.
+
+        Unlike run(), nothing is added to the input, so it reaches whatever reads
+        the terminal: a program started in the session (a REPL, psql...), or the
+        shell itself. The output has settled when nothing was read for
+        settle_seconds, as when the program waits for its next input.
+
+        Args:
+            text (str): The input, a newline is added to submit it
+            timeout_seconds (float): The timeout in seconds
+            settle_seconds (float): Seconds without output that end the response
+
+        Raises:
+            SessionTimeout: If the output did not settle in time. The session is
+                closed, since the program is still busy.
+        """
+        self.last_used = time.monotonic()
+        deadline = self.last_used + float(timeout_seconds)
+        os.write(self._master_fd, f"{text}\n".encode())
+        yield from self._read(deadline, timeout_seconds, settle_seconds=settle_seconds)
+
+    def _read(
+        self,
+        deadline: float,
+        timeout_seconds: float,
+        sentinel: Optional[re.Pattern] = None,
+        settle_seconds: Optional[float] = None,
+    ) -> Iterator[bytes]:
+        """Yield the output of the session until the sentinel is read, or until it
+        settles, and return the exit code of the sentinel, if any."""
+        # Hold back enough bytes to recognize a sentinel split across two reads
+        pending = b""
+        holdback = 48 if sentinel else 0
+        engine = SelectorEngine()
+        ready = []
+        engine.register(self._master_fd, lambda fd, _events: ready.append(fd))
+        last_output = time.monotonic()
+        try:
+            while True:
+                now = time.monotonic()
+                remaining = deadline - now
+                if remaining <= 0:
+                    self.close()
+                    raise SessionTimeout(f"Timeout after {timeout_seconds} seconds")
+                if settle_seconds is not None:
+                    if now - last_output >= settle_seconds:
+                        self.last_used = now
+                        return None
+                    remaining = min(remaining, last_output + settle_seconds - now)
+
+                ready.clear()
+                engine.poll(remaining)
+                if not ready:
+                    continue
+                try:
+                    data = os.read(self._master_fd, MAX_READ_SIZE)
+                except OSError:
+                    # EIO once the shell exited
+                    data = b""
+                if not data:
+                    if pending:
+                        yield pending
+                    self.close()
+                    return self.process.returncode
+                last_output = time.monotonic()
+
+                pending += data
+                match = sentinel.search(pending) if sentinel else None
+                if match:
+                    if match.start():
+                        yield pending[: match.start()]
+                    self.last_used = time.monotonic()
+                    return int(match.group(1))
+                if len(pending) > holdback:
+                    yield pending[: len(pending) - holdback]
+                    pending = pending[len(pending) - holdback :]
+        finally:
+            engine.close()
+
+    def close(self) -> None:
+        """Stop the shell and everything it started."""
+        # Interactive shells ignore SIGTERM, but exit on the EOF of their terminal
+        if self._master_fd is not None:
+            os.close(self._master_fd)
+            self._master_fd = None
+        if self.alive:
+            terminate_process_group(self.process)
+
+
+class ShellSessionManager:
+    """Keep named shell sessions alive between commands, and close idle ones.
+
+    There is no background timer, which could close a session while a command is
+    sent to it: idle sessions are closed the next time a session is requested with
+    get(), or reap_idle() is called, and every session is closed at exit.
+    """
+
+    def __init__(
+        self,
+        idle_seconds: float = DEFAULT_SESSION_IDLE_SECONDS,
+        shell: str = "/bin/sh",
+    ) -> None:
+        self._idle_seconds = float(idle_seconds) if idle_seconds else None
+        self._shell = shell
+        self._sessions: dict[str, ShellSession] = {}
+        atexit.register(self.close_all)
+
+    def get(self, name: str) -> ShellSession:
+        """Return the named session, starting it if needed.
+
+        Args:
+            name (str): The session name
+
+        Returns:
+            ShellSession: The running session
+        """
+        self.reap_idle()
+        session = self._sessions.get(name)
+        if session is None or not session.alive:
+            session = self._sessions[name] = ShellSession(name, self._shell)
+        return session
+
+    def close(self, name: str) -> bool:
+        """Close the named session.
+
+        Args:
+            name (str): The session name
+
+        Returns:
+            bool: True if the session existed
+        """
+        session = self._sessions.pop(name, None)
+        if session is None:
+            return False
+        session.close()
+        return True
+
+    def reap_idle(self) -> list[str]:
+        """Close the sessions that exited, or were not used for too long.
+
+        Returns:
+            list[str]: The names of the closed sessions
+        """
+        now = time.monotonic()
+        reaped = [
+            name
+            for name, session in self._sessions.items()
+            if not session.alive
+            or (self._idle_seconds and now - session.last_used > self._idle_seconds)
+        ]
+        for name in reaped:
+            self.close(name)
+        return reaped
+
+    def close_all(self) -> None:
+        """Close every session."""
+        for name in list(self._sessions):
+            self.close(name)
+
+    @property
+    def names(self) -> list[str]:
+        """The names of the open sessions."""
+        return list(self._sessions)
@@ -0,0 +1,226 @@
+"""Keep the full raw output of commands, to page through or grep it afterwards"""
+import atexit
+import mmap
+import os
+import re
+import tempfile
+from array import array
+from collections import OrderedDict
+from typing import Iterator, Optional
+
+from .capture import normalize_content
+
+# Bytes kept in memory before a log is spilled to a temporary file
+DEFAULT_SPILL_BYTES = 1024 * 1024
+
+# Logs kept by a ShellLogStore before the oldest is deleted
+DEFAULT_MAX_LOGS = 20
+
+# Roles are stored as their index in this tuple
+ROLES = ("user", "process", "error")
+
+
+class RawCapture:
+    """The raw bytes of a command's conversation, with events that only point to them.
+
+    Bytes are appended to an in-memory bytearray, moved to a temporary file once they
+    exceed ``spill_bytes``. Each event is a role, an offset and a length, stored in
+    compact arrays; consecutive chunks of the same role extend the same event. Text
+    is only decoded when an event or a range is read, from a memory map of the file
+    for spilled logs.
+    """
+
+    def __init__(
+        self, spill_bytes: int = DEFAULT_SPILL_BYTES, directory: Optional[str] = None
+    ) -> None:
+        self._spill_bytes = spill_bytes
+        self._directory = directory
+        self._buffer: Optional[bytearray] = bytearray()
+        self._file = None
+        self._map: Optional[mmap.mmap] = None
+        self._size = 0
+        self._roles = array("B")
+        self._offsets = array("Q")
+        self._lengths = array("Q")
+
+    @property
+    def size(self) -> int:
+        """The number of bytes captured."""
+        return self._size
+
+    @property
+    def path(self) -> Optional[str]:
+        """The path of the spill file, None while the log is in memory."""
+        return self._file.name if self._file else None
+
+    def __len__(self) -> int:
+        return len(self._roles)
+
+    def append(self, role: str, data: bytes) -> None:
+        """Add a chunk read from (or written to) the process.
+
+        Args:
+            role (str): "user", "process" or "error"
+            data (bytes): The chunk
+        """
+        if not data:
+            return
+        role_index = ROLES.index(role)
+        if self._roles and self._roles[-1] == role_index:
+            self._lengths[-1] += len(data)
+        else:
+            self._roles.append(role_index)
+            self._offsets.append(self._size)
+            self._lengths.append(len(data))
+        self._size += len(data)
+
+        if self._file is not None:
+            self._file.write(data)
+            return
+        self._buffer += data
+        if len(self._buffer) > self._spill_bytes:
+            self._file = tempfile.NamedTemporaryFile(
+                prefix="shell-log-", suffix=".raw", dir=self._directory, delete=False
+            )
+            self._file.write(self._buffer)
+            self._buffer = None
+
+    def events(self) -> Iterator[tuple[str, int, int]]:
+        """Yield the (role, offset, length) of each event, without reading them."""
+        for role_index, offset, length in zip(
+            self._roles, self._offsets, self._lengths
+        ):
+            yield ROLES[role_index], offset, length
+
+    def read(self, offset: int, length: int) -> bytes:
+        """Return a range of the raw bytes.
+
+        Args:
+            offset (int): The offset of the first byte
+            length (int): The number of bytes
+
+        Returns:
+            bytes: The bytes, fewer at the end of the log
+        """
+        return self._data()[offset : offset + length]
+
+    def slice(self, offset: int, length: int, errors: str = "replace") -> list[dict]:
+        """Decode the events overlapping a range of bytes, cut to the range.
+
+        Args:
+            offset (int): The offset of the first byte
+            length (int): The number of bytes
+            errors (str): How undecodable bytes are handled (see codecs)
+
+        Returns:
+            list[dict]: The events of the range: [{role: "user"|"process"|"error", content: "the content of the interaction"}, ...]
+        """
+        data = self._data()
+        end = offset + length
+        conversation = []
+        for role, event_offset, event_length in self.events():
+            start, stop = max(offset, event_offset), min(
+                end, event_offset + event_length
+            )
+            if start >= stop:
+                continue
+            content = normalize_content(data[start:stop].decode("utf-8", errors))
+            if content:
+                conversation.append({"role": role, "content": content})
+        return conversation
+
+    def grep(self, pattern: str, max_matches: int = 50) -> list[dict]:
+        """Find the lines matching a regular expression.
+
+        Args:
+            pattern (str): The regular expression
+            max_matches (int): The maximum number of lines returned
+
+        Returns:
+            list[dict]: The matching lines: [{role, offset: the offset of the line, line}, ...]
+        """
+        line_pattern = re.compile(
+            rb"^[^\n]*(?:" + pattern.encode() + rb")[^\n]*$", re.MULTILINE
+        )
+        matches = []
+        with memoryview(self._data()) as data:
+            for role, offset, length in self.events():
+                # Searched on its own, so that ^ also matches where an event starts
+                # mid-line, such as an answer after a prompt
+                with data[offset : offset + length] as event:
+                    for match in line_pattern.finditer(event):
+                        line = match.group().decode("utf-8", "replace")
+                        matches.append(
+                            {
+                                "role": role,
+                                "offset": offset + match.start(),
+                                "line": normalize_content(line),
+                            }
+                        )
+                        if len(matches) >= max_matches:
+                            return matches
+        return matches
+
+    def close(self) -> None:
+        """Release the memory map, and delete the spill file."""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            os.unlink(self._file.name)
+            self._file = None
+        self._buffer = bytearray()
+
+    def _data(self):
+        """Return the bytes captured so far, as a bytearray or a memory map."""
+        if self._file is None:
+            return self._buffer
+        if self._map is None or len(self._map) != self._size:
+            self._file.flush()
+            if self._map is not None:
+                self._map.close()
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+
+class ShellLogStore:
+    """The raw logs of the last commands, identified by a number.
+
+    Only the last ``max_logs`` logs are kept, older ones are closed and their spill
+    files deleted, as are all of them when Python exits.
+    """
+
+    def __init__(
+        self,
+        max_logs: int = DEFAULT_MAX_LOGS,
+        spill_bytes: int = DEFAULT_SPILL_BYTES,
+        directory: Optional[str] = None,
+    ) -> None:
+        self._max_logs = max_logs
+        self._spill_bytes = spill_bytes
+        self._directory = directory
+        self._logs: OrderedDict[int, RawCapture] = OrderedDict()
+        self._next_id = 1
+        atexit.register(self.close_all)
+
+    def new(self) -> tuple[int, RawCapture]:
+        """Start the log of a new command.
+
+        Returns:
+            tuple[int, RawCapture]: The log id, and the log to append to
+        """
+        log_id, self._next_id = self._next_id, self._next_id + 1
+        log = self._logs[log_id] = RawCapture(self._spill_bytes, self._directory)
+        while len(self._logs) > self._max_logs:
+            self._logs.popitem(last=False)[1].close()
+        return log_id, log
+
+    def get(self, log_id: int) -> Optional[RawCapture]:
+        """Return a log, None if there is no such log, or it was deleted."""
+        return self._logs.get(log_id)
+
+    def close_all(self) -> None:
+        """Close every log."""
+        while self._logs:
+            self._logs.popitem()[1].close()
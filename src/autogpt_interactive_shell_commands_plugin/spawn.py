@@ -0,0 +1,170 @@
+"""Start shell commands with posix_spawn(), skipping the shell when it is not needed
+
+fork() copies the page tables of the whole Auto-GPT process, which gets slower as
+the agent grows, and every command line also pays for starting /bin/sh. The
+"posix_spawn" backend starts commands with os.posix_spawn(), which uses vfork() or
+clone(CLONE_VM) where available, and executes the program directly when the
+command line is a plain list of words.
+"""
+import os
+import shlex
+import shutil
+import subprocess
+import time
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from .resources import ResourceLimits
+
+# Start commands with subprocess.Popen(shell=True), as always
+POPEN_BACKEND = "popen"
+# Start commands with os.posix_spawn(), without /bin/sh for plain command lines
+POSIX_SPAWN_BACKEND = "posix_spawn"
+SPAWN_BACKENDS = (POPEN_BACKEND, POSIX_SPAWN_BACKEND)
+
+# Command lines with these need the shell: operators, redirections, expansions,
+# globs and comments. Quoted ones too, to keep the check simple.
+_SHELL_SYNTAX = frozenset(";&|<>`$()\n*?[]{}~#!")
+
+# Commands that only exist, or only have their effect, in the shell
+SHELL_BUILTINS = frozenset(
+    {
+        ".", ":", "alias", "bg", "break", "builtin", "case", "cd", "command",
+        "continue", "declare", "dirs", "eval", "exec", "exit", "export", "fg",
+        "for", "function", "getopts", "hash", "if", "jobs", "let", "local", "popd",
+        "pushd", "read", "readonly", "return", "select", "set", "shift", "source",
+        "time", "times", "trap", "type", "typeset", "ulimit", "umask", "unalias",
+        "unset", "until", "wait", "while",
+    }
+)  # fmt: skip
+
+# Longest sleep between two checks for the exit of a process
+_MAX_POLL_INTERVAL = 0.05
+
+
+def split_command(command_line: str) -> Optional[list[str]]:
+    """Split a command line that can be executed without the shell.
+
+    Args:
+        command_line (str): The command line
+
+    Returns:
+        list[str]: The program, resolved in PATH, and its arguments, None if the
+            command line needs the shell
+    """
+    if _SHELL_SYNTAX.intersection(command_line):
+        return None
+    try:
+        argv = shlex.split(command_line)
+    except ValueError:
+        # Unbalanced quotes, for the shell to report
+        return None
+    if not argv or argv[0] in SHELL_BUILTINS or "=" in argv[0]:
+        return None
+    program = shutil.which(argv[0])
+    if program is None:
+        # Not found, for the shell to report as usual
+        return None
+    return [program] + argv[1:]
+
+
+class SpawnedProcess:
+    """The part of subprocess.Popen used by ShellProcess, for a process started
+    with os.posix_spawn() in its own session, its standard streams piped."""
+
+    def __init__(self, argv: list[str]) -> None:
+        self.args = argv
+        self.returncode: Optional[int] = None
+
+        # Pipes are created close-on-exec, so only their dup2() copies are inherited
+        stdin_read, stdin_write = os.pipe()
+        stdout_read, stdout_write = os.pipe()
+        stderr_read, stderr_write = os.pipe()
+        try:
+            self.pid = os.posix_spawn(
+                argv[0],
+                argv,
+                os.environ,
+                file_actions=[
+                    (os.POSIX_SPAWN_DUP2, stdin_read, 0),
+                    (os.POSIX_SPAWN_DUP2, stdout_write, 1),
+                    (os.POSIX_SPAWN_DUP2, stderr_write, 2),
+                ],
+                # Own process group, so a timeout also stops the processes it started
+                setsid=True,
+            )
+        except BaseException:
+            for fd in (stdin_write, stdout_read, stderr_read):
+                os.close(fd)
+            raise
+        finally:
+            for fd in (stdin_read, stdout_write, stderr_write):
+                os.close(fd)
+
+        self.stdin = open(stdin_write, "wb")  # pylint: disable=consider-using-with
+        self.stdout = open(stdout_read, "rb")  # pylint: disable=consider-using-with
+        self.stderr = open(stderr_read, "rb")  # pylint: disable=consider-using-with
+
+    def poll(self) -> Optional[int]:
+        """Return the exit code if the process exited, None if it is still running."""
+        try:
+            return self.wait(0)
+        except subprocess.TimeoutExpired:
+            return None
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        """Wait for the process to exit.
+
+        Args:
+            timeout (float): The maximum number of seconds to wait, None to block
+
+        Returns:
+            int: The exit code, negative for a signal
+
+        Raises:
+            subprocess.TimeoutExpired: If the process is still running
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        interval = 0.001
+        while self.returncode is None:
+            pid, status = os.waitpid(self.pid, 0 if deadline is None else os.WNOHANG)
+            if pid:
+                self.returncode = os.waitstatus_to_exitcode(status)
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(self.args, timeout)
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, _MAX_POLL_INTERVAL)
+        return self.returncode
+
+
+def spawn(
+    command_line: str,
+    backend: str = POPEN_BACKEND,
+    limits: Optional["ResourceLimits"] = None,
+):
+    """Start a command in its own session, with its standard streams piped.
+
+    Args:
+        command_line (str): The command line
+        backend (str): POPEN_BACKEND or POSIX_SPAWN_BACKEND
+        limits (ResourceLimits): Caps set by the shell before the command runs, so
+            the command line always runs with /bin/sh -c
+
+    Returns:
+        subprocess.Popen | SpawnedProcess: The process
+    """
+    prefix = limits.shell_prefix() if limits else ""
+    if backend == POSIX_SPAWN_BACKEND:
+        argv = None if prefix else split_command(command_line)
+        return SpawnedProcess(argv or ["/bin/sh", "-c", prefix + command_line])
+    return subprocess.Popen(  # pylint: disable=consider-using-with
+        prefix + command_line,
+        shell=True,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        # Own process group, so a timeout also stops the processes it started
+        start_new_session=True,
+    )
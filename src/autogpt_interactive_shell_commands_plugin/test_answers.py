@@ -0,0 +1,76 @@
+"""
+Tests for the answer store.
+"""
+import time
+from unittest.mock import patch
+
+from .answers import AnswerStore, normalize_prompt
+from .interactive_shell_commands import InteractiveShellCommands
+
+
+def test_normalize_prompt() -> None:
+    """Test that case, punctuation and spacing are ignored."""
+    assert normalize_prompt("Which directory should I use?") == normalize_prompt(
+        "  which  directory should I use: "
+    )
+    assert normalize_prompt("Use a?") != normalize_prompt("Use b?")
+
+
+def test_ttl_and_scope(tmp_path, monkeypatch) -> None:
+    """Test that answers expire, and are only reused in their directory."""
+    monkeypatch.chdir(tmp_path)
+    store = AnswerStore(ttl_seconds=0.05)
+    store.put("Directory?", "src")
+    assert store.get("directory") == "src"
+    time.sleep(0.1)
+    assert store.get("directory") is None
+
+    store = AnswerStore(scope="cwd")
+    shared = AnswerStore(scope="global")
+    store.put("Directory?", "src")
+    shared.put("Directory?", "src")
+    monkeypatch.chdir(tmp_path.parent)
+    assert store.get("Directory?") is None
+    assert shared.get("Directory?") == "src"
+
+
+def test_persistence(tmp_path) -> None:
+    """Test that answers are saved to, and loaded from, the answers file."""
+    path = str(tmp_path / "answers.json")
+    AnswerStore(path=path).put("Proceed?", "yes")
+    store = AnswerStore(path=path)
+    assert store.get("proceed") == "yes"
+    store.forget("proceed")
+    assert len(AnswerStore(path=path)) == 0
+
+
+def test_corrupt_answers_file_is_set_aside(tmp_path, capsys) -> None:
+    """Test that an answers file that can't be loaded does not stop the store."""
+    path = tmp_path / "answers.json"
+    path.write_text('[{"prompt": "Proceed?"')
+    store = AnswerStore(path=str(path))
+
+    assert len(store) == 0
+    assert "Ignored the answers file" in capsys.readouterr().err
+    assert (tmp_path / "answers.json.corrupt").read_text() == '[{"prompt": "Proceed?"'
+    store.put("Proceed?", "yes")
+    assert AnswerStore(path=str(path)).get("proceed") == "yes"
+
+
+def test_ask_user_serves_remembered_answers(tmp_path, monkeypatch) -> None:
+    """Test that repeated prompts are answered from memory, unchanged, and only
+    marked as such by ask_user_batch."""
+    monkeypatch.chdir(tmp_path)
+    is_commands = InteractiveShellCommands(
+        default_timeout_seconds=10, answer_store=AnswerStore()
+    )
+    with patch("inputimeout.inputimeout", side_effect=["src", "blue"]) as ask:
+        assert is_commands.ask_user(["Which directory?"]) == ["src"]
+        assert is_commands.ask_user(["which directory", "Color?"]) == [
+            "src",
+            "blue",
+        ]
+        results = is_commands.ask_user_batch(["Color?"])
+
+    assert ask.call_count == 2
+    assert results == [{"prompt": "Color?", "status": "remembered", "response": "blue"}]
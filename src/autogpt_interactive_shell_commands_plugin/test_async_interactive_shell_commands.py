@@ -0,0 +1,105 @@
+"""
+Tests for the AsyncInteractiveShellCommands class.
+"""
+import asyncio
+import sys
+import time
+
+import pytest
+
+from .async_interactive_shell_commands import AsyncInteractiveShellCommands
+
+pytestmark = pytest.mark.skipif(
+    sys.platform == "win32", reason="the async engine needs POSIX process groups"
+)
+
+
+def test_execute_interactive_shell_async_runs_concurrently(idle_stdin) -> None:
+    """Test that several commands run at the same time on one event loop."""
+    is_commands = AsyncInteractiveShellCommands(default_timeout_seconds=10)
+
+    async def run_all() -> list[list[dict]]:
+        return await asyncio.gather(
+            *(
+                is_commands.execute_interactive_shell_async(
+                    f"sleep 0.5; echo {index}; echo warning {index} >&2"
+                )
+                for index in range(3)
+            )
+        )
+
+    started = time.monotonic()
+    conversations = asyncio.run(run_all())
+
+    assert time.monotonic() - started < 1.4
+    for index, conversation in enumerate(conversations):
+        assert sorted(conversation, key=lambda event: event["role"]) == [
+            {"role": "error", "content": f"warning {index}"},
+            {"role": "process", "content": str(index)},
+        ]
+
+
+def test_execute_interactive_shell_async_timeout(idle_stdin) -> None:
+    """Test that a hung command is stopped and its partial output returned."""
+    is_commands = AsyncInteractiveShellCommands(default_timeout_seconds=10)
+    conversation = asyncio.run(
+        is_commands.execute_interactive_shell_async(
+            "echo started; sleep 30", timeout_seconds=1
+        )
+    )
+
+    assert conversation == [
+        {"role": "process", "content": "started"},
+        {"role": "error", "content": "Timeout after 1 seconds"},
+    ]
+
+
+def test_execute_interactive_shell_async_shares_the_posix_engine(
+    idle_stdin, tmp_path
+) -> None:
+    """Test that the async engine feeds stdin_data and keeps shell logs, like the
+    POSIX engine, while another command runs on the loop."""
+    from .shell_logs import ShellLogStore
+
+    stdin_data = b"x" * (1024 * 1024)
+    is_commands = AsyncInteractiveShellCommands(
+        default_timeout_seconds=10,
+        compact_output=False,
+        headless=True,
+        shell_logs=ShellLogStore(directory=str(tmp_path)),
+    )
+
+    async def run_both() -> list[list[dict]]:
+        return await asyncio.gather(
+            is_commands.execute_interactive_shell_async(
+                "cat | wc -c", stdin_data=stdin_data
+            ),
+            is_commands.execute_interactive_shell_async("sleep 0.2; echo done"),
+        )
+
+    fed, other = asyncio.run(run_both())
+
+    assert fed[:2] == [
+        {"role": "user", "content": f"[{len(stdin_data)} bytes of input]"},
+        {"role": "process", "content": str(len(stdin_data))},
+    ]
+    assert fed[2]["content"].startswith("Full output kept as shell log ")
+    assert other[0] == {"role": "process", "content": "done"}
+
+
+def test_iter_interactive_shell_async_keeps_the_timeout_apart(idle_stdin) -> None:
+    """Test that the timeout is an event of its own, after the output."""
+    is_commands = AsyncInteractiveShellCommands(default_timeout_seconds=10)
+
+    async def collect() -> list[dict]:
+        return [
+            event
+            async for event in is_commands.iter_interactive_shell_async(
+                "echo started >&2; sleep 30", timeout_seconds=0.5
+            )
+        ]
+
+    assert asyncio.run(collect()) == [
+        {"role": "error", "content": "started"},
+        {"role": "error", "content": "Timeout after 0.5 seconds"},
+    ]
@@ -0,0 +1,87 @@
+"""
+Tests for the result cache.
+"""
+import os
+import sys
+import time
+
+import pytest
+
+from .cache import ResultCache
+from .interactive_shell_commands import InteractiveShellCommands
+
+
+def test_is_cacheable() -> None:
+    """Test the allow-list, and that chained or redirected commands never match."""
+    cache = ResultCache(60)
+    assert cache.is_cacheable("ls")
+    assert cache.is_cacheable("git  log --oneline")
+    assert not cache.is_cacheable("git status --short")
+    assert cache.is_cacheable("cat requirements.txt")
+    assert not cache.is_cacheable("rm -rf build")
+    assert not cache.is_cacheable("cat a.txt > b.txt")
+    assert not cache.is_cacheable("ls; rm a.txt")
+    assert not cache.is_cacheable("cat $(which python)")
+    assert ResultCache(60, patterns=["make *"]).is_cacheable("make help")
+
+
+def test_ttl_and_lru_eviction(tmp_path, monkeypatch) -> None:
+    """Test that entries expire after the TTL, and the least recently used goes."""
+    monkeypatch.chdir(tmp_path)
+    cache = ResultCache(60, max_entries=2)
+    cache.put("ls", [{"role": "process", "content": "a"}])
+    cache.put("pwd", [{"role": "process", "content": "b"}])
+    assert cache.get("ls") == [{"role": "process", "content": "a"}]
+    cache.put("git status", [])
+    assert cache.get("pwd") is None
+    assert cache.get("ls") is not None
+    assert (cache.hits, cache.misses) == (2, 1)
+
+    expiring = ResultCache(0.05)
+    expiring.put("ls", [])
+    time.sleep(0.1)
+    assert expiring.get("ls") is None
+
+
+def test_invalidation_by_mtime_cwd_and_env(tmp_path, monkeypatch) -> None:
+    """Test that a changed argument file, cwd or environment is a cache miss."""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "notes.txt").write_text("one")
+    cache = ResultCache(60, watch_paths=[])
+    cache.put("cat notes.txt", [{"role": "process", "content": "one"}])
+    assert cache.get("cat notes.txt") is not None
+
+    stat = os.stat(tmp_path / "notes.txt")
+    os.utime(tmp_path / "notes.txt", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert cache.get("cat notes.txt") is None
+
+    cache.put("ls", [])
+    monkeypatch.setenv("VIRTUAL_ENV", str(tmp_path))
+    assert cache.get("ls") is None
+    monkeypatch.delenv("VIRTUAL_ENV")
+    monkeypatch.chdir(tmp_path.parent)
+    assert cache.get("ls") is None
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="select() needs POSIX pipes")
+def test_execute_interactive_shell_uses_cache(
+    tmp_path, monkeypatch, idle_stdin
+) -> None:
+    """Test that cached commands are not run again until another command runs."""
+    monkeypatch.chdir(tmp_path)
+    cache = ResultCache(60, patterns=["sh count.sh"], watch_paths=[])
+    (tmp_path / "count.sh").write_text("echo run >> runs.log; echo done\n")
+    is_commands = InteractiveShellCommands(
+        default_timeout_seconds=10, result_cache=cache
+    )
+
+    expected = [{"role": "process", "content": "done"}]
+    assert is_commands.execute_interactive_shell("sh count.sh") == expected
+    assert is_commands.execute_interactive_shell("sh count.sh") == expected
+    assert (tmp_path / "runs.log").read_text() == "run\n"
+
+    # Any other command may have changed the files, so the cache is dropped
+    is_commands.execute_interactive_shell("true")
+    assert len(cache) == 0
+    assert is_commands.execute_interactive_shell("sh count.sh") == expected
+    assert (tmp_path / "runs.log").read_text() == "run\nrun\n"
@@ -0,0 +1,102 @@
+"""
+Tests for the conversation capture helpers.
+"""
+from .capture import (
+    ChunkCoalescer,
+    ConversationBuffer,
+    ConversationCapture,
+    StreamDecoder,
+    normalize_content,
+)
+
+
+def test_normalize_content() -> None:
+    """Test that captured text is flattened to a single line."""
+    assert normalize_content("line 1\r\nline 2\n") == "line 1 line 2"
+    assert normalize_content("") == ""
+
+
+def test_normalize_content_strips_escapes_and_whitespace() -> None:
+    """Test that escape sequences, carriage returns and repeated spaces are removed."""
+    assert normalize_content("\x1b[1;32mOK\x1b[0m  done\t\n") == "OK done"
+    assert normalize_content("\x1b]0;title\x07 50%\r100%") == "50%100%"
+
+
+def test_stream_decoder_handles_split_characters() -> None:
+    """Test that a character split across chunks is decoded once complete."""
+    data = "é✓".encode("utf-8")
+    decoder = StreamDecoder()
+
+    assert decoder.decode("process", data[:1]) == ""
+    assert decoder.decode("process", data[1:3]) == "é"
+    assert decoder.decode("process", data[3:]) == "✓"
+    assert decoder.decode("error", b"\xff") == "\ufffd"
+    assert decoder.flush() == []
+
+
+def test_conversation_buffer_unbounded() -> None:
+    """Test that every event is kept when there is no byte budget."""
+    conversation = ConversationBuffer()
+    conversation.append("process", "hello\n")
+    conversation.append("user", "y\n")
+    conversation.append("error", "oops\n")
+
+    assert conversation.to_conversation() == [
+        {"role": "process", "content": "hello"},
+        {"role": "user", "content": "y"},
+        {"role": "error", "content": "oops"},
+    ]
+
+
+def test_conversation_buffer_keeps_head_and_tail() -> None:
+    """Test that the middle of a role's output is summarized past the budget."""
+    conversation = ConversationBuffer(max_bytes=8)
+    for index in range(10):
+        conversation.append("process", f"{index}\n")
+    conversation.append("error", "e\n")
+
+    assert conversation.to_conversation() == [
+        {"role": "process", "content": "0"},
+        {"role": "process", "content": "1"},
+        {"role": "process", "content": "[... 12 bytes, 6 lines omitted ...]"},
+        {"role": "process", "content": "8"},
+        {"role": "process", "content": "9"},
+        {"role": "error", "content": "e"},
+    ]
+
+
+def test_conversation_buffer_splits_events_at_the_budget() -> None:
+    """Test that a single large event is split between the head and the tail."""
+    conversation = ConversationBuffer(max_bytes=4)
+    conversation.append("process", "abcdefgh")
+
+    assert conversation.to_conversation() == [
+        {"role": "process", "content": "ab"},
+        {"role": "process", "content": "[... 4 bytes, 0 lines omitted ...]"},
+        {"role": "process", "content": "gh"},
+    ]
+
+
+def test_chunk_coalescer_merges_same_role() -> None:
+    """Test that chunks are merged until the role changes or output pauses."""
+    coalescer = ChunkCoalescer(gap_seconds=1.0)
+
+    assert coalescer.add("process", b"a", timestamp=0.0) == []
+    assert coalescer.add("process", b"b", timestamp=0.5) == []
+    assert coalescer.add("user", b"y\n", timestamp=0.6) == [("process", b"ab")]
+    assert coalescer.add("user", b"n\n", timestamp=5.0) == [("user", b"y\n")]
+    assert coalescer.flush() == [("user", b"n\n")]
+    assert coalescer.flush() == []
+
+
+def test_conversation_capture_coalesces_chunks() -> None:
+    """Test that the capture pipeline returns one event per burst of output."""
+    conversation = ConversationCapture()
+    conversation.feed("process", b"hello ", timestamp=0.0)
+    conversation.feed("process", b"world\n", timestamp=0.1)
+    conversation.append("error", "Timeout after 1 seconds")
+
+    assert conversation.to_conversation() == [
+        {"role": "process", "content": "hello world"},
+        {"role": "error", "content": "Timeout after 1 seconds"},
+    ]
@@ -0,0 +1,81 @@
+"""
+Tests for the output compaction.
+"""
+from .capture import ConversationCapture
+from .compaction import LineCompactor, apply_token_budget
+
+
+def compact(*chunks: str) -> list[tuple[str, str]]:
+    compactor = LineCompactor()
+    events = []
+    for chunk in chunks:
+        events.extend(compactor.add("process", chunk))
+    return events + compactor.flush()
+
+
+def test_progress_bars_keep_their_final_state() -> None:
+    """Test that lines redrawn with carriage returns keep their last state only."""
+    assert compact(
+        "Downloading  10%\r", "Downloading  55%", "\rDownloading 100%\n"
+    ) == [("process", "Downloading 100%\n")]
+    assert compact("done\r\n", "next\r\n") == [("process", "done\nnext\n")]
+    # Redraws split right after the carriage return, as slow progress bars are
+    assert compact("Downloading 10%\r", "Downloading 55%\r", "Downloading 100%\n") == [
+        ("process", "Downloading 100%\n")
+    ]
+    assert compact("Downloading 10%\r") == [("process", "Downloading 10%")]
+
+
+def test_repeated_lines_are_collapsed() -> None:
+    """Test that identical lines, and redrawn lines only differing by numbers,
+    collapse, keeping the first and last line of the run."""
+    progress = "".join(f"\rfetched {count} of 9\n" for count in (1, 2, 9))
+    assert compact("warning: x\n" * 3 + progress + "end\n") == [
+        ("process", "warning: x (×3)\nfetched 1 of 9 … fetched 9 of 9 (×3)\nend\n")
+    ]
+    assert compact("\n\n\nend") == [("process", "\nend")]
+
+
+def test_lines_differing_by_numbers_are_kept() -> None:
+    """Test that lines that were not redrawn are kept when their numbers differ."""
+    assert compact("1\n2\n3\n") == [("process", "1\n2\n3\n")]
+    assert compact("a.c:10: error: x\n", "a.c:20: error: x\n") == [
+        ("process", "a.c:10: error: x\na.c:20: error: x\n")
+    ]
+
+
+def test_roles_are_kept_in_order() -> None:
+    """Test that a role change releases what was held back."""
+    compactor = LineCompactor()
+    assert compactor.add("process", "Continue? ") == []
+    assert compactor.add("error", "warning\n") == [("process", "Continue? ")]
+    assert compactor.flush() == [("error", "warning\n")]
+
+
+def test_apply_token_budget() -> None:
+    """Test that the start and end are kept, and the middle summarized."""
+    conversation = [{"role": "process", "content": "a" * 40} for _ in range(10)]
+    assert apply_token_budget(conversation, 1000) is conversation
+
+    compacted = apply_token_budget(conversation, 40)
+    assert compacted[:2] == [{"role": "process", "content": "a" * 40}] * 2
+    assert compacted[2] == {
+        "role": "process",
+        "content": "[... about 60 tokens of output omitted ...]",
+    }
+    assert compacted[3:] == [{"role": "process", "content": "a" * 40}] * 2
+
+
+def test_capture_compacts_before_normalizing() -> None:
+    """Test the compaction stage of the capture pipeline, around the user's input."""
+    capture = ConversationCapture(compact=True)
+    for percent in range(0, 101, 10):
+        capture.feed("process", f"\rprogress {percent}%".encode(), timestamp=percent)
+    capture.feed("process", b"\nok? ", timestamp=200)
+    capture.feed("user", b"y\n", timestamp=201)
+    capture.feed("process", b"bye\n", timestamp=202)
+    assert capture.to_conversation() == [
+        {"role": "process", "content": "progress 100% ok?"},
+        {"role": "user", "content": "y"},
+        {"role": "process", "content": "bye"},
+    ]
@@ -0,0 +1,74 @@
+"""
+Tests for the terminal echo.
+"""
+import sys
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+
+from .echo import EchoWriter
+from .interactive_shell_commands import InteractiveShellCommands
+
+
+class SlowStream:
+    """A terminal that takes a while for every write."""
+
+    def __init__(self, delay: float = 0.0) -> None:
+        self.delay = delay
+        self.writes: list[bytes] = []
+        self.flushes = 0
+
+    def write(self, data: bytes) -> int:
+        time.sleep(self.delay)
+        self.writes.append(data)
+        return len(data)
+
+    def flush(self) -> None:
+        self.flushes += 1
+
+
+def test_echo_writer_batches_writes() -> None:
+    """Test that chunks queued while the terminal is busy are written together."""
+    stdout, stderr = SlowStream(delay=0.1), SlowStream()
+    with patch("sys.stdout", SimpleNamespace(buffer=stdout)), patch(
+        "sys.stderr", SimpleNamespace(buffer=stderr)
+    ):
+        echo = EchoWriter()
+        started = time.monotonic()
+        for index in range(50):
+            echo.write("process", b"line %d\n" % index)
+        echo.write("error", b"oops\n")
+        assert time.monotonic() - started < 0.1
+        assert echo.flush(timeout=5)
+
+    assert b"".join(stdout.writes) == b"".join(b"line %d\n" % i for i in range(50))
+    assert len(stdout.writes) < 5 and stdout.flushes == len(stdout.writes)
+    assert stderr.writes == [b"oops\n"]
+
+
+def test_echo_writer_drops_output_when_full() -> None:
+    """Test that output past the queue bound is skipped, and said so."""
+    stdout, stderr = SlowStream(delay=0.2), SlowStream()
+    with patch("sys.stdout", SimpleNamespace(buffer=stdout)), patch(
+        "sys.stderr", SimpleNamespace(buffer=stderr)
+    ):
+        echo = EchoWriter(max_queue_bytes=10)
+        for _ in range(4):
+            echo.write("process", b"12345")
+        assert echo.flush(timeout=5)
+
+    assert len(b"".join(stdout.writes)) < 20
+    assert stderr.writes[-1].endswith(b"bytes not echoed ...]\n")
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="select() needs POSIX pipes")
+def test_headless_commands_are_not_echoed(idle_stdin, capfd) -> None:
+    """Test that headless commands are captured, but not mirrored."""
+    for headless, echoed in ((True, ""), (False, "hello\n")):
+        is_commands = InteractiveShellCommands(10, headless=headless)
+        assert is_commands.execute_interactive_shell_linux("echo hello") == [
+            {"role": "process", "content": "hello"}
+        ]
+        assert capfd.readouterr().out == echoed
@@ -0,0 +1,57 @@
+"""
+Tests for the selector engine.
+"""
+import os
+import sys
+import time
+from unittest.mock import patch
+
+import pytest
+
+from .engine import SelectorEngine, ShellProcess
+
+pytestmark = pytest.mark.skipif(
+    sys.platform == "win32", reason="the engine needs POSIX pipes"
+)
+
+
+def _run(engine: SelectorEngine, shells: list[ShellProcess]) -> None:
+    deadline = time.monotonic() + 10
+    while not all(shell.done for shell in shells):
+        assert time.monotonic() < deadline, "commands did not finish"
+        engine.poll(0.1)
+
+
+def test_shared_engine_runs_concurrent_commands() -> None:
+    """Test that several commands share one selector, one of them reading stdin."""
+    read_fd, write_fd = os.pipe()
+    engine = SelectorEngine()
+    try:
+        with open(read_fd, "rb", closefd=False) as stdin, patch("sys.stdin", stdin):
+            first = ShellProcess(engine, "sleep 0.2; echo first")
+            second = ShellProcess(engine, "echo second; echo problem >&2")
+            assert engine.is_registered(stdin.fileno())
+
+            _run(engine, [first, second])
+            first.close()
+            second.close()
+            assert not engine.is_registered(stdin.fileno())
+    finally:
+        engine.close()
+        os.close(read_fd)
+        os.close(write_fd)
+
+    assert list(first.chunks) == [("process", b"first\n")]
+    assert sorted(second.chunks) == [("error", b"problem\n"), ("process", b"second\n")]
+
+
+def test_engine_accepts_regular_files() -> None:
+    """Test that a stdin redirected from a file is read even though epoll rejects it."""
+    with open(os.devnull, "rb") as stdin, patch("sys.stdin", stdin):
+        engine = SelectorEngine()
+        shell = ShellProcess(engine, "cat")
+        _run(engine, [shell])
+        shell.close()
+        engine.close()
+
+    assert shell.process.returncode == 0
@@ -1,10 +1,17 @@
 """
 Tests for the InteractiveShellCommands class.
 """
-from unittest.mock import patch
+import os
+import subprocess
+import sys
+import time
+from unittest.mock import MagicMock, patch
 
-from . import AutoGPTInteractiveShellCommandsPlugin
+import pytest
+
+from . import AutoGPTInteractiveShellCommandsPlugin, _env_int, _env_seconds
 from .interactive_shell_commands import InteractiveShellCommands
+from .metrics import CommandMetrics
 from auto_gpt_plugin_template import AutoGPTPluginTemplate
 
 def test_ask_user() -> None:
@@ -34,6 +41,62 @@ def test_ask_user_timeout() -> None:
     assert responses == [f"Timeout after {timeout} seconds"]
 
 
+def test_ask_user_timeout_keeps_responses_aligned() -> None:
+    """Test that the prompts after a timeout still get a response."""
+    from inputimeout import TimeoutOccurred
+
+    with patch("inputimeout.inputimeout", side_effect=["Answer 1", TimeoutOccurred]):
+        is_commands = InteractiveShellCommands(default_timeout_seconds=10)
+        responses = is_commands.ask_user(["Q1", "Q2", "Q3"], 5)
+
+    assert responses == ["Answer 1"] + ["Timeout after 5 seconds"] * 2
+
+
+def test_ask_user_batch() -> None:
+    """Test the statuses of a form, and the shortcut taking the defaults."""
+    prompts = ["Name?", "Directory?", "Color?", "Size?", "Shape?"]
+    defaults = [None, "/tmp", None, "large"]
+    with patch(
+        "inputimeout.inputimeout", side_effect=["Ada", "", "", "!defaults"]
+    ) as ask:
+        is_commands = InteractiveShellCommands(default_timeout_seconds=10)
+        results = is_commands.ask_user_batch(prompts, defaults)
+
+    assert ask.call_count == 4
+    assert [(result["status"], result["response"]) for result in results] == [
+        ("answered", "Ada"),
+        ("default", "/tmp"),
+        ("skipped", None),
+        ("default", "large"),
+        ("skipped", None),
+    ]
+
+
+def test_ask_user_batch_overall_deadline() -> None:
+    """Test that the whole form shares one deadline."""
+    from inputimeout import TimeoutOccurred
+
+    timeouts = []
+
+    def answer_slowly(prompt, timeout):
+        timeouts.append(timeout)
+        time.sleep(0.2)
+        if len(timeouts) == 2:
+            raise TimeoutOccurred
+        return "answer"
+
+    with patch("inputimeout.inputimeout", side_effect=answer_slowly):
+        is_commands = InteractiveShellCommands(default_timeout_seconds=10)
+        results = is_commands.ask_user_batch(["Q1", "Q2", "Q3"], timeout_seconds=1)
+
+    assert timeouts[0] <= 1 and timeouts[1] <= 0.85
+    assert [result["status"] for result in results] == [
+        "answered",
+        "timed_out",
+        "timed_out",
+    ]
+
+
 def test_auto_gpt_interactive_shell_commands_plugin():
     plugin = AutoGPTInteractiveShellCommandsPlugin()
 
@@ -58,4 +121,486 @@ def test_auto_gpt_interactive_shell_commands_plugin():
     assert plugin.can_handle_text_embedding(text) is False
     user_input = ""
     assert plugin.can_handle_user_input(user_input) is False
-    assert plugin.can_handle_report() is False
\ No newline at end of file
+    assert plugin.can_handle_report() is False
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="select() needs POSIX pipes")
+def test_iter_interactive_shell_linux_streams_events(idle_stdin) -> None:
+    """Test that events are yielded as they are read, until the generator is closed."""
+    is_commands = InteractiveShellCommands(default_timeout_seconds=10)
+    events = is_commands.iter_interactive_shell_linux(
+        "echo first; sleep 30; echo never"
+    )
+    assert next(events) == {"role": "process", "content": "first"}
+    events.close()
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="select() needs POSIX pipes")
+def test_execute_interactive_shell_linux_timeout(idle_stdin) -> None:
+    """Test that a hung command is stopped on schedule and its output is kept."""
+    is_commands = InteractiveShellCommands(default_timeout_seconds=10)
+    started = time.monotonic()
+    conversation = is_commands.execute_interactive_shell_linux(
+        "echo started; sleep 30", timeout_seconds=1
+    )
+
+    assert time.monotonic() - started < 10
+    assert conversation == [
+        {"role": "process", "content": "started"},
+        {"role": "error", "content": "Timeout after 1 seconds"},
+    ]
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="select() needs POSIX pipes")
+def test_execute_interactive_shell_linux_idle_timeout(idle_stdin) -> None:
+    """Test that a command that stops producing output is stopped."""
+    is_commands = InteractiveShellCommands(
+        default_timeout_seconds=10, idle_timeout_seconds=0.5
+    )
+    conversation = is_commands.execute_interactive_shell_linux("echo started; sleep 30")
+
+    assert conversation[-1] == {"role": "error", "content": "No output for 0.5 seconds"}
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="select() needs POSIX pipes")
+def test_execute_interactive_shell_does_not_cache_timeouts(
+    idle_stdin, tmp_path
+) -> None:
+    """Test that a command stopped while writing to stderr is not cached, and that
+    its timeout stays an event of its own."""
+    from .cache import ResultCache
+
+    script = tmp_path / "warn.sh"
+    script.write_text("while :; do echo warn >&2; sleep 0.05; done\n")
+    cache = ResultCache(60, patterns=["sh *"])
+    is_commands = InteractiveShellCommands(
+        default_timeout_seconds=10, result_cache=cache
+    )
+    conversation = is_commands.execute_interactive_shell(
+        f"sh {script}", timeout_seconds=0.3
+    )
+
+    assert conversation[-1] == {"role": "error", "content": "Timeout after 0.3 seconds"}
+    assert conversation[-2]["role"] == "error"
+    assert conversation[-2]["content"].startswith("warn")
+    assert len(cache) == 0
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="select() needs POSIX pipes")
+def test_execute_interactive_shell_linux_drains_all_streams(idle_stdin) -> None:
+    """Test that output still pending on one stream is kept after the other closes."""
+    is_commands = InteractiveShellCommands(default_timeout_seconds=10)
+    conversation = is_commands.execute_interactive_shell_linux(
+        "echo oops >&2; exec 2>&-; sleep 0.5; echo done"
+    )
+
+    assert conversation == [
+        {"role": "error", "content": "oops"},
+        {"role": "process", "content": "done"},
+    ]
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="select() needs POSIX pipes")
+def test_execute_interactive_shell_linux_forwards_stdin_eof() -> None:
+    """Test that user input is forwarded and its EOF reaches the process."""
+    read_fd, write_fd = os.pipe()
+    os.write(write_fd, b"hello\n")
+    os.close(write_fd)
+    with open(read_fd, "rb") as stdin, patch("sys.stdin", stdin):
+        is_commands = InteractiveShellCommands(default_timeout_seconds=10)
+        conversation = is_commands.execute_interactive_shell_linux("cat; echo eof")
+
+    assert conversation[0] == {"role": "user", "content": "hello"}
+    assert conversation[-1] == {"role": "process", "content": "hello eof"}
+
+
+def test_execute_interactive_shell_crossplatform_round_trip() -> None:
+    """Test that the user is asked for a response as soon as the output settles."""
+    read_fd, write_fd = os.pipe()
+    os.write(write_fd, b"yes\n")
+    os.close(write_fd)
+    with open(read_fd, "rb") as stdin, patch("sys.stdin", stdin):
+        is_commands = InteractiveShellCommands(default_timeout_seconds=10)
+        started = time.monotonic()
+        conversation = is_commands.execute_interactive_shell_crossplatform(
+            "echo ready; read answer; sleep 0.3; echo got $answer"
+        )
+
+    assert time.monotonic() - started < 2
+    assert conversation == [
+        {"role": "process", "content": "ready"},
+        {"role": "user", "content": "yes"},
+        {"role": "process", "content": "got yes"},
+    ]
+
+
+def test_execute_interactive_shell_crossplatform_timeout_while_asking(
+    idle_stdin,
+) -> None:
+    """Test that the deadline stops the command while a response is pending."""
+    is_commands = InteractiveShellCommands(default_timeout_seconds=10, headless=True)
+    started = time.monotonic()
+    conversation = is_commands.execute_interactive_shell_crossplatform(
+        "echo hi; sleep 30", timeout_seconds=1
+    )
+
+    assert time.monotonic() - started < 5
+    assert conversation == [
+        {"role": "process", "content": "hi"},
+        {"role": "error", "content": "Timeout after 1 seconds"},
+    ]
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="select() needs POSIX pipes")
+def test_execute_interactive_shell_crossplatform_leaves_stdin_alone() -> None:
+    """Test that input typed after the command ended is left for the next reader."""
+    import select
+
+    read_fd, write_fd = os.pipe()
+    try:
+        with open(read_fd, "rb", closefd=False) as stdin, patch("sys.stdin", stdin):
+            is_commands = InteractiveShellCommands(
+                default_timeout_seconds=10, headless=True
+            )
+            is_commands.execute_interactive_shell_crossplatform("echo hi; sleep 0.3")
+        os.write(write_fd, b"y\n")
+        time.sleep(0.1)
+
+        assert select.select([read_fd], [], [], 1)[0]
+        assert os.read(read_fd, 16) == b"y\n"
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="shell sessions need a terminal")
+def test_execute_in_shell_session() -> None:
+    """Test that commands sent to the same session share its state."""
+    is_commands = InteractiveShellCommands(default_timeout_seconds=10)
+    try:
+        assert is_commands.execute_in_shell_session("s", "X=42") == []
+        assert is_commands.execute_in_shell_session("s", "echo $X; exit 3") == [
+            {"role": "process", "content": "42"},
+            {"role": "error", "content": "Exit code 3"},
+        ]
+    finally:
+        is_commands.close_shell_session("s")
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="shell sessions need a terminal")
+def test_execute_in_shell_session_input_only() -> None:
+    """Test that a REPL started in a session is answered with input_only."""
+    is_commands = InteractiveShellCommands(default_timeout_seconds=10, headless=True)
+    try:
+        is_commands.execute_in_shell_session(
+            "py", f"{sys.executable} -q -i -c ''", input_only=True
+        )
+        # As given by the agent
+        conversation = is_commands.execute_in_shell_session(
+            "py", "6 * 7", input_only="true"
+        )
+        assert conversation[0]["content"].startswith("42")
+    finally:
+        is_commands.close_shell_session("py")
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="shell sessions need a terminal")
+def test_execute_in_shell_session_start_timeout() -> None:
+    """Test that a session that does not start is reported as an error."""
+    from .sessions import SessionTimeout
+
+    is_commands = InteractiveShellCommands(default_timeout_seconds=10, headless=True)
+    with patch(
+        "autogpt_interactive_shell_commands_plugin.sessions.ShellSession",
+        side_effect=SessionTimeout("Timeout after 10 seconds"),
+    ):
+        conversation = is_commands.execute_in_shell_session("s", "true")
+
+    assert conversation == [
+        {
+            "role": "error",
+            "content": "Session s did not start: Timeout after 10 seconds",
+        }
+    ]
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="shell sessions need a terminal")
+def test_execute_in_shell_session_parses_input_only() -> None:
+    """Test that input_only given as a string by the agent is read as a flag."""
+    session = MagicMock()
+    session.run.side_effect = lambda *args: iter([b"ran\n"])
+    session.send.side_effect = lambda *args: iter([b"sent\n"])
+    is_commands = InteractiveShellCommands(
+        default_timeout_seconds=10,
+        session_manager=MagicMock(get=MagicMock(return_value=session)),
+        headless=True,
+    )
+
+    for input_only, content in (("false", "ran"), ("True", "sent"), (False, "ran")):
+        conversation = is_commands.execute_in_shell_session(
+            "s", "true", input_only=input_only
+        )
+        assert conversation == [{"role": "process", "content": content}]
+
+
+def test_plugin_post_command_adds_metrics(monkeypatch) -> None:
+    """Test that post_command surfaces the metrics of the last command when enabled."""
+    # The plugin is a singleton, already initialized by the other tests
+    plugin = AutoGPTInteractiveShellCommandsPlugin()
+    monkeypatch.setattr(plugin, "_metrics_in_response", True)
+    assert plugin.can_handle_post_command() is True
+
+    metrics = CommandMetrics("ls", "linux")
+    metrics.finish(0)
+    plugin._record_metrics(metrics)
+
+    response = plugin.post_command("execute_interactive_shell", "[]")
+    assert response.startswith("[]\nCommand metrics: wall ")
+    assert plugin.post_command("execute_interactive_shell", "[]") == "[]"
+
+    # The metrics of a batch are not taken for those of a later cached result
+    assert plugin.can_handle_pre_command() is True
+    plugin._record_metrics(metrics)
+    plugin.pre_command("execute_interactive_shell", {"command_line": "ls"})
+    assert plugin.post_command("execute_interactive_shell", "[]") == "[]"
+
+
+def test_plugin_pre_command_clears_the_cache(monkeypatch) -> None:
+    """Test that commands outside the plugin clear the result cache."""
+    from .cache import ResultCache
+
+    plugin = AutoGPTInteractiveShellCommandsPlugin()
+    cache = ResultCache(60)
+    monkeypatch.setattr(plugin, "_cache_ttl_seconds", 60)
+    monkeypatch.setattr(plugin, "_result_cache", cache)
+    assert plugin.can_handle_pre_command() is True
+
+    cache.put("ls", [])
+    arguments = {"command_line": "ls"}
+    assert plugin.pre_command("execute_interactive_shell", arguments) == (
+        "execute_interactive_shell",
+        arguments,
+    )
+    assert len(cache) == 1
+    plugin.pre_command("write_to_file", {"filename": "a.txt", "text": "b"})
+    assert len(cache) == 0
+
+
+def test_plugin_post_prompt_reuses_commands() -> None:
+    """Test that every prompt registers the methods of the same command object."""
+
+    class PromptGenerator:
+        def __init__(self):
+            self.commands = {}
+
+        def add_command(self, label, name, args, function):
+            self.commands[label] = function
+
+    plugin = AutoGPTInteractiveShellCommandsPlugin()
+    first, second = PromptGenerator(), PromptGenerator()
+    plugin.post_prompt(first)
+    plugin.post_prompt(second)
+
+    assert "execute_interactive_shell" in first.commands
+    for label, function in first.commands.items():
+        assert second.commands[label].__self__ is function.__self__
+
+
+def test_plugin_startup_imports_no_engine() -> None:
+    """Test that importing and building the plugin leaves the engines, and their
+    dependencies, unloaded until the first prompt."""
+    lazy_modules = [
+        "pty",
+        "termios",
+        "inputimeout",
+        "autogpt_interactive_shell_commands_plugin.sessions",
+        "autogpt_interactive_shell_commands_plugin.interactive_shell_commands",
+    ]
+    script = (
+        "import sys\n"
+        "from autogpt_interactive_shell_commands_plugin import "
+        "AutoGPTInteractiveShellCommandsPlugin\n"
+        "AutoGPTInteractiveShellCommandsPlugin()\n"
+        f"print([name for name in {lazy_modules!r} if name in sys.modules])\n"
+    )
+    # A fresh interpreter, since the other tests already imported everything
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        check=True,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+
+    # After the settings the plugin prints
+    assert result.stdout.splitlines()[-1] == "[]"
+
+
+def test_env_seconds(monkeypatch) -> None:
+    """Test that durations are parsed once, and rejected when invalid."""
+    monkeypatch.setenv("SECONDS_SETTING", "60")
+    assert _env_seconds("SECONDS_SETTING", 900) == 60
+    monkeypatch.setenv("SECONDS_SETTING", "0.5")
+    assert _env_seconds("SECONDS_SETTING", 900) == 0.5
+    monkeypatch.delenv("SECONDS_SETTING")
+    assert _env_seconds("SECONDS_SETTING", 900) == 900
+    for invalid in ("soon", "-1"):
+        monkeypatch.setenv("SECONDS_SETTING", invalid)
+        with pytest.raises(ValueError, match="SECONDS_SETTING"):
+            _env_seconds("SECONDS_SETTING", 900)
+    monkeypatch.setenv("SECONDS_SETTING", "0")
+    with pytest.raises(ValueError):
+        _env_seconds("SECONDS_SETTING", 900, allow_zero=False)
+
+
+def test_env_int(monkeypatch) -> None:
+    """Test that counts and sizes are parsed once, and rejected when invalid."""
+    monkeypatch.setenv("COUNT_SETTING", "64")
+    assert _env_int("COUNT_SETTING", 4) == 64
+    monkeypatch.delenv("COUNT_SETTING")
+    assert _env_int("COUNT_SETTING", 4) == 4
+    for invalid in ("many", "1.5", "-1"):
+        monkeypatch.setenv("COUNT_SETTING", invalid)
+        with pytest.raises(ValueError, match="COUNT_SETTING"):
+            _env_int("COUNT_SETTING", 4)
+    monkeypatch.setenv("COUNT_SETTING", "0")
+    with pytest.raises(ValueError):
+        _env_int("COUNT_SETTING", 4, allow_zero=False)
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="select() needs POSIX pipes")
+def test_execute_shell_batch() -> None:
+    """Test that commands run concurrently, and results come back in input order."""
+    is_commands = InteractiveShellCommands(default_timeout_seconds=10)
+    started = time.monotonic()
+    results = is_commands.execute_shell_batch(
+        ["sleep 0.4; echo first", "echo second; echo oops >&2; exit 2", "read x"]
+        + ["sleep 0.4"] * 3,
+        max_workers=4,
+    )
+
+    # Two waves of at most 4 commands, instead of 5 sleeps in a row
+    assert time.monotonic() - started < 1.5
+    assert [result["exit_code"] for result in results] == [0, 2, 1, 0, 0, 0]
+    assert all(result["usage"]["max_rss_kib"] > 0 for result in results)
+    assert results[0]["conversation"] == [{"role": "process", "content": "first"}]
+    assert results[1]["conversation"] == [
+        {"role": "process", "content": "second"},
+        {"role": "error", "content": "oops"},
+    ]
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="select() needs POSIX pipes")
+def test_execute_shell_batch_timeouts() -> None:
+    """Test the timeouts of each command, and of the whole batch."""
+    is_commands = InteractiveShellCommands(default_timeout_seconds=10)
+    results = is_commands.execute_shell_batch(
+        ["echo quick", "sleep 5", "sleep 5", "echo never"],
+        max_workers=1,
+        timeout_seconds=0.3,
+        overall_timeout_seconds=0.5,
+    )
+
+    assert results[0]["exit_code"] == 0
+    assert results[1]["conversation"] == [
+        {"role": "error", "content": "Timeout after 0.3 seconds"}
+    ]
+    assert results[2]["conversation"] == [
+        {"role": "error", "content": "Timeout after 0.5 seconds (batch)"}
+    ]
+    assert results[3]["exit_code"] is None
+    assert results[3]["conversation"][0]["content"].startswith("Not started")
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="select() needs POSIX pipes")
+def test_execute_interactive_shell_keeps_shell_logs(idle_stdin, tmp_path) -> None:
+    """Test that the full output of a command can be paged through and grepped."""
+    from .shell_logs import ShellLogStore
+
+    is_commands = InteractiveShellCommands(
+        default_timeout_seconds=10,
+        compact_output=False,
+        max_output_tokens=10,
+        shell_logs=ShellLogStore(spill_bytes=64, directory=str(tmp_path)),
+    )
+    conversation = is_commands.execute_interactive_shell_linux(
+        "for i in $(seq 1 100); do echo line $i; done"
+    )
+
+    assert "omitted" in conversation[1]["content"]
+    assert conversation[-1]["content"].startswith("Full output kept as shell log 1 ")
+    page = is_commands.read_shell_log(1, offset=7, length=14)
+    assert page["next_offset"] == 21
+    assert page["conversation"] == [{"role": "process", "content": "line 2 line 3"}]
+    assert is_commands.grep_shell_log("1", "line 5[05]")["matches"] == [
+        {"role": "process", "offset": 383, "line": "line 50"},
+        {"role": "process", "offset": 423, "line": "line 55"},
+    ]
+    assert "error" in is_commands.grep_shell_log(1, "(")
+    assert is_commands.read_shell_log(2) == {"error": "No shell log 2"}
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="select() needs POSIX pipes")
+def test_shell_logs_bound_the_returned_conversation(idle_stdin, tmp_path) -> None:
+    """Test that a logged command returns a bounded conversation by default."""
+    from .interactive_shell_commands import DEFAULT_LOGGED_CAPTURE_BYTES
+    from .shell_logs import ShellLogStore
+
+    is_commands = InteractiveShellCommands(
+        default_timeout_seconds=10,
+        shell_logs=ShellLogStore(directory=str(tmp_path)),
+        headless=True,
+    )
+    conversation = is_commands.execute_interactive_shell_linux("seq 1 100000")
+
+    returned = sum(len(event["content"]) for event in conversation)
+    assert returned < DEFAULT_LOGGED_CAPTURE_BYTES * 2
+    assert is_commands.read_shell_log(1)["size"] == 588895
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="select() needs POSIX pipes")
+def test_execute_interactive_shell_linux_feeds_large_stdin_data(idle_stdin) -> None:
+    """Test that input larger than the pipe buffers is fed while output is read."""
+    stdin_data = b"x" * (8 * 1024 * 1024)
+    is_commands = InteractiveShellCommands(
+        default_timeout_seconds=30, compact_output=False, headless=True
+    )
+    # cat writes as much as it reads, so both pipes fill up unless both are served
+    conversation = is_commands.execute_interactive_shell_linux(
+        "cat | wc -c; cat >/dev/null", stdin_data=stdin_data
+    )
+
+    assert conversation == [
+        {"role": "user", "content": f"[{len(stdin_data)} bytes of input]"},
+        {"role": "process", "content": str(len(stdin_data))},
+    ]
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="select() needs POSIX pipes")
+def test_execute_interactive_shell_linux_reports_unread_input(idle_stdin) -> None:
+    """Test that a command exiting before reading all of its input is reported."""
+    is_commands = InteractiveShellCommands(
+        default_timeout_seconds=10, compact_output=False, headless=True
+    )
+    conversation = is_commands.execute_interactive_shell_linux(
+        "head -c 5; echo", stdin_data="y\n" * 1024 * 1024
+    )
+
+    assert conversation[1] == {"role": "process", "content": "y y y"}
+    assert conversation[-1]["role"] == "error"
+    assert conversation[-1]["content"].startswith(
+        "The command exited before reading all of its input"
+    )
+
+
+def test_execute_interactive_shell_crossplatform_feeds_stdin_data() -> None:
+    """Test that stdin_data replaces the user's input and is followed by EOF."""
+    is_commands = InteractiveShellCommands(default_timeout_seconds=10, headless=True)
+    conversation = is_commands.execute_interactive_shell_crossplatform(
+        "read answer; echo got $answer; cat | wc -l", stdin_data="yes\nmore\n"
+    )
+
+    assert conversation == [
+        {"role": "user", "content": "[9 bytes of input]"},
+        {"role": "process", "content": "got yes 1"},
+    ]
@@ -0,0 +1,59 @@
+"""
+Tests for the command metrics.
+"""
+import json
+import sys
+
+import pytest
+
+from .interactive_shell_commands import InteractiveShellCommands
+from .metrics import CommandMetrics, JsonLinesMetricsSink
+
+
+def test_command_metrics_accounting() -> None:
+    """Test that chunks, output latency and time waiting on the user are recorded."""
+    metrics = CommandMetrics("cat", "linux")
+    metrics.spawned()
+    metrics.add_chunk("process", 10)
+    metrics.add_chunk("process", 5)
+    metrics.add_chunk("user", 2)
+    metrics.add_chunk("error", 3)
+    metrics.finish(0)
+
+    assert metrics.bytes_by_role == {"process": 15, "user": 2, "error": 3}
+    assert metrics.chunks_by_role == {"process": 2, "user": 1, "error": 1}
+    assert 0 <= metrics.spawn_seconds <= metrics.first_output_seconds
+    assert metrics.waiting_on_user_seconds >= 0
+    assert metrics.wall_seconds >= metrics.first_output_seconds
+    assert "exit code 0" in metrics.summary()
+
+
+def test_json_lines_metrics_sink(tmp_path) -> None:
+    """Test that each command's metrics are appended as one JSON line."""
+    path = tmp_path / "metrics.jsonl"
+    sink = JsonLinesMetricsSink(str(path))
+    for exit_code in (0, 1):
+        metrics = CommandMetrics("false", "linux")
+        metrics.finish(exit_code)
+        sink(metrics)
+
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [record["exit_code"] for record in records] == [0, 1]
+    assert records[0]["command_line"] == "false"
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="select() needs POSIX pipes")
+def test_metrics_are_emitted_per_command(idle_stdin) -> None:
+    """Test that every command sends its metrics to the sink, including timeouts."""
+    records = []
+    is_commands = InteractiveShellCommands(
+        default_timeout_seconds=10, metrics_sink=records.append
+    )
+    is_commands.execute_interactive_shell_linux("echo hello; echo oops >&2; exit 3")
+    is_commands.execute_interactive_shell_linux("sleep 30", timeout_seconds=0.5)
+
+    assert records[0].bytes_by_role == {"process": 6, "error": 5}
+    assert records[0].exit_code == 3
+    assert records[0].timeout is None
+    assert records[1].timeout == "deadline"
+    assert records[1].exit_code < 0
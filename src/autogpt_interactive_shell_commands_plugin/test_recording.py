@@ -0,0 +1,121 @@
+"""
+Tests for the session recordings and their replay.
+"""
+import os
+import sys
+import time
+
+import pytest
+
+from .capture import ConversationCapture
+from .interactive_shell_commands import InteractiveShellCommands
+from .recording import MAGIC, Recording, RecordingWriter, replay
+
+
+def write_recording(path, chunks, metadata=None) -> None:
+    with RecordingWriter(open(path, "wb"), metadata) as writer:
+        for timestamp, role, data in chunks:
+            writer.record(role, data, timestamp)
+
+
+def test_recording_round_trip(tmp_path) -> None:
+    """Test that chunks are read back with their roles, data and timing."""
+    path = tmp_path / "session.shrec"
+    write_recording(
+        path,
+        [
+            (100.0, "process", b"Continue? "),
+            (101.5, "user", b"y\n"),
+            (101.75, "error", "caf\xc3".encode("latin-1")),
+            (101.75, "process", b""),
+        ],
+        {"command_line": "./install.sh"},
+    )
+
+    recording = Recording.load(path)
+    assert recording.metadata == {"command_line": "./install.sh"}
+    assert recording.chunks == [
+        (0.0, "process", b"Continue? "),
+        (1.5, "user", b"y\n"),
+        (1.75, "error", b"caf\xc3"),
+        (1.75, "process", b""),
+    ]
+    assert recording.size == 16 and recording.duration == 1.75
+
+
+def test_replay_keeps_messages_apart(tmp_path) -> None:
+    """Test that the messages of the plugin are replayed as events of their own."""
+    path = tmp_path / "session.shrec"
+    write_recording(
+        path,
+        [
+            (0.0, "error", b"warn\n"),
+            (0.01, "error", "Timeout after 1 seconds"),
+        ],
+    )
+
+    recording = Recording.load(path)
+    assert recording.chunks[1] == (0.01, "error", "Timeout after 1 seconds")
+    assert replay(recording) == [
+        {"role": "error", "content": "warn"},
+        {"role": "error", "content": "Timeout after 1 seconds"},
+    ]
+
+
+def test_recording_rejects_other_files(tmp_path) -> None:
+    """Test that files that are not, or no longer, recordings are refused."""
+    (tmp_path / "other").write_bytes(b"hello")
+    with pytest.raises(ValueError, match="not a shell recording"):
+        Recording.load(tmp_path / "other")
+
+    write_recording(tmp_path / "cut", [(0.0, "process", b"hello")])
+    data = (tmp_path / "cut").read_bytes()
+    assert data.startswith(MAGIC)
+    (tmp_path / "cut").write_bytes(data[:-1])
+    with pytest.raises(ValueError, match="truncated"):
+        Recording.load(tmp_path / "cut")
+
+
+def test_replay_is_deterministic(tmp_path) -> None:
+    """Test that replays coalesce chunks by their recorded timing, at any speed."""
+    path = tmp_path / "session.shrec"
+    write_recording(
+        path,
+        [
+            (0.0, "process", b"step 1\n"),
+            (0.1, "process", b"step 2\n"),
+            (0.6, "process", b"step 3\n"),
+        ],
+    )
+    recording = Recording.load(path)
+    expected = [
+        {"role": "process", "content": "step 1 step 2"},
+        {"role": "process", "content": "step 3"},
+    ]
+
+    assert replay(recording) == expected
+    started = time.monotonic()
+    assert replay(recording, ConversationCapture(), realtime=True, speed=2) == expected
+    assert 0.3 <= time.monotonic() - started < 1
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="select() needs POSIX pipes")
+def test_execute_interactive_shell_records_commands(idle_stdin, tmp_path) -> None:
+    """Test that a recorded command replays into the same conversation."""
+    is_commands = InteractiveShellCommands(
+        default_timeout_seconds=10,
+        max_capture_bytes=64,
+        recording_dir=str(tmp_path),
+        headless=True,
+    )
+    command_line = "printf '50%%\\r100%%\\n'; seq 100; sleep 0.5; echo two >&2"
+    conversation = is_commands.execute_interactive_shell_linux(command_line)
+
+    (name,) = os.listdir(tmp_path)
+    recording = Recording.load(tmp_path / name)
+    assert recording.metadata["command_line"] == command_line
+    assert recording.metadata["engine"] == "linux"
+    assert recording.metadata["capture"]["max_bytes"] == 64
+    # The conversation is compacted and cut the same way, with no settings given
+    assert conversation[0]["content"].startswith("100% 1 2")
+    assert replay(recording) == conversation
@@ -0,0 +1,98 @@
+"""
+Tests for the resource accounting and limits.
+"""
+import os
+import signal
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+from .engine import SelectorEngine, ShellProcess
+from .interactive_shell_commands import InteractiveShellCommands
+from .resources import ResourceLimits, ResourceUsage, limit_exceeded
+from .spawn import POSIX_SPAWN_BACKEND, SpawnedProcess
+
+pytestmark = pytest.mark.skipif(
+    sys.platform == "win32", reason="resource limits need POSIX"
+)
+
+
+def test_resource_usage_from_rusage() -> None:
+    """Test that the usage reported by wait4() is summarized."""
+    usage = ResourceUsage.from_rusage(
+        SimpleNamespace(
+            ru_utime=1.5,
+            ru_stime=0.25,
+            ru_maxrss=20 * 1024 * (1024 if sys.platform == "darwin" else 1),
+            ru_inblock=8,
+            ru_oublock=16,
+            ru_nvcsw=3,
+            ru_nivcsw=4,
+        )
+    )
+
+    assert usage.max_rss_kib == 20 * 1024
+    assert usage.to_dict()["block_writes"] == 16
+    assert usage.summary() == "cpu 1.50s user 0.25s sys, max rss 20.0 MiB"
+
+
+def test_limit_exceeded() -> None:
+    """Test that the signals of the limits are recognized, from the shell or not."""
+    assert limit_exceeded(-signal.SIGXCPU) == "CPU time"
+    assert limit_exceeded(128 + signal.SIGXFSZ) == "file size"
+    assert limit_exceeded(0) is None
+    assert limit_exceeded(None) is None
+    assert not ResourceLimits()
+    assert ResourceLimits(open_files=64)
+
+
+def test_shell_prefix() -> None:
+    """Test that the limits are set by ulimit, in the units of the POSIX shell."""
+    import resource
+
+    limits = ResourceLimits(cpu_seconds=5, file_size_bytes=4096)
+    assert ResourceLimits().shell_prefix() == ""
+    if resource.getrlimit(resource.RLIMIT_CPU)[1] == resource.RLIM_INFINITY:
+        assert limits.shell_prefix() == (
+            "ulimit -t 6 && ulimit -S -t 5 && ulimit -f 8 || exit 1; "
+        )
+
+
+@pytest.mark.parametrize("backend", ["popen", POSIX_SPAWN_BACKEND])
+def test_shell_process_reports_usage_and_applies_limits(idle_stdin, backend) -> None:
+    """Test that a reaped command has its usage, and runs within its limits."""
+    engine = SelectorEngine()
+    shell = ShellProcess(
+        engine,
+        "ulimit -n; ulimit -f",
+        limits=ResourceLimits(open_files=64),
+        spawn_backend=backend,
+    )
+    if backend == POSIX_SPAWN_BACKEND:
+        # Limits no longer need fork(), so the backend is kept
+        assert isinstance(shell.process, SpawnedProcess)
+    while not shell.done:
+        engine.poll(1)
+    assert shell.wait(10) == 0
+    shell.close()
+    engine.close()
+
+    assert b"".join(data for _, data in shell.chunks).split()[0] == b"64"
+    assert shell.usage is not None and shell.usage.max_rss_kib > 0
+
+
+def test_execute_interactive_shell_linux_file_size_limit(idle_stdin, tmp_path) -> None:
+    """Test that a command writing past the file size limit is stopped and said so."""
+    is_commands = InteractiveShellCommands(
+        default_timeout_seconds=10,
+        resource_limits=ResourceLimits(file_size_bytes=4096),
+    )
+    conversation = is_commands.execute_interactive_shell_linux(
+        f"head -c 100000 /dev/zero > {tmp_path / 'big'}"
+    )
+
+    # After the shell's own message, if any
+    assert conversation[-1]["role"] == "error"
+    assert conversation[-1]["content"].endswith("Stopped by the file size limit")
+    assert os.path.getsize(tmp_path / "big") == 4096
@@ -0,0 +1,111 @@
+"""
+Tests for the auto-responder.
+"""
+import json
+import os
+import sys
+from unittest.mock import patch
+
+import pytest
+
+from . import AutoGPTInteractiveShellCommandsPlugin
+from .interactive_shell_commands import InteractiveShellCommands
+from .responder import AutoResponder
+
+# Asks twice, then prints what it was told
+PROMPTING_COMMAND = (
+    "printf 'Proceed? [Y/n] '; read a; printf 'Overwrite file? '; read b; "
+    'echo "got $a $b"'
+)
+
+RULES = [(r"\[Y/n\] $", "y\n"), (r"(?i:overwrite .*\? )$", "no\n")]
+
+
+def test_matcher_answers_prompts_split_across_chunks() -> None:
+    """Test that a prompt split across reads is answered once, by the first rule."""
+    matcher = AutoResponder(RULES + [(r"\[Y/n\]", "ignored\n")]).matcher()
+    assert matcher.feed("process", b"Proceed? [Y") == []
+    assert matcher.feed("process", b"/n] ") == [b"y\n"]
+    assert matcher.feed("process", b"\n") == []
+    assert matcher.feed("error", b"OVERWRITE it? ") == [b"no\n"]
+
+
+def test_matcher_window_is_bounded() -> None:
+    """Test that only the last window_bytes of output are kept."""
+    matcher = AutoResponder([("abc", "x")], window_bytes=8).matcher()
+    matcher.feed("process", b"a" * 100)
+    assert len(matcher._windows["process"]) == 8
+    assert matcher.feed("process", b"bc") == [b"x"]
+    assert AutoResponder([]).matcher().feed("process", b"anything") == []
+
+
+def test_rules_with_global_flags_or_groups() -> None:
+    """Test that leading flags and backreferences keep working among other rules."""
+    matcher = AutoResponder(
+        [
+            (r"\[Y/n\] $", "y\n"),
+            (r"(?i)proceed\?", "yes\n"),
+            (r"(['\"])continue\1\? $", "c\n"),
+            (r"(?P<word>\w+) or (?P=word)\? $", "both\n"),
+        ]
+    ).matcher()
+    assert matcher.feed("process", b"PROCEED? ") == [b"yes\n"]
+    assert matcher.feed("process", b"'continue'? ") == [b"c\n"]
+    assert matcher.feed("process", b"'continue\"? ") == []
+    assert matcher.feed("process", b"\nthis or this? ") == [b"both\n"]
+    assert matcher.feed("process", b"\nProceed? [Y/n] ") == [b"yes\n", b"y\n"]
+
+
+def test_invalid_rule_is_named() -> None:
+    """Test that an invalid pattern is reported with its rule."""
+    with pytest.raises(ValueError, match=r"rule 2 \('\(unclosed'\)"):
+        AutoResponder([("ok", "y\n"), ("(unclosed", "n\n")])
+
+
+def test_plugin_survives_invalid_rules(monkeypatch, tmp_path) -> None:
+    """Test that the commands are still available when the rules can't be loaded."""
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps([{"pattern": "(unclosed", "response": "n\n"}]))
+    # The plugin is a singleton, already initialized by the other tests
+    plugin = AutoGPTInteractiveShellCommandsPlugin()
+    monkeypatch.setattr(plugin, "_auto_responses_file", str(path))
+    monkeypatch.setattr(plugin, "_is_commands", None)
+    monkeypatch.setattr(plugin, "_auto_responder", None)
+
+    assert plugin._get_interactive_shell_commands()._auto_responder is None
+
+
+def test_from_file(tmp_path) -> None:
+    """Test loading the rules from a JSON file."""
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps([{"pattern": "License\\?", "response": "accept\n"}]))
+    responder = AutoResponder.from_file(str(path))
+    assert len(responder) == 1
+    assert responder.matcher().feed("process", b"Accept the License?") == [b"accept\n"]
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="select() needs POSIX pipes")
+def test_linux_engine_answers_prompts(idle_stdin) -> None:
+    """Test that matching prompts are answered without the user."""
+    is_commands = InteractiveShellCommands(
+        default_timeout_seconds=10, auto_responder=AutoResponder(RULES)
+    )
+    conversation = is_commands.execute_interactive_shell_linux(PROMPTING_COMMAND)
+    assert conversation[-1] == {"role": "process", "content": "got y no"}
+    assert {"role": "user", "content": "y"} in conversation
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="sh syntax in the command")
+def test_crossplatform_engine_answers_prompts() -> None:
+    """Test that the user is only asked when no rule matches."""
+    is_commands = InteractiveShellCommands(
+        default_timeout_seconds=10, auto_responder=AutoResponder(RULES[:1])
+    )
+    read_fd, write_fd = os.pipe()
+    os.write(write_fd, b"maybe\n")
+    os.close(write_fd)
+    with open(read_fd, "rb") as stdin, patch("sys.stdin", stdin):
+        conversation = is_commands.execute_interactive_shell_crossplatform(
+            PROMPTING_COMMAND
+        )
+    assert conversation[-1] == {"role": "process", "content": "got y maybe"}
@@ -0,0 +1,83 @@
+"""
+Tests for the persistent shell sessions.
+"""
+import sys
+
+import pytest
+
+pytestmark = pytest.mark.skipif(
+    sys.platform == "win32", reason="shell sessions need a POSIX terminal"
+)
+
+
+@pytest.fixture
+def manager():
+    from .sessions import ShellSessionManager
+
+    manager = ShellSessionManager()
+    yield manager
+    manager.close_all()
+
+
+def _run(session, command_line: str, timeout_seconds: float = 10) -> tuple[bytes, int]:
+    output = session.run(command_line, timeout_seconds)
+    data = b""
+    try:
+        while True:
+            data += next(output)
+    except StopIteration as stop:
+        return data, stop.value
+
+
+def test_session_keeps_state_between_commands(manager) -> None:
+    """Test that the working directory and variables survive between commands."""
+    session = manager.get("work")
+    assert _run(session, "cd /tmp; export GREETING=hello") == (b"", 0)
+    assert _run(session, 'echo "$GREETING from $(pwd)"') == (b"hello from /tmp\r\n", 0)
+    assert _run(session, "false") == (b"", 1)
+    assert manager.get("work") is session
+
+
+def test_session_timeout_closes_the_session(manager) -> None:
+    """Test that a command that does not finish in time stops its session."""
+    from .sessions import SessionTimeout
+
+    session = manager.get("slow")
+    with pytest.raises(SessionTimeout):
+        _run(session, "sleep 30", timeout_seconds=0.5)
+
+    assert not session.alive
+    assert manager.reap_idle() == ["slow"]
+
+
+def test_idle_sessions_are_reaped() -> None:
+    """Test that sessions unused for too long are closed."""
+    from .sessions import ShellSessionManager
+
+    manager = ShellSessionManager(idle_seconds=0.01)
+    session = manager.get("idle")
+    session.last_used -= 1
+
+    assert manager.reap_idle() == ["idle"]
+    assert not session.alive
+    assert manager.names == []
+
+
+def test_sentinel_survives_trailing_comments(manager) -> None:
+    """Test that a comment at the end of a command does not hide the sentinel."""
+    session = manager.get("comment")
+    assert _run(session, "echo hi # and the rest") == (b"hi\r\n", 0)
+
+
+def test_send_drives_a_repl(manager) -> None:
+    """Test that input reaches a program started in the session, until it exits."""
+    session = manager.get("repl")
+
+    def send(text: str) -> bytes:
+        output = session.send(text, timeout_seconds=10)
+        return b"".join(output)
+
+    send(f"{sys.executable} -q -i -c ''")
+    assert b"42" in send("6 * 7")
+    send("exit()")
+    assert _run(session, "echo back") == (b"back\r\n", 0)
@@ -0,0 +1,73 @@
+"""
+Tests for the raw shell logs.
+"""
+import os
+
+from .shell_logs import RawCapture, ShellLogStore
+
+
+def test_raw_capture_events_point_to_the_bytes() -> None:
+    """Test that consecutive chunks of a role share an event, decoded on demand."""
+    log = RawCapture()
+    log.append("process", b"hello\n")
+    log.append("process", b"world\n")
+    log.append("error", "café\n".encode())
+    log.append("process", b"")
+
+    assert list(log.events()) == [("process", 0, 12), ("error", 12, 6)]
+    assert log.path is None
+    assert log.read(6, 5) == b"world"
+    assert log.slice(6, 100) == [
+        {"role": "process", "content": "world"},
+        {"role": "error", "content": "café"},
+    ]
+
+
+def test_raw_capture_spills_to_a_file(tmp_path) -> None:
+    """Test that large logs are moved to a file, read through a memory map."""
+    log = RawCapture(spill_bytes=16, directory=str(tmp_path))
+    log.append("process", b"line 1\nline 2\n")
+    assert log.path is None
+    log.append("process", b"line 3\n")
+    path = log.path
+    assert os.path.dirname(path) == str(tmp_path)
+    log.append("error", b"failed at line 3\n")
+
+    assert log.size == 38
+    assert log.grep(r"line [23]") == [
+        {"role": "process", "offset": 7, "line": "line 2"},
+        {"role": "process", "offset": 14, "line": "line 3"},
+        {"role": "error", "offset": 21, "line": "failed at line 3"},
+    ]
+    assert log.grep("line", max_matches=1) == [
+        {"role": "process", "offset": 0, "line": "line 1"}
+    ]
+    log.close()
+    assert not os.path.exists(path)
+
+
+def test_grep_finds_events_starting_mid_line() -> None:
+    """Test that an answer typed after a prompt is found, with its own role."""
+    log = RawCapture()
+    log.append("process", b"Enter name: ")
+    log.append("user", b"bob\n")
+    log.append("process", b"Hello bob\n")
+
+    assert log.grep("bob") == [
+        {"role": "user", "offset": 12, "line": "bob"},
+        {"role": "process", "offset": 16, "line": "Hello bob"},
+    ]
+
+
+def test_shell_log_store_keeps_the_last_logs(tmp_path) -> None:
+    """Test that the oldest logs are deleted, with their spill files."""
+    store = ShellLogStore(max_logs=2, spill_bytes=0, directory=str(tmp_path))
+    first_id, first = store.new()
+    first.append("process", b"first")
+    store.new()
+    third_id, _ = store.new()
+
+    assert store.get(first_id) is None
+    assert third_id == first_id + 2 and store.get(third_id) is not None
+    assert os.listdir(tmp_path) == []
+    store.close_all()
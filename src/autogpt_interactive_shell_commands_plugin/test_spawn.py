@@ -0,0 +1,68 @@
+"""
+Tests for the spawn backends.
+"""
+import shutil
+import sys
+
+import pytest
+
+from .engine import SelectorEngine, ShellProcess
+from .interactive_shell_commands import InteractiveShellCommands
+from .spawn import POSIX_SPAWN_BACKEND, SpawnedProcess, split_command
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="posix_spawn is POSIX")
+
+
+def test_split_command() -> None:
+    """Test that only plain command lines of programs skip the shell."""
+    assert split_command("ls -la 'my dir'") == [shutil.which("ls"), "-la", "my dir"]
+    for command_line in [
+        "ls *.py",
+        "echo $HOME",
+        "cat < file",
+        "cd /tmp",
+        "FOO=1 env",
+        "echo 'unbalanced",
+        "no-such-program-here",
+        "",
+    ]:
+        assert split_command(command_line) is None, command_line
+
+
+def test_spawned_process_has_its_own_session(idle_stdin) -> None:
+    """Test that a spawned process gets the pipes, and leads its own session."""
+    engine = SelectorEngine()
+    shell = ShellProcess(
+        engine,
+        "ps -o sid= -p $$; echo oops >&2; exit 3",
+        spawn_backend=POSIX_SPAWN_BACKEND,
+    )
+    while not shell.done:
+        engine.poll(1)
+    assert shell.wait(10) == 3
+    shell.close()
+    engine.close()
+
+    assert isinstance(shell.process, SpawnedProcess)
+    assert ("error", b"oops\n") in shell.chunks
+    output = b"".join(data for role, data in shell.chunks if role == "process")
+    assert int(output) == shell.process.pid
+    assert shell.usage is not None
+
+
+def test_execute_interactive_shell_linux_with_posix_spawn(idle_stdin) -> None:
+    """Test that commands run the same, with or without the shell."""
+    is_commands = InteractiveShellCommands(
+        default_timeout_seconds=1, spawn_backend=POSIX_SPAWN_BACKEND
+    )
+
+    assert is_commands.execute_interactive_shell_linux("echo 'a  b' c") == [
+        {"role": "process", "content": "a b c"}
+    ]
+    assert is_commands.execute_interactive_shell_linux("echo $((1 + 2))") == [
+        {"role": "process", "content": "3"}
+    ]
+    assert is_commands.execute_interactive_shell_linux("sleep 5")[-1] == {
+        "role": "error",
+        "content": "Timeout after 1 seconds",
+    }